@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+""" Compares insert throughput and primary key index size for ``IDField``'s
+    default (time + random) IDs and ``MonotonicIDGenerator`` IDs.
+
+    Usage::
+
+        $ python benchmarks/idfield_insert.py [--rows 200000] [--batch 1000]
+        $ python benchmarks/idfield_insert.py --postgres "dbname=bench"
+
+    Rows are inserted in batches (one transaction per batch) into a table with
+    a ``CHAR(12)`` primary key. With SQLite the index size is the number of
+    pages in the database file; with PostgreSQL (which requires ``psycopg2``)
+    it is ``pg_relation_size`` of the primary key index.
+"""
+
+import os
+import sys
+import time
+import tempfile
+import sqlite3
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from django.conf import settings
+if not settings.configured:
+    settings.configure()
+
+from dwdj.fields import IDField, MonotonicIDGenerator
+
+
+def default_ids(count):
+    # One at a time, the way ``pre_save`` mints them. A batch is minted in
+    # well under a second, so its IDs share a timestamp and are effectively
+    # in random order.
+    return [IDField.new() for _ in xrange(count)]
+
+
+GENERATORS = [
+    ("default", default_ids),
+    ("monotonic", MonotonicIDGenerator(worker_id=1).new_many),
+]
+
+
+def bench_sqlite(name, generator, options):
+    fd, path = tempfile.mkstemp(suffix=".sqlite3")
+    os.close(fd)
+    try:
+        cxn = sqlite3.connect(path)
+        cxn.execute("CREATE TABLE bench (id CHAR(12) PRIMARY KEY, n INTEGER)")
+        elapsed = run_inserts(cxn, "?", generator, options)
+        page_size = cxn.execute("PRAGMA page_size").fetchone()[0]
+        page_count = cxn.execute("PRAGMA page_count").fetchone()[0]
+        cxn.close()
+        return elapsed, page_size * page_count
+    finally:
+        os.unlink(path)
+
+
+def bench_postgres(name, generator, options):
+    import psycopg2
+    cxn = psycopg2.connect(options.postgres)
+    cur = cxn.cursor()
+    cur.execute("DROP TABLE IF EXISTS dwdj_idfield_bench")
+    cur.execute("CREATE TABLE dwdj_idfield_bench "
+                "(id CHAR(12) PRIMARY KEY, n INTEGER)")
+    cxn.commit()
+    elapsed = run_inserts(cxn, "%s", generator, options,
+                          table="dwdj_idfield_bench")
+    cur.execute("SELECT pg_relation_size('dwdj_idfield_bench_pkey')")
+    size = cur.fetchone()[0]
+    cur.execute("DROP TABLE dwdj_idfield_bench")
+    cxn.commit()
+    cxn.close()
+    return elapsed, size
+
+
+def run_inserts(cxn, param, generator, options, table="bench"):
+    sql = "INSERT INTO %s (id, n) VALUES (%s, %s)" %(table, param, param)
+    elapsed = 0.0
+    for start in xrange(0, options.rows, options.batch):
+        ids = generator(options.batch)
+        rows = [(id, start + i) for (i, id) in enumerate(ids)]
+        batch_start = time.time()
+        cur = cxn.cursor()
+        cur.executemany(sql, rows)
+        cxn.commit()
+        elapsed += time.time() - batch_start
+    return elapsed
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option("--rows", type="int", default=200000)
+    parser.add_option("--batch", type="int", default=1000)
+    parser.add_option("--postgres", help="psycopg2 DSN (default: use SQLite)")
+    options, args = parser.parse_args()
+    bench = bench_postgres if options.postgres else bench_sqlite
+    print "%-10s %12s %14s" %("generator", "rows/sec", "index bytes")
+    for name, generator in GENERATORS:
+        elapsed, size = bench(name, generator, options)
+        print "%-10s %12.0f %14s" %(name, options.rows / elapsed, size)
+
+
+if __name__ == "__main__":
+    main()
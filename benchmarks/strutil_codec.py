@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+""" Micro-benchmarks for ``dwdj.strutil.BaseCodec`` against ``to_base``,
+    ``to36`` and ``from36``.
+
+    Usage::
+
+        $ python benchmarks/strutil_codec.py [--count 100000]
+"""
+
+import os
+import sys
+import random
+import timeit
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from dwdj import strutil
+from dwdj.strutil import BaseCodec, BASE36_ALPHABET
+
+BASE62_ALPHABET = BASE36_ALPHABET + "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+
+
+def get_benchmarks(numbers):
+    b36 = strutil.base36
+    b36_padded = BaseCodec(BASE36_ALPHABET, width=13)
+    b62 = BaseCodec(BASE62_ALPHABET)
+    encoded36 = [strutil.to36(n) for n in numbers]
+    encoded62 = [strutil.to_base(n, BASE62_ALPHABET) for n in numbers]
+    benchmarks = [
+        ("to36", lambda: [strutil.to36(n) for n in numbers]),
+        ("base36.encode", lambda: [b36.encode(n) for n in numbers]),
+        ("base36.encode_many", lambda: list(b36.encode_many(numbers))),
+        ("base36 width=13", lambda: list(b36_padded.encode_many(numbers))),
+        ("to_base(62)", lambda: [
+            strutil.to_base(n, BASE62_ALPHABET) for n in numbers
+        ]),
+        ("base62.encode_many", lambda: list(b62.encode_many(numbers))),
+        ("from36", lambda: [strutil.from36(s) for s in encoded36]),
+        ("base36.decode_many", lambda: list(b36.decode_many(encoded36))),
+        ("base62.decode_many", lambda: list(b62.decode_many(encoded62))),
+    ]
+    if strutil.numpy is not None:
+        array = strutil.numpy.array(numbers, dtype=strutil.numpy.uint64)
+        benchmarks.append(
+            ("base36.encode_many(numpy)", lambda: list(b36.encode_many(array))),
+        )
+    return benchmarks
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option("--count", type="int", default=100000)
+    parser.add_option("--repeat", type="int", default=3)
+    options, args = parser.parse_args()
+    numbers = [random.getrandbits(62) for _ in xrange(options.count)]
+    print "%-28s %12s" %("benchmark", "ns/item")
+    for name, func in get_benchmarks(numbers):
+        best = min(timeit.repeat(func, number=1, repeat=options.repeat))
+        print "%-28s %12.0f" %(name, best / options.count * 1e9)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+""" Compares the per-item cost of ``to_str``/``to_unicode`` with
+    ``to_str_many``/``to_unicode_many`` on a mix of ``str``, ``unicode``,
+    exception and ``int`` inputs.
+
+    Usage::
+
+        $ python benchmarks/strutil_text.py [--count 100000]
+"""
+
+import os
+import sys
+import timeit
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from dwdj.strutil import to_str, to_unicode, to_str_many, to_unicode_many
+
+
+def get_inputs(count):
+    samples = [
+        "plain str",
+        "\xe1\x88\xb4 utf-8 str",
+        "\xff latin1 str",
+        u"unicode \u1234",
+        Exception(u"error \u1234"),
+        42,
+    ]
+    return [samples[i % len(samples)] for i in xrange(count)]
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option("--count", type="int", default=100000)
+    parser.add_option("--repeat", type="int", default=3)
+    options, args = parser.parse_args()
+    inputs = get_inputs(options.count)
+    benchmarks = [
+        ("to_str", lambda: [to_str(x) for x in inputs]),
+        ("to_str_many", lambda: list(to_str_many(inputs))),
+        ("to_unicode", lambda: [to_unicode(x) for x in inputs]),
+        ("to_unicode_many", lambda: list(to_unicode_many(inputs))),
+    ]
+    print "%-20s %12s" %("benchmark", "ns/item")
+    for name, func in benchmarks:
+        best = min(timeit.repeat(func, number=1, repeat=options.repeat))
+        print "%-20s %12.0f" %(name, best / options.count * 1e9)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,858 @@
+import os
+import sys
+import atexit
+import logging
+import math
+import bisect
+import hashlib
+import time
+import zlib
+import random
+import marshal
+import threading
+import socket
+import cPickle as pickle
+from itertools import islice
+from collections import OrderedDict, namedtuple
+from multiprocessing.pool import ThreadPool
+
+from django.dispatch import Signal
+try:
+    from django.core.cache.backends.base import DEFAULT_TIMEOUT
+except ImportError:
+    # Before Django 1.6, ``None`` meant "use the default timeout"
+    DEFAULT_TIMEOUT = None
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+log = logging.getLogger(__name__)
+
+_missing = object()
+
+# Sent by ``SwappableCache.report_stats`` with a ``CacheStats.snapshot()``
+signal_cache_stats = Signal(providing_args=["stats"])
+
+# The value stored by ``SwappableCache.get_or_set``: ``fresh_until`` is the
+# (unix) time after which the value is stale and ``delta`` is the number of
+# seconds it took to compute.
+CachedValue = namedtuple("CachedValue", "value fresh_until delta")
+
+# The value stored by ``SwappableCache.set(..., tags=[...])``: ``tags`` is a
+# tuple of ``(tag, tag_version)`` pairs.
+TaggedValue = namedtuple("TaggedValue", "value tags")
+
+
+def _cached_value(value):
+    """ Returns ``value`` if it's a ``CachedValue``, otherwise ``None`` (so
+        values written by something other than ``get_or_set`` are misses). """
+    return value if isinstance(value, CachedValue) else None
+
+
+class LocalLRUCache(object):
+    """ A small, thread safe, process-local LRU cache where each entry expires
+        after ``timeout`` seconds. Used by ``SwappableCache`` as an "L1" cache
+        in front of the true backend.
+
+        Entries are evicted (least recently used first) when there are more
+        than ``max_entries`` of them, or when the approximate total size (as
+        reported by ``sys.getsizeof``) exceeds ``max_bytes``.
+
+        Note that values are returned as-is (they are not copied), so callers
+        must not mutate values they get from the cache.
+
+        >>> l1 = LocalLRUCache(max_entries=2)
+        >>> l1.set("a", 1); l1.set("b", 2); l1.set("c", 3)
+        >>> l1.get("a", "missing")
+        'missing'
+        >>> l1.get("c")
+        3
+        >>> sorted(l1.stats().items())
+        [('entries', 2), ('evictions', 1), ('hits', 1), ('misses', 1), ('size', ...)]
+    """
+
+    def __init__(self, max_entries=1000, timeout=5, max_bytes=None):
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._size = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is None or entry[0] < time.time():
+                if entry is not None:
+                    self._size -= entry[2]
+                self.misses += 1
+                return default
+            self._data[key] = entry
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, timeout=None):
+        if timeout is None or timeout > self.timeout:
+            timeout = self.timeout
+        if timeout <= 0:
+            self.delete(key)
+            return
+        size = self.max_bytes and sys.getsizeof(value) or 0
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._size -= old[2]
+            self._data[key] = (time.time() + timeout, value, size)
+            self._size += size
+            while (len(self._data) > self.max_entries or
+                   (self.max_bytes and self._size > self.max_bytes)):
+                _, evicted = self._data.popitem(last=False)
+                self._size -= evicted[2]
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._size -= old[2]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._size = 0
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self._data),
+            "size": self._size,
+        }
+
+
+_PLAIN_SCALARS = set([str, unicode, int, long, float, bool, type(None)])
+_PLAIN_CONTAINERS = set([list, tuple])
+
+def _is_plain(value):
+    """ Returns ``True`` if ``value`` can be round-tripped through ``marshal``
+        without changing its type (``marshal`` will happily turn an
+        ``OrderedDict`` into a ``dict``). """
+    t = type(value)
+    if t in _PLAIN_SCALARS:
+        return True
+    if t in _PLAIN_CONTAINERS:
+        return all(_is_plain(x) for x in value)
+    if t is dict:
+        return all(_is_plain(k) and _is_plain(v) for (k, v) in value.iteritems())
+    return False
+
+
+class ValueCodec(object):
+    """ Serializes (and optionally compresses) cache values before they are
+        passed to the true backend. Used by ``SwappableCache`` when
+        ``OPTIONS["CODEC"]`` is set.
+
+        Plain data (``str``, ``int``, ``list``, ``dict``, etc) is serialized
+        with ``marshal`` (which is faster and more compact than ``pickle``)
+        when ``serializer="marshal"``, and everything else is pickled.
+        Payloads longer than ``compress_threshold`` bytes are compressed with
+        ``compressor`` (``"zlib"`` or ``"lzma"``, if available).
+
+        Each encoded value starts with a header recording how it was encoded,
+        so the codec settings can be changed on a live cluster: values written
+        with other settings (or without a codec at all) are still readable.
+        Integers are stored as-is so ``incr`` and ``decr`` continue to work.
+
+        >>> codec = ValueCodec(compress_threshold=10)
+        >>> encoded = codec.encode({"foo": "bar" * 100})
+        >>> encoded[:7]
+        '\\x00dwc1mz'
+        >>> codec.decode(encoded) == {"foo": "bar" * 100}
+        True
+        >>> codec.decode("not encoded")
+        'not encoded'
+        >>> codec.stats()["bytes_saved"] > 0
+        True
+    """
+
+    header_prefix = "\x00dwc1"
+
+    def __init__(self, serializer="marshal", compressor="zlib",
+                 compress_threshold=1024, compress_level=6):
+        if serializer not in ["marshal", "pickle"]:
+            raise ValueError("invalid serializer: %r" %(serializer, ))
+        if compressor not in ["zlib", "lzma", None]:
+            raise ValueError("invalid compressor: %r" %(compressor, ))
+        if compressor == "lzma" and lzma is None:
+            raise ValueError("lzma compression requires the 'backports.lzma' "
+                             "package")
+        self.serializer = serializer
+        self.compressor = compressor
+        self.compress_threshold = compress_threshold
+        self.compress_level = compress_level
+        self.encode_count = 0
+        self.decode_count = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.encode_time = 0.0
+        self.decode_time = 0.0
+
+    def encode(self, value):
+        if type(value) in (int, long):
+            return value
+        start = time.time()
+        if self.serializer == "marshal" and _is_plain(value):
+            flags = "m"
+            data = marshal.dumps(value)
+        else:
+            flags = "p"
+            data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        raw_len = len(data)
+        if self.compressor is not None and raw_len > self.compress_threshold:
+            if self.compressor == "zlib":
+                compressed = zlib.compress(data, self.compress_level)
+                compressed_flag = "z"
+            else:
+                compressed = lzma.compress(data, preset=self.compress_level)
+                compressed_flag = "x"
+            if len(compressed) < raw_len:
+                flags += compressed_flag
+                data = compressed
+        result = self.header_prefix + flags.ljust(2, "-") + data
+        self.encode_count += 1
+        self.bytes_in += raw_len
+        self.bytes_out += len(result)
+        self.encode_time += time.time() - start
+        return result
+
+    def decode(self, value):
+        if not (isinstance(value, str) and value.startswith(self.header_prefix)):
+            return value
+        start = time.time()
+        offset = len(self.header_prefix)
+        serializer, compressor = value[offset:offset + 2]
+        data = value[offset + 2:]
+        if compressor == "z":
+            data = zlib.decompress(data)
+        elif compressor == "x":
+            if lzma is None:
+                raise ValueError("can't decode lzma compressed cache value "
+                                 "(install 'backports.lzma')")
+            data = lzma.decompress(data)
+        if serializer == "m":
+            result = marshal.loads(data)
+        else:
+            result = pickle.loads(data)
+        self.decode_count += 1
+        self.decode_time += time.time() - start
+        return result
+
+    def stats(self):
+        return {
+            "encode_count": self.encode_count,
+            "decode_count": self.decode_count,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "bytes_saved": self.bytes_in - self.bytes_out,
+            "encode_time": self.encode_time,
+            "decode_time": self.decode_time,
+        }
+
+
+class ConsistentHashRing(object):
+    """ A consistent hash ring with ``vnodes`` virtual nodes per node, so
+        adding or removing a node only moves about ``1/len(nodes)`` of the
+        keys.
+
+        >>> ring = ConsistentHashRing(["a", "b", "c"])
+        >>> keys = ["key%s" %(i, ) for i in range(1000)]
+        >>> before = dict((k, ring.get_node(k)) for k in keys)
+        >>> ring.add_node("d")
+        >>> moved = [k for k in keys if ring.get_node(k) != before[k]]
+        >>> 150 < len(moved) < 350
+        True
+        >>> set(ring.get_node(k) for k in moved)
+        set(['d'])
+    """
+
+    def __init__(self, nodes=(), vnodes=160):
+        self.vnodes = vnodes
+        self._hashes = []
+        self._nodes = []
+        for node in nodes:
+            self.add_node(node)
+
+    def _hash(self, key):
+        return int(hashlib.md5(key).hexdigest()[:8], 16)
+
+    def add_node(self, node):
+        for i in range(self.vnodes):
+            h = self._hash("%s-%s" %(node, i))
+            idx = bisect.bisect(self._hashes, h)
+            self._hashes.insert(idx, h)
+            self._nodes.insert(idx, node)
+
+    def remove_node(self, node):
+        keep = [(h, n) for (h, n) in zip(self._hashes, self._nodes) if n != node]
+        self._hashes = [h for (h, _) in keep]
+        self._nodes = [n for (_, n) in keep]
+
+    def get_node(self, key):
+        if isinstance(key, unicode):
+            key = key.encode("utf-8")
+        elif not isinstance(key, str):
+            key = str(key)
+        idx = bisect.bisect(self._hashes, self._hash(key))
+        if idx == len(self._hashes):
+            idx = 0
+        return self._nodes[idx]
+
+
+class ShardedCache(object):
+    """ Distributes keys between several cache backends using a
+        ``ConsistentHashRing``. Multi-key operations are split per shard and,
+        when more than one shard is involved, issued concurrently from a small
+        thread pool.
+
+        ``backends`` is either a list of cache aliases or a dictionary of
+        ``{name: backend}`` (where each backend is a cache object or alias).
+        Keys are placed by shard name, so names must be the same in every
+        process (and stay the same across restarts) or keys will be looked
+        up on the wrong shard.
+
+        ``SwappableCache`` uses a ``ShardedCache`` when its ``LOCATION`` is a
+        list (or a ``;`` or ``,`` separated string) of aliases. """
+
+    def __init__(self, backends, vnodes=160, pool_size=None):
+        from django.core.cache import get_cache as django_get_cache
+        if not isinstance(backends, dict):
+            for backend in backends:
+                if not isinstance(backend, basestring):
+                    raise ValueError(
+                        "cache objects must be given stable names; use "
+                        "ShardedCache({name: backend, ...}) (got: %r)"
+                        %(backend, )
+                    )
+            backends = dict((alias, alias) for alias in backends)
+        self.backends = {}
+        for name, backend in backends.items():
+            if isinstance(backend, basestring):
+                backend = django_get_cache(backend)
+            self.backends[name] = backend
+        self.ring = ConsistentHashRing(self.backends, vnodes=vnodes)
+        self.pool_size = pool_size or len(self.backends)
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    def add_backend(self, alias, backend=None):
+        """ Adds a new shard; only about ``1/len(backends)`` of the keys will
+            move to it. """
+        from django.core.cache import get_cache as django_get_cache
+        self.backends[alias] = backend or django_get_cache(alias)
+        self.ring.add_node(alias)
+
+    def get_shard(self, key):
+        return self.backends[self.ring.get_node(key)]
+
+    def _group(self, keys):
+        groups = {}
+        for key in keys:
+            groups.setdefault(self.ring.get_node(key), []).append(key)
+        return groups
+
+    def _map(self, func, items):
+        if len(items) < 2:
+            return map(func, items)
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    self._pool = ThreadPool(self.pool_size)
+        return self._pool.map(func, items)
+
+    def get(self, key, default=None, version=None):
+        return self.get_shard(key).get(key, default, version=version)
+
+    def get_many(self, keys, version=None):
+        result = {}
+        for shard_result in self._map(
+            lambda (alias, shard_keys): (
+                self.backends[alias].get_many(shard_keys, version=version)
+            ),
+            self._group(keys).items(),
+        ):
+            result.update(shard_result)
+        return result
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None, **kwargs):
+        return self.get_shard(key).set(key, value, timeout, version=version,
+                                       **kwargs)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None, **kwargs):
+        return self.get_shard(key).add(key, value, timeout, version=version,
+                                       **kwargs)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None, **kwargs):
+        self._map(
+            lambda (alias, shard_keys): self.backends[alias].set_many(
+                dict((k, data[k]) for k in shard_keys), timeout,
+                version=version, **kwargs
+            ),
+            self._group(data).items(),
+        )
+
+    def delete(self, key, version=None):
+        return self.get_shard(key).delete(key, version=version)
+
+    def delete_many(self, keys, version=None):
+        self._map(
+            lambda (alias, shard_keys): (
+                self.backends[alias].delete_many(shard_keys, version=version)
+            ),
+            self._group(keys).items(),
+        )
+
+    def incr(self, key, delta=1, version=None):
+        return self.get_shard(key).incr(key, delta, version=version)
+
+    def decr(self, key, delta=1, version=None):
+        return self.get_shard(key).decr(key, delta, version=version)
+
+    def has_key(self, key, version=None):
+        return self.get_shard(key).has_key(key, version=version)
+
+    def __contains__(self, key):
+        return key in self.get_shard(key)
+
+    def clear(self):
+        for backend in self.backends.values():
+            backend.clear()
+
+    def __getattr__(self, attr):
+        # Other attributes (ex, ``default_timeout``) come from any one shard
+        if attr in ["backends", "_pool"]:
+            raise AttributeError(attr)
+        return getattr(next(self.backends.itervalues()), attr)
+
+
+def _value_size(value):
+    """ Returns the size of ``value`` if it's cheap to compute (ex, because
+        it's a string), otherwise ``None``. """
+    if isinstance(value, basestring):
+        return len(value)
+    return None
+
+
+class CacheStats(object):
+    """ Aggregates the count, hit ratio, value size and latency of cache
+        operations by key prefix (the part of the key before
+        ``prefix_separator``) and operation.
+
+        Latencies are recorded in a log-scale histogram (four buckets per
+        doubling, starting at one microsecond) so recording is just a couple
+        of dict increments. No locks are taken; under heavy concurrency a few
+        counts may be lost, which is fine for statistics.
+
+        >>> stats = CacheStats()
+        >>> stats.record("get", "user:1", 0.001, hit=True, size=100)
+        >>> stats.record("get", "user:2", 0.003, hit=False)
+        >>> summary = summarize_cache_stats(stats.snapshot())
+        >>> summary[0]["prefix"], summary[0]["op"], summary[0]["hit_ratio"]
+        ('user', 'get', 0.5)
+        >>> 0.9 < summary[0]["p50"] < 1.2
+        True
+    """
+
+    def __init__(self, prefix_separator=":"):
+        self.prefix_separator = prefix_separator
+        self.started = time.time()
+        self._entries = {}
+
+    def record(self, op, key, elapsed, hit=None, size=None):
+        if not isinstance(key, basestring):
+            key = str(key)
+        prefix = key.partition(self.prefix_separator)[0]
+        if prefix == key:
+            prefix = "-"
+        entry = self._entries.get((prefix, op))
+        if entry is None:
+            entry = self._entries.setdefault((prefix, op), {
+                "count": 0, "hits": 0, "misses": 0, "bytes": 0, "buckets": {},
+            })
+        entry["count"] += 1
+        if hit is not None:
+            entry["hits" if hit else "misses"] += 1
+        if size is not None:
+            entry["bytes"] += size
+        bucket = int(math.log(max(elapsed * 1000000, 1), 2) * 4)
+        buckets = entry["buckets"]
+        buckets[bucket] = buckets.get(bucket, 0) + 1
+
+    def snapshot(self, reset=False):
+        """ Returns a picklable copy of the stats, optionally resetting them.
+            """
+        entries = self._entries
+        if reset:
+            self._entries = {}
+            self.started = time.time()
+        return {
+            "started": self.started,
+            "entries": dict(
+                (key, dict(entry, buckets=dict(entry["buckets"])))
+                for (key, entry) in entries.items()
+            ),
+        }
+
+
+def _bucket_percentile(buckets, count, percentile):
+    target = count * percentile
+    seen = 0
+    for bucket in sorted(buckets):
+        seen += buckets[bucket]
+        if seen >= target:
+            # Return the upper bound of the bucket in milliseconds
+            return 2 ** ((bucket + 1) / 4.0) / 1000.0
+    return None
+
+
+def merge_cache_stats(snapshots):
+    """ Merges several ``CacheStats.snapshot()``s (ex, from different
+        processes) into one. """
+    merged = {}
+    started = None
+    for snapshot in snapshots:
+        started = min(started or snapshot["started"], snapshot["started"])
+        for key, entry in snapshot["entries"].items():
+            target = merged.setdefault(key, {
+                "count": 0, "hits": 0, "misses": 0, "bytes": 0, "buckets": {},
+            })
+            for field in ["count", "hits", "misses", "bytes"]:
+                target[field] += entry[field]
+            for bucket, count in entry["buckets"].items():
+                target["buckets"][bucket] = (
+                    target["buckets"].get(bucket, 0) + count
+                )
+    return {"started": started, "entries": merged}
+
+
+def summarize_cache_stats(snapshot):
+    """ Returns a list of dicts summarizing a ``CacheStats.snapshot()``,
+        sorted by count (descending). Latencies are in milliseconds. """
+    result = []
+    for (prefix, op), entry in snapshot["entries"].items():
+        count = entry["count"]
+        lookups = entry["hits"] + entry["misses"]
+        result.append({
+            "prefix": prefix,
+            "op": op,
+            "count": count,
+            "hit_ratio": float(entry["hits"]) / lookups if lookups else None,
+            "avg_bytes": entry["bytes"] / count if entry["bytes"] else None,
+            "p50": _bucket_percentile(entry["buckets"], count, 0.50),
+            "p95": _bucket_percentile(entry["buckets"], count, 0.95),
+            "p99": _bucket_percentile(entry["buckets"], count, 0.99),
+        })
+    result.sort(key=lambda x: -x["count"])
+    return result
+
+
+class WriteBehindQueue(object):
+    """ A bounded queue of pending ``set`` and ``delete`` operations which a
+        background thread writes to a cache backend in ``set_many`` and
+        ``delete_many`` batches of up to ``batch_size`` keys. Used by
+        ``SwappableCache`` when ``OPTIONS["WRITE_BEHIND"]`` is set.
+
+        Only the most recent operation on each key is kept, and operations
+        stay in the queue until they have been written, so ``get_pending``
+        can be used to make reads consistent with pending writes.
+
+        When more than ``max_size`` keys are pending, ``put`` blocks for up
+        to ``block_timeout`` seconds (or not at all, if ``block`` is
+        ``False``) before dropping the write and incrementing ``dropped``.
+        Note that a dropped write leaves the old value in the backend.
+
+        The queue is flushed at exit. """
+
+    def __init__(self, get_backend, max_size=10000, batch_size=100,
+                 block=True, block_timeout=1.0, linger=0.005):
+        self.get_backend = get_backend
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.block = block
+        self.block_timeout = block_timeout
+        self.linger = linger
+        self.queued = 0
+        self.written = 0
+        self.batches = 0
+        self.dropped = 0
+        self.errors = 0
+        self._pending = OrderedDict()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._pid = None
+
+    def put(self, op, key, version, value=None, timeout=DEFAULT_TIMEOUT,
+            backend=None):
+        """ Queues ``op`` (``"set"`` or ``"delete"``) on ``key``, returning
+            ``False`` if the queue was full and the write was dropped. The
+            write goes to ``backend``, or ``get_backend()`` if it's ``None``.
+            """
+        vkey = (key, version)
+        with self._cond:
+            if vkey not in self._pending and len(self._pending) >= self.max_size:
+                if self.block:
+                    deadline = time.time() + self.block_timeout
+                    while len(self._pending) >= self.max_size:
+                        remaining = deadline - time.time()
+                        if remaining <= 0:
+                            break
+                        self._cond.wait(remaining)
+                if len(self._pending) >= self.max_size:
+                    self.dropped += 1
+                    return False
+            self._pending.pop(vkey, None)
+            self._pending[vkey] = (op, value, timeout, backend)
+            self.queued += 1
+            if self._pid != os.getpid():
+                self._start()
+            self._cond.notify_all()
+        return True
+
+    def get_pending(self, key, version):
+        """ Returns the pending ``(op, value, timeout)`` for ``key``, or
+            ``None`` if there are no pending writes to ``key``. """
+        entry = self._pending.get((key, version))
+        return entry and entry[:3]
+
+    def flush(self, timeout=None):
+        """ Waits until every pending write has been written. """
+        deadline = timeout and time.time() + timeout
+        with self._cond:
+            while self._pending:
+                if self._pid != os.getpid():
+                    self._start()
+                remaining = deadline and deadline - time.time()
+                if deadline and remaining <= 0:
+                    return False
+                self._cond.wait(remaining or 0.1)
+        return True
+
+    def clear(self):
+        with self._cond:
+            self._pending.clear()
+            self._cond.notify_all()
+
+    def stats(self):
+        return {
+            "pending": len(self._pending),
+            "queued": self.queued,
+            "written": self.written,
+            "batches": self.batches,
+            "dropped": self.dropped,
+            "errors": self.errors,
+        }
+
+    def _start(self):
+        # Threads don't survive a fork, so the writer is (re-)started in each
+        # process (the ``atexit`` handler is inherited, though).
+        if self._thread is None:
+            atexit.register(self.flush, timeout=5)
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._run,
+                                        name="dwdj-cache-write-behind")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+            if self.linger:
+                time.sleep(self.linger)
+            with self._cond:
+                items = list(islice(self._pending.iteritems(), self.batch_size))
+            try:
+                self._write(items)
+            except Exception:
+                self.errors += 1
+                log.exception("error writing %s keys to cache", len(items))
+            with self._cond:
+                for vkey, entry in items:
+                    if self._pending.get(vkey) is entry:
+                        del self._pending[vkey]
+                self._cond.notify_all()
+
+    def _write(self, items):
+        sets = {}
+        deletes = {}
+        for (key, version), (op, value, timeout, backend) in items:
+            if backend is None:
+                backend = self.get_backend()
+            if op == "set":
+                sets.setdefault((backend, version, timeout), {})[key] = value
+            else:
+                deletes.setdefault((backend, version), []).append(key)
+        for (backend, version, timeout), data in sets.items():
+            backend.set_many(data, timeout, version=version)
+            self.batches += 1
+        for (backend, version), keys in deletes.items():
+            backend.delete_many(keys, version=version)
+            self.batches += 1
+        self.written += len(items)
+
+
+class RequestScope(object):
+    """ Values fetched by ``SwappableCache`` during one request (see
+        ``SwappableCache.begin_request_scope``). """
+
+    def __init__(self):
+        # (key, version) -> value (or ``_missing`` if the key was missing)
+        self.values = {}
+        # version -> set of keys which have been deferred but not yet fetched
+        self.pending = {}
+        self.fetched = []
+        self.hits = 0
+        self.round_trips = 0
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "round_trips": self.round_trips,
+            "fetched": list(self.fetched),
+        }
+
+
+class DeferredGet(object):
+    """ A cache ``get`` which has been deferred so it can be merged with other
+        gets into one ``get_many`` (see ``SwappableCache.get_deferred``). """
+
+    def __init__(self, cache, key, default, version):
+        self.cache = cache
+        self.key = key
+        self.default = default
+        self.version = version
+
+    def get(self):
+        return self.cache.get(self.key, self.default, version=self.version)
+
+
+class KeyedLocks(object):
+    """ Thread locks for arbitrary keys. Locks are created when they are
+        first needed and discarded once nothing holds or is waiting on them,
+        so holding the lock for one key never blocks callers using another.
+
+        >>> locks = KeyedLocks()
+        >>> locks.acquire("foo")
+        True
+        >>> locks.acquire("foo", False)
+        False
+        >>> locks.acquire("bar", False)
+        True
+        >>> locks.release("foo"); locks.release("bar")
+        >>> len(locks)
+        0
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._locks = {}
+
+    def __len__(self):
+        return len(self._locks)
+
+    def acquire(self, key, blocking=True):
+        with self._lock:
+            entry = self._locks.get(key)
+            if entry is None:
+                entry = self._locks[key] = [threading.Lock(), 0]
+            entry[1] += 1
+        if entry[0].acquire(blocking):
+            return True
+        with self._lock:
+            self._unref(key, entry)
+        return False
+
+    def release(self, key):
+        with self._lock:
+            entry = self._locks[key]
+            entry[0].release()
+            self._unref(key, entry)
+
+    def _unref(self, key, entry):
+        entry[1] -= 1
+        if not entry[1]:
+            del self._locks[key]
+
+
+def _config_key(value):
+    """ Returns a hashable version of a cache configuration. """
+    if isinstance(value, dict):
+        return tuple(sorted((k, _config_key(v)) for (k, v) in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_config_key(v) for v in value)
+    return value
+
+
+class SharedCacheState(object):
+    """ The state which every ``SwappableCache`` instance with the same
+        configuration shares: the L1 cache, codec, write-behind queue, stats,
+        and the locks used by ``get_or_set``.
+
+        This is necessary because, since Django 1.7, ``caches[alias]`` (and
+        ``django.core.cache.cache``) create a separate instance in each
+        thread. Django doesn't tell cache backends their alias, so instances
+        are grouped by their ``LOCATION`` and parameters instead.
+    """
+
+    _registry = {}
+    _registry_lock = threading.Lock()
+
+    @classmethod
+    def get(cls, host, params, get_backend):
+        key = _config_key((host, params or {}))
+        with cls._registry_lock:
+            state = cls._registry.get(key)
+            if state is None:
+                state = cls._registry[key] = cls(params, get_backend)
+            return state
+
+    def __init__(self, params, get_backend):
+        options = (params or {}).get("OPTIONS") or {}
+        self.flight_locks = KeyedLocks()
+        self.l1 = None
+        if options.get("L1_MAX_ENTRIES"):
+            self.l1 = LocalLRUCache(
+                max_entries=options["L1_MAX_ENTRIES"],
+                timeout=options.get("L1_TIMEOUT", 5),
+                max_bytes=options.get("L1_MAX_BYTES"),
+            )
+        self.codec = None
+        if options.get("CODEC") is not None:
+            self.codec = ValueCodec(**options["CODEC"])
+        self.write_behind = None
+        if options.get("WRITE_BEHIND") is not None:
+            self.write_behind = WriteBehindQueue(
+                get_backend, **options["WRITE_BEHIND"]
+            )
+        self.stats = None
+        if options.get("STATS"):
+            self.stats = CacheStats(
+                prefix_separator=options.get("STATS_PREFIX_SEPARATOR", ":"),
+            )
+            self.stats_interval = options.get("STATS_REPORT_INTERVAL", 60)
+            self.stats_publish = options.get("STATS_PUBLISH", True)
+            self.stats_next_report = time.time() + self.stats_interval
+
+
 class SwappableCache(object):
     """ A Django cache backend which allows the *true* backend to be swapped at
         runtime. Especially useful for tests, and moderately optimized so it
@@ -47,18 +902,131 @@ class SwappableCache(object):
         fiddled with because ``django.core.cache.get_cache`` doesn't do any
         caching, so subsequent calls to ``get_cache(...)`` will use
         ``settings.CACHES``.
+
+        An optional process-local LRU cache (see ``LocalLRUCache``) can be
+        placed in front of the true backend so hot keys don't need a round
+        trip. It is enabled with ``OPTIONS``::
+
+            "default": {
+                "BACKEND": "dwdj.cache.SwappableCache",
+                "LOCATION": "redis_cache",
+                "OPTIONS": {
+                    "L1_MAX_ENTRIES": 1000,
+                    "L1_TIMEOUT": 5, # seconds
+                    "L1_MAX_BYTES": None,
+                },
+            },
+
+        The L1 cache is shared by every thread (see ``SharedCacheState``) and
+        is invalidated by ``set``, ``delete`` (etc) and ``set_backend`` *in
+        this process only*, so other processes may see stale values for up
+        to ``L1_TIMEOUT`` seconds. Use
+        ``cache.l1_stats()`` to get hit/miss/eviction counters.
+
+        A per-thread "request scope" can also be enabled (usually with
+        ``dwdj.middleware.CacheRequestScopeMiddleware``). While it is active
+        each key is fetched from the backend at most once, and gets can be
+        batched into a single ``get_many``::
+
+            cache.prefetch(["user:1", "user:2", "nav"])
+            cache.get("user:1") # no round trip
+
+            a = cache.get_deferred("a")
+            b = cache.get_deferred("b")
+            a.get() # fetches both "a" and "b" with one get_many
+            b.get() # no round trip
+
+        ``get_or_set`` protects expensive values from cache stampedes; see its
+        docstring for details.
+
+        Values can be compressed and serialized more compactly before they
+        are sent to the true backend by setting ``OPTIONS["CODEC"]`` to a
+        dict of arguments for ``ValueCodec`` (ex, ``{"compressor": "zlib",
+        "compress_threshold": 1024}``). Use ``cache.codec_stats()`` to see
+        how many bytes it has saved and how long encoding and decoding took.
+
+        To shard keys between several backends, set ``LOCATION`` to a list of
+        aliases (see ``ShardedCache``)::
+
+            "default": {
+                "BACKEND": "dwdj.cache.SwappableCache",
+                "LOCATION": ["redis_a", "redis_b", "redis_c"],
+                "OPTIONS": {"SHARD_VNODES": 160},
+            },
+
+        Every operation on the true backend can be timed and aggregated by
+        key prefix (see ``CacheStats``) by setting ``OPTIONS["STATS"]`` to
+        ``True``. Every ``STATS_REPORT_INTERVAL`` seconds (default 60) the
+        stats are sent with ``signal_cache_stats`` and, unless
+        ``STATS_PUBLISH`` is ``False``, stored in the cache so they can be
+        viewed with ``./manage.py cachestats``. When ``STATS`` is off the
+        only overhead is an ``is None`` check per operation.
+
+        Values can be tagged so they can be invalidated as a group::
+
+            cache.set("user:1:profile", profile, tags=["user:1"])
+            cache.get("user:1:profile", tags=["user:1"])
+            cache.invalidate_tag("user:1")
+
+        Each tag has a version number stored in the cache, and each tagged
+        value records the versions of its tags when it was set, so
+        ``invalidate_tag`` only needs to increment the tag's version. When
+        the tags are passed to ``get`` (or ``get_many``) their versions are
+        fetched in the same ``get_many`` as the value; otherwise they are
+        fetched with a second round trip after the value is found.
+
+        Setting ``OPTIONS["WRITE_BEHIND"]`` to a dict of arguments for
+        ``WriteBehindQueue`` (ex, ``{"max_size": 10000, "block": False}``)
+        makes ``set``, ``set_many``, ``delete`` and ``delete_many`` return
+        immediately, with a background thread writing them to the backend in
+        batches. Reads from this process see pending writes. ``add``,
+        ``incr`` and ``decr`` are always synchronous (they wait for any
+        pending write to the same key). Use ``cache.flush_writes()`` to wait
+        for pending writes and ``cache.write_behind_stats()`` to see how many
+        have been written or dropped.
     """
 
-    def __init__(self, host, *args, **kwargs):
+    stats_key = "dwdj-cache-stats"
+    tag_key_prefix = "dwdj-tag:"
+    tag_timeout = 60 * 60 * 24 * 30
+
+    flight_poll_interval = 0.05
+
+    def __init__(self, host, params=None, *args, **kwargs):
         self._backend = None
         self._backend_attrs = []
+        options = (params or {}).get("OPTIONS") or {}
+        if isinstance(host, basestring) and (";" in host or "," in host):
+            host = [h.strip() for h in host.replace(";", ",").split(",")]
+        state_key = host
+        if isinstance(host, (list, tuple)):
+            self._shard_aliases = list(host)
+            self._shard_vnodes = options.get("SHARD_VNODES", 160)
+            # The shards identify the cache (Django removes ``LOCATION`` from
+            # ``params``, so they aren't part of the parameters).
+            state_key = ("shards", tuple(sorted(self._shard_aliases)))
+            host = None
         self.default_backend = host
+        self._local = threading.local()
+        self._shared = shared = SharedCacheState.get(
+            state_key, params, lambda: self._backend or self.get_backend(),
+        )
+        self._flight_locks = shared.flight_locks
+        self._l1 = shared.l1
+        self._codec = shared.codec
+        self._write_behind = shared.write_behind
+        self._stats = shared.stats
 
     def set_backend(self, new_backend):
         from django.core.cache import get_cache as django_get_cache
         if isinstance(new_backend, basestring):
             new_backend = django_get_cache(new_backend)
         self._backend = new_backend
+        if self._l1 is not None:
+            self._l1.clear()
+        scope = getattr(self._local, "scope", None)
+        if scope is not None:
+            scope.values.clear()
         for attr in self._backend_attrs:
             try:
                 delattr(self, attr)
@@ -66,6 +1034,12 @@ class SwappableCache(object):
                 pass
 
     def get_backend(self):
+        if self.default_backend is None:
+            # Note: the shards are created lazily because ``get_cache`` can't
+            # be called while ``settings.CACHES`` is being loaded.
+            self.default_backend = ShardedCache(
+                self._shard_aliases, vnodes=self._shard_vnodes,
+            )
         self.set_backend(self.default_backend)
         return self._backend
 
@@ -80,5 +1054,496 @@ class SwappableCache(object):
         return value
 
     def __contains__(self, key):
+        return self.has_key(key)
+
+    def has_key(self, key, version=None):
+        # Goes through ``get`` so pending writes (and the L1 cache) are seen
+        return self.get(key, _missing, version=version) is not _missing
+
+    def l1_stats(self):
+        """ Returns a dict of hit/miss/eviction counters for the L1 cache (or
+            ``None`` if the L1 cache isn't enabled). """
+        return self._l1 and self._l1.stats()
+
+    def codec_stats(self):
+        """ Returns a dict of ``ValueCodec`` stats (or ``None`` if no codec
+            is configured). """
+        return self._codec and self._codec.stats()
+
+    def flush_writes(self, timeout=None):
+        """ Waits for any pending write-behind writes to be written. """
+        if self._write_behind is not None:
+            return self._write_behind.flush(timeout=timeout)
+        return True
+
+    def write_behind_stats(self):
+        """ Returns a dict of ``WriteBehindQueue`` stats (or ``None`` if
+            write-behind isn't enabled). """
+        return self._write_behind and self._write_behind.stats()
+
+    def report_stats(self, reset=True):
+        """ Sends ``signal_cache_stats`` with a snapshot of the stats (and
+            publishes it to the cache if ``STATS_PUBLISH`` is set). This is
+            called automatically every ``STATS_REPORT_INTERVAL`` seconds. """
+        if self._stats is None:
+            return None
+        shared = self._shared
+        shared.stats_next_report = time.time() + shared.stats_interval
+        snapshot = self._stats.snapshot(reset=reset)
+        signal_cache_stats.send(self, stats=snapshot)
+        if shared.stats_publish:
+            self._publish_stats(snapshot)
+        return snapshot
+
+    def _publish_stats(self, snapshot):
+        # Each process stores its latest snapshot under its own key, and keeps
+        # a list of those keys under ``stats_key``. Updates to the list are
+        # racy, but a lost update will be fixed by the next report.
+        backend = (self._backend or self.get_backend())
+        timeout = self._shared.stats_interval * 10
+        proc_key = "%s:%s:%s" %(self.stats_key, socket.gethostname(), os.getpid())
+        backend.set(proc_key, snapshot, timeout)
+        proc_keys = backend.get(self.stats_key) or []
+        proc_keys = [k for k in proc_keys if k != proc_key][-100:] + [proc_key]
+        backend.set(self.stats_key, proc_keys, timeout)
+
+    def get_published_stats(self):
+        """ Returns the merged snapshot of all stats published to the cache.
+            """
+        backend = (self._backend or self.get_backend())
+        proc_keys = backend.get(self.stats_key) or []
+        snapshots = backend.get_many(proc_keys).values()
+        return merge_cache_stats(snapshots)
+
+    def _record(self, op, keys, start, hits=None, sizes=None):
+        """ Records an operation on ``keys`` which started at ``start``. The
+            elapsed time is split evenly between the keys, so a batch of
+            ``n`` keys adds ``n`` to the count but only its own latency. """
+        now = time.time()
+        elapsed = (now - start) / (len(keys) or 1)
+        for i, key in enumerate(keys):
+            self._stats.record(
+                op, key, elapsed,
+                hit=hits and hits[i], size=sizes and sizes[i],
+            )
+        if now > self._shared.stats_next_report:
+            self.report_stats()
+
+    def begin_request_scope(self):
+        """ Starts a new request scope for the current thread (see above). """
+        self._local.scope = RequestScope()
+
+    def end_request_scope(self):
+        """ Ends the current thread's request scope, returning its stats (or
+            ``None`` if there was no scope). """
+        scope = getattr(self._local, "scope", None)
+        self._local.scope = None
+        return scope and scope.stats()
+
+    def _scope_fetch(self, scope, keys, version):
+        to_fetch = scope.pending.pop(version, set())
+        to_fetch.update(keys)
+        to_fetch = [
+            key for key in to_fetch
+            if (key, version) not in scope.values
+        ]
+        if not to_fetch:
+            return
+        fetched = self._get_many(to_fetch, version)
+        scope.round_trips += 1
+        scope.fetched.extend(to_fetch)
+        for key in to_fetch:
+            scope.values[(key, version)] = fetched.get(key, _missing)
+
+    def prefetch(self, keys, version=None):
+        """ Fetches ``keys`` (along with any pending deferred gets) in a single
+            ``get_many`` so that subsequent gets during this request won't
+            need a round trip. Does nothing if there is no request scope. """
+        scope = getattr(self._local, "scope", None)
+        if scope is not None:
+            self._scope_fetch(scope, keys, version)
+
+    def get_deferred(self, key, default=None, version=None):
+        """ Returns a ``DeferredGet`` for ``key``. When the first deferred get
+            is resolved, all pending deferred gets are fetched together. """
+        scope = getattr(self._local, "scope", None)
+        if scope is not None and (key, version) not in scope.values:
+            scope.pending.setdefault(version, set()).add(key)
+        return DeferredGet(self, key, default, version)
+
+    def get(self, key, default=None, version=None, tags=None):
+        if tags:
+            return self.get_many([key], version=version, tags=tags).get(
+                key, default,
+            )
+        value = self._scoped_get(key, _missing, version)
+        if type(value) is TaggedValue:
+            value = self._untag({key: value}, version).get(key, _missing)
+        return default if value is _missing else value
+
+    def get_many(self, keys, version=None, tags=None):
+        tag_keys = [self._tag_key(tag) for tag in tags or []]
+        result = self._scoped_get_many(list(keys) + tag_keys, version)
+        tag_versions = dict((k, result.pop(k, None)) for k in tag_keys)
+        return self._untag(result, version, tag_versions)
+
+    def _tag_key(self, tag):
+        return self.tag_key_prefix + tag
+
+    def _untag(self, values, version, tag_versions=None):
+        tagged = [k for (k, v) in values.items() if type(v) is TaggedValue]
+        if not tagged:
+            return values
+        tag_versions = dict(tag_versions or {})
+        to_fetch = set(
+            self._tag_key(tag)
+            for key in tagged
+            for (tag, _) in values[key].tags
+        ).difference(tag_versions)
+        if to_fetch:
+            tag_versions.update(self._scoped_get_many(list(to_fetch), version))
+        for key in tagged:
+            value = values[key]
+            if all(tag_versions.get(self._tag_key(tag)) == tag_version
+                   for (tag, tag_version) in value.tags):
+                values[key] = value.value
+            else:
+                del values[key]
+        return values
+
+    def _get_tag_versions(self, tags, version):
+        tag_keys = [self._tag_key(tag) for tag in tags]
+        current = self._scoped_get_many(tag_keys, version)
+        result = []
+        for tag, tag_key in zip(tags, tag_keys):
+            tag_version = current.get(tag_key)
+            if tag_version is None:
+                tag_version = random.getrandbits(48)
+                if not self.add(tag_key, tag_version, self.tag_timeout,
+                                version=version):
+                    tag_version = self._get(tag_key, version=version)
+            result.append((tag, tag_version))
+        return tuple(result)
+
+    def invalidate_tag(self, tag, version=None):
+        """ Invalidates every value which was set with ``tag``. """
+        tag_key = self._tag_key(tag)
+        try:
+            self.incr(tag_key, version=version)
+        except ValueError:
+            # The tag doesn't exist, so nothing needs to be invalidated
+            pass
+
+    def _scoped_get(self, key, default=None, version=None):
+        scope = getattr(self._local, "scope", None)
+        if scope is None:
+            return self._get(key, default, version)
+        vkey = (key, version)
+        if vkey in scope.values:
+            scope.hits += 1
+        else:
+            self._scope_fetch(scope, [key], version)
+        value = scope.values[vkey]
+        return default if value is _missing else value
+
+    def _scoped_get_many(self, keys, version=None):
+        scope = getattr(self._local, "scope", None)
+        if scope is None:
+            return self._get_many(keys, version)
+        self._scope_fetch(scope, keys, version)
+        result = {}
+        for key in keys:
+            value = scope.values[(key, version)]
+            if value is not _missing:
+                result[key] = value
+        return result
+
+    def get_or_set(self, key, func, timeout=DEFAULT_TIMEOUT, stale_timeout=0,
+                   lock_timeout=30, beta=1.0, version=None):
+        """ Returns the value of ``key``, calling ``func()`` to compute (and
+            cache) it if it's missing or stale.
+
+            Only one caller at a time will call ``func()`` for a key: within
+            a process this is enforced with a per-key thread lock, and
+            between processes with a lock key created with ``add()`` on the
+            backend, which expires after ``lock_timeout`` seconds. Callers
+            which don't get the lock wait for the value to appear.
+
+            Values are kept for ``stale_timeout`` seconds after ``timeout``
+            expires. While a value is stale it will be served to every caller
+            except the one which holds the lock and is refreshing it.
+
+            To avoid every process noticing an expired value at the same
+            moment, values are refreshed early with a probability which
+            increases as expiry approaches and with the time ``func()`` took
+            to run (scaled by ``beta``; set ``beta=0`` to disable).
+
+            ``timeout`` defaults to the backend's default timeout, and (as
+            with ``set``) ``None`` means the value never goes stale.
+
+            Values are stored as ``CachedValue`` tuples, so keys set with
+            ``get_or_set`` should only be read with ``get_or_set``. Any other
+            value found under ``key`` is treated as a miss. """
+        now = time.time()
+        entry = _cached_value(self.get(key, version=version))
+        if entry is not None:
+            early = beta and entry.delta * beta * -math.log(1 - random.random())
+            if now + early < entry.fresh_until:
+                return entry.value
+
+        vkey = (key, version)
+        flight_locks = self._flight_locks
+        lock_key = "dwdj-lock:%s" %(key, )
+        if entry is not None:
+            # The value is stale, but it can be served while someone else
+            # refreshes it.
+            if not flight_locks.acquire(vkey, False):
+                return entry.value
+            try:
+                if not self._add_lock(lock_key, lock_timeout, version):
+                    return entry.value
+                return self._get_or_set_compute(
+                    key, func, timeout, stale_timeout, lock_key, version)
+            finally:
+                flight_locks.release(vkey)
+
+        flight_locks.acquire(vkey)
+        try:
+            entry = _cached_value(self._get(key, version=version))
+            if entry is not None:
+                return entry.value
+            deadline = time.time() + lock_timeout
+            while not self._add_lock(lock_key, lock_timeout, version):
+                if time.time() > deadline:
+                    # Whoever holds the lock has taken too long; compute the
+                    # value anyway, but leave their lock alone.
+                    lock_key = None
+                    break
+                time.sleep(self.flight_poll_interval)
+                entry = _cached_value(self._get(key, version=version))
+                if entry is not None:
+                    return entry.value
+            return self._get_or_set_compute(
+                key, func, timeout, stale_timeout, lock_key, version)
+        finally:
+            flight_locks.release(vkey)
+
+    def _add_lock(self, lock_key, lock_timeout, version):
+        backend = (self._backend or self.get_backend())
+        return backend.add(lock_key, 1, lock_timeout, version=version)
+
+    def _get_or_set_compute(self, key, func, timeout, stale_timeout,
+                            lock_key, version):
+        backend = (self._backend or self.get_backend())
+        try:
+            start = time.time()
+            value = func()
+            end = time.time()
+            if timeout is DEFAULT_TIMEOUT:
+                timeout = getattr(backend, "default_timeout", 300)
+            if timeout is None:
+                entry = CachedValue(value, float("inf"), end - start)
+            else:
+                entry = CachedValue(value, end + timeout, end - start)
+                timeout += stale_timeout
+            self.set(key, entry, timeout, version=version)
+            return value
+        finally:
+            if lock_key is not None:
+                backend.delete(lock_key, version=version)
+
+    def _fetch(self, key, default, version):
+        if self._write_behind is not None:
+            pending = self._write_behind.get_pending(key, version)
+            if pending is not None:
+                op, value, _ = pending
+                if op == "delete":
+                    return default
+                return self._codec.decode(value) if self._codec else value
+        backend = (self._backend or self.get_backend())
+        if self._stats is None:
+            value = backend.get(key, default, version=version)
+        else:
+            start = time.time()
+            value = backend.get(key, _missing, version=version)
+            hit = value is not _missing
+            self._record("get", [key], start, hits=[hit],
+                         sizes=[hit and _value_size(value) or None])
+            if not hit:
+                value = default
+        if self._codec is not None and value is not default:
+            value = self._codec.decode(value)
+        return value
+
+    def _fetch_many(self, keys, version):
+        pending_values = {}
+        if self._write_behind is not None:
+            to_fetch = []
+            for key in keys:
+                pending = self._write_behind.get_pending(key, version)
+                if pending is None:
+                    to_fetch.append(key)
+                elif pending[0] == "set":
+                    pending_values[key] = pending[1]
+            keys = to_fetch
+        backend = (self._backend or self.get_backend())
+        if not keys:
+            result = {}
+        elif self._stats is None:
+            result = backend.get_many(keys, version=version)
+        else:
+            start = time.time()
+            result = backend.get_many(keys, version=version)
+            values = [result.get(key, _missing) for key in keys]
+            hits = [value is not _missing for value in values]
+            self._record("get_many", keys, start, hits=hits, sizes=[
+                hit and _value_size(value) or None
+                for (hit, value) in zip(hits, values)
+            ])
+        result.update(pending_values)
+        codec = self._codec
+        if codec is not None:
+            for key, value in result.items():
+                result[key] = codec.decode(value)
+        return result
+
+    def _store(self, op, keys, args, kwargs, size=None):
+        write_behind = self._write_behind
+        if write_behind is not None:
+            if op in ("set", "delete", "set_many", "delete_many") \
+                    and list(kwargs) == ["version"]:
+                return self._store_write_behind(op, args, kwargs["version"])
+            if any(write_behind.get_pending(key, kwargs.get("version"))
+                   for key in keys):
+                write_behind.flush()
+        backend = (self._backend or self.get_backend())
+        if self._stats is None:
+            return getattr(backend, op)(*args, **kwargs)
+        start = time.time()
+        result = getattr(backend, op)(*args, **kwargs)
+        self._record(op, keys, start, sizes=size and [size] * len(keys))
+        return result
+
+    def _store_write_behind(self, op, args, version):
+        put = self._write_behind.put
+        backend = (self._backend or self.get_backend())
+        if op == "set":
+            key, value, timeout = args
+            put("set", key, version, value, timeout, backend=backend)
+        elif op == "set_many":
+            data, timeout = args
+            for key, value in data.items():
+                put("set", key, version, value, timeout, backend=backend)
+        elif op == "delete":
+            put("delete", args[0], version, backend=backend)
+        else:
+            for key in args[0]:
+                put("delete", key, version, backend=backend)
+
+    def _encode(self, value):
+        if self._codec is None:
+            return value
+        return self._codec.encode(value)
+
+    def _get(self, key, default=None, version=None):
+        l1 = self._l1
+        if l1 is None:
+            return self._fetch(key, default, version)
+        value = l1.get((key, version), _missing)
+        if value is not _missing:
+            return value
+        value = self._fetch(key, _missing, version)
+        if value is _missing:
+            return default
+        l1.set((key, version), value)
+        return value
+
+    def _get_many(self, keys, version=None):
+        l1 = self._l1
+        if l1 is None:
+            return self._fetch_many(keys, version)
+        result = {}
+        to_fetch = []
+        for key in keys:
+            value = l1.get((key, version), _missing)
+            if value is _missing:
+                to_fetch.append(key)
+            else:
+                result[key] = value
+        if to_fetch:
+            fetched = self._fetch_many(to_fetch, version)
+            for key, value in fetched.items():
+                l1.set((key, version), value)
+            result.update(fetched)
+        return result
+
+    def _invalidate(self, keys, version):
+        l1 = self._l1
+        scope = getattr(self._local, "scope", None)
+        if l1 is None and scope is None:
+            return
+        for key in keys:
+            if l1 is not None:
+                l1.delete((key, version))
+            if scope is not None:
+                scope.values.pop((key, version), None)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None, tags=None,
+            **kwargs):
+        if tags:
+            value = TaggedValue(value, self._get_tag_versions(tags, version))
+        self._invalidate([key], version)
+        value = self._encode(value)
+        kwargs["version"] = version
+        return self._store("set", [key], (key, value, timeout), kwargs,
+                           size=self._stats and _value_size(value))
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None, tags=None,
+            **kwargs):
+        if tags:
+            value = TaggedValue(value, self._get_tag_versions(tags, version))
+        self._invalidate([key], version)
+        value = self._encode(value)
+        kwargs["version"] = version
+        return self._store("add", [key], (key, value, timeout), kwargs,
+                           size=self._stats and _value_size(value))
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None, tags=None,
+                 **kwargs):
+        if tags:
+            tag_versions = self._get_tag_versions(tags, version)
+            data = dict(
+                (k, TaggedValue(v, tag_versions)) for (k, v) in data.items()
+            )
+        self._invalidate(data, version)
+        if self._codec is not None:
+            data = dict((k, self._codec.encode(v)) for (k, v) in data.items())
+        kwargs["version"] = version
+        return self._store("set_many", data, (data, timeout), kwargs)
+
+    def delete(self, key, version=None):
+        self._invalidate([key], version)
+        return self._store("delete", [key], (key, ), {"version": version})
+
+    def delete_many(self, keys, version=None):
+        self._invalidate(keys, version)
+        return self._store("delete_many", keys, (keys, ), {"version": version})
+
+    def incr(self, key, delta=1, version=None):
+        self._invalidate([key], version)
+        return self._store("incr", [key], (key, delta), {"version": version})
+
+    def decr(self, key, delta=1, version=None):
+        self._invalidate([key], version)
+        return self._store("decr", [key], (key, delta), {"version": version})
+
+    def clear(self):
+        if self._write_behind is not None:
+            self._write_behind.clear()
+        if self._l1 is not None:
+            self._l1.clear()
+        scope = getattr(self._local, "scope", None)
+        if scope is not None:
+            scope.values.clear()
         backend = (self._backend or self.get_backend())
-        return key in backend
+        return backend.clear()
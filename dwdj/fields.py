@@ -1,24 +1,142 @@
+import os
 import time
 import random
+import struct
+import threading
 
 from django.forms import widgets
+from django.core.exceptions import ImproperlyConfigured
 from django.db import models as m
 
-from .strutil import to36
-
+from .strutil import to36, to36_many, from36, BASE36_ALPHABET
 
 try:
-    from south.modelsinspector import add_introspection_rules
+    from django.utils.deconstruct import deconstructible
 except ImportError:
-    pass
-else:
-    add_introspection_rules([], ["^fi\.dj\.fields\.IDField"])
+    # Django < 1.7 (migrations aren't supported, so there's nothing to do)
+    deconstructible = lambda cls: cls
+
+
+@deconstructible
+class MonotonicIDGenerator(object):
+    """ Generates IDs for ``IDField`` which increase monotonically within a
+        process, so rows inserted in quick succession are adjacent in the
+        primary key index (with the default generator, IDs created in the
+        same second are ordered randomly).
+
+        Each ID is a 62 bit integer made of (from most to least significant):
+
+        * 41 bits: milliseconds since ``epoch`` (good for about 69 years)
+        * 10 bits: the worker ID
+        * 11 bits: a per-process sequence number, which starts each
+          millisecond at a random value below 1024 (so there are at least
+          1024 IDs per millisecond; if it overflows, the timestamp is advanced
+          by a millisecond)
+
+        The worker ID is the ``worker_id`` argument or, if it isn't given,
+        ``settings.IDFIELD_WORKER_ID`` (which may also be a callable
+        returning the ID, so it can be computed in each process after a
+        fork). It must be between 0 and 1023, and must be unique among the
+        processes generating IDs for the same table: two processes which
+        share a worker ID can generate the same ID in the same millisecond.
+        It is not derived from the host name or process ID because those
+        collide too often (with 40 processes, it's more likely than not that
+        two share a 10 bit hash), so ``ImproperlyConfigured`` is raised if it
+        isn't set.
+
+        IDs are zero-padded to 12 base36 digits so they sort as strings in
+        the same order as they were generated.
+
+        Use it with ``IDField(generator="monotonic")``.
+    """
+
+    epoch = 1577836800 # 2020-01-01 00:00:00 UTC
+    worker_bits = 10
+    sequence_bits = 11
+
+    def __init__(self, worker_id=None):
+        self._worker_id = worker_id
+        self._pid = None
+        self._last_ms = 0
+        self._sequence = 0
+        self._lock = threading.Lock()
+
+    def get_worker_id(self):
+        if self._pid != os.getpid():
+            # (Re-)compute the worker ID after a fork
+            worker_id = self._worker_id
+            if worker_id is None:
+                from django.conf import settings
+                worker_id = getattr(settings, "IDFIELD_WORKER_ID", None)
+                if callable(worker_id):
+                    worker_id = worker_id()
+            if worker_id is None:
+                raise ImproperlyConfigured(
+                    "MonotonicIDGenerator needs a worker ID: set "
+                    "settings.IDFIELD_WORKER_ID (unique per process) or "
+                    "pass worker_id"
+                )
+            max_worker_id = (1 << self.worker_bits) - 1
+            if not 0 <= worker_id <= max_worker_id:
+                raise ImproperlyConfigured(
+                    "invalid MonotonicIDGenerator worker ID: %r (must be "
+                    "between 0 and %s)" %(worker_id, max_worker_id)
+                )
+            self._current_worker_id = worker_id
+            self._pid = os.getpid()
+        return self._current_worker_id
+
+    def new_ints(self, count):
+        worker = self.get_worker_id() << self.sequence_bits
+        max_sequence = (1 << self.sequence_bits) - 1
+        ts_shift = self.worker_bits + self.sequence_bits
+        now_ms = int((time.time() - self.epoch) * 1000)
+        result = []
+        with self._lock:
+            last_ms = self._last_ms
+            sequence = self._sequence
+            if now_ms > last_ms:
+                last_ms = now_ms
+                sequence = random.getrandbits(self.sequence_bits - 1) - 1
+            for _ in xrange(count):
+                sequence += 1
+                if sequence > max_sequence:
+                    last_ms += 1
+                    sequence = 0
+                result.append((last_ms << ts_shift) | worker | sequence)
+            self._last_ms = last_ms
+            self._sequence = sequence
+        return result
+
+    def new(self):
+        return to36(self.new_ints(1)[0]).rjust(12, BASE36_ALPHABET[0])
+
+    def new_many(self, count):
+        return [
+            x.rjust(12, BASE36_ALPHABET[0])
+            for x in to36_many(self.new_ints(count))
+        ]
+
+
+monotonic_ids = MonotonicIDGenerator()
 
 
 class IDField(m.Field):
     """ An ID field which is a 12 byte string, which is a base36 encoded 62
         bit integer, where the leading bits are time, and the trailing bits
-        are random. """
+        are random.
+
+        If ``generator="monotonic"`` (or a ``MonotonicIDGenerator``) is
+        passed, IDs are instead generated by a ``MonotonicIDGenerator``. See
+        ``benchmarks/idfield_insert.py`` for a comparison.
+
+        If ``storage="bigint"`` is passed, IDs are still base36 strings in
+        Python, but are stored in the database as ``BIGINT``s, which makes
+        primary key (and foreign key) indexes smaller and comparisons faster.
+        The ``*_id`` attributes of ``ForeignKey``s pointing to a ``bigint``
+        ``IDField`` are converted back to strings too (Django 1.8+, which
+        uses the target field's ``from_db_value``). Existing tables can be
+        converted with ``migrate_idfield_storage``. """
     description = "A unique ID 12 byte string, suitable for use as a unique ID"
     max_length = 12
 
@@ -37,21 +155,92 @@ class IDField(m.Field):
         # random bits coming first and the time bits coming second)
         return to36((curtime << 32) | random.getrandbits(32))
 
-    def __init__(self, primary_key=True, auto=True, **kwargs):
+    @classmethod
+    def new_many(cls, count):
+        """ Returns a list of ``count`` new IDs. Equivalent to calling
+            ``new()`` ``count`` times, but much faster (the time is only
+            checked once, the random bits are generated in bulk and
+            ``to36_many`` is used for the conversion). """
+        curtime = (int(time.time()) & ((1<<30)-1)) << 32
+        result = []
+        while len(result) < count:
+            chunk = min(count - len(result), 4096)
+            rand_bits = struct.unpack("<%sI" %(chunk, ), os.urandom(4 * chunk))
+            result.extend(to36_many([curtime | bits for bits in rand_bits]))
+        return result
+
+    def assign_ids(self, objs):
+        """ Assigns new IDs (with ``new_many``) to each of ``objs`` which
+            doesn't already have one. Useful before a ``bulk_create``, so the
+            IDs are minted in one pass instead of by ``pre_save``::
+
+                id_field = MyModel._meta.pk
+                id_field.assign_ids(objs)
+                MyModel.objects.bulk_create(objs)
+            """
+        attname = self.attname
+        needs_id = [obj for obj in objs if not getattr(obj, attname)]
+        for obj, new_id in zip(needs_id, self.new_many(len(needs_id))):
+            setattr(obj, attname, new_id)
+        return objs
+
+    def __init__(self, primary_key=True, auto=True, generator=None,
+                 storage="char", **kwargs):
+        if storage not in ["char", "bigint"]:
+            raise ValueError("invalid IDField storage: %r" %(storage, ))
         self.auto = auto
+        self.storage = storage
+        # Only pad IDs loaded from BIGINT columns when the generator does
+        self.pad_ids = isinstance(generator, MonotonicIDGenerator) or \
+            generator == "monotonic"
+        self._generator = generator
+        if generator == "monotonic":
+            generator = monotonic_ids
+        if generator is not None:
+            self.generator = generator
+            self.new = generator.new
+            self.new_many = generator.new_many
         super(IDField, self).__init__(primary_key=primary_key,
                                       default=None,
                                       max_length=self.max_length,
                                       blank=True)
 
+    def deconstruct(self):
+        name, path, args, kwargs = super(IDField, self).deconstruct()
+        # These are always passed to ``Field.__init__`` by ``__init__``
+        for key in ["default", "max_length", "blank", "primary_key"]:
+            kwargs.pop(key, None)
+        if not self.primary_key:
+            kwargs["primary_key"] = False
+        if not self.auto:
+            kwargs["auto"] = False
+        if self.storage != "char":
+            kwargs["storage"] = self.storage
+        if self._generator is not None:
+            kwargs["generator"] = self._generator
+        return name, path, args, kwargs
+
     def db_type(self, connection):
+        if self.storage == "bigint":
+            return "BIGINT"
         return "CHAR(%s)" %(self.max_length, )
 
+    def _from_int(self, value):
+        result = to36(value)
+        if self.pad_ids:
+            result = result.rjust(self.max_length, BASE36_ALPHABET[0])
+        return result
+
+    def from_db_value(self, value, expression, connection, context):
+        if self.storage == "bigint" and isinstance(value, (int, long)):
+            return self._from_int(value)
+        return value
+
     def to_python(self, value):
         if isinstance(value, basestring):
             return value
         elif isinstance(value, (int, long)):
-            return to36(value)
+            return self._from_int(value)
         elif value is None:
             # When an object is being deleted, its primary key is null'd
             return value
@@ -72,6 +261,10 @@ class IDField(m.Field):
         return cur_val
 
     def get_prep_value(self, value):
+        if self.storage == "bigint":
+            if isinstance(value, basestring):
+                return from36(value.strip())
+            return value
         if isinstance(value, (int, long)):
             # This can happen when using 'dumpdata', for some reason
             return to36(value)
@@ -83,6 +276,26 @@ class IDField(m.Field):
         return super(IDField, self).formfield(**defaults)
 
 
+try:
+    from south.modelsinspector import add_introspection_rules
+except ImportError:
+    pass
+else:
+    # Note: ``generator`` isn't frozen; it doesn't affect the schema, and
+    # South can't freeze generator instances.
+    add_introspection_rules([
+        (
+            [IDField],
+            [],
+            {
+                "primary_key": ["primary_key", {"default": True}],
+                "auto": ["auto", {"default": True}],
+                "storage": ["storage", {"default": "char"}],
+            },
+        ),
+    ], ["^dwdj\.fields\.IDField", "^fi\.dj\.fields\.IDField"])
+
+
 class ReadOnlyWidget(widgets.Widget):
     def render(self, name, value, attrs=None):
         if value is None:
@@ -93,3 +306,103 @@ class ReadOnlyWidget(widgets.Widget):
         return widgets.format_html('<input{0} />{1}',
                                    widgets.flatatt(final_attrs),
                                    value)
+
+
+_MIGRATE_FUNCTIONS_SQL = """
+    CREATE OR REPLACE FUNCTION dwdj_from36(value text) RETURNS bigint AS $$
+    DECLARE
+        result bigint := 0;
+    BEGIN
+        value := lower(trim(value));
+        FOR i IN 1..length(value) LOOP
+            result := result * 36 + position(substr(value, i, 1) in
+                '0123456789abcdefghijklmnopqrstuvwxyz') - 1;
+        END LOOP;
+        RETURN result;
+    END;
+    $$ LANGUAGE plpgsql IMMUTABLE STRICT;
+
+    CREATE OR REPLACE FUNCTION dwdj_to36(value bigint) RETURNS text AS $$
+    DECLARE
+        result text := '';
+    BEGIN
+        IF value = 0 THEN
+            RETURN '0';
+        END IF;
+        WHILE value > 0 LOOP
+            result := substr('0123456789abcdefghijklmnopqrstuvwxyz',
+                             (value % 36)::integer + 1, 1) || result;
+            value := value / 36;
+        END LOOP;
+        RETURN result;
+    END;
+    $$ LANGUAGE plpgsql IMMUTABLE STRICT;
+"""
+
+def migrate_idfield_storage(cursor, table, column="id", to="bigint",
+                            pad=False):
+    """ Converts an existing ``IDField`` column (and every foreign key column
+        which references it) between ``CHAR(12)`` and ``BIGINT`` storage
+        (``to`` is ``"bigint"`` or ``"char"``). PostgreSQL only. Foreign key
+        constraints are dropped, the columns are converted, then the
+        constraints are re-created.
+
+        When converting to ``"char"``, pass ``pad=True`` if the field uses
+        ``generator="monotonic"`` so the IDs are zero-padded to 12 digits
+        (the way the generator creates them, so they sort as strings).
+
+        For example, from a migration::
+
+            def forwards(apps, schema_editor):
+                cursor = schema_editor.connection.cursor()
+                migrate_idfield_storage(cursor, "myapp_account")
+
+            def backwards(apps, schema_editor):
+                cursor = schema_editor.connection.cursor()
+                migrate_idfield_storage(cursor, "myapp_account", to="char")
+
+            operations = [
+                migrations.SeparateDatabaseAndState(
+                    database_operations=[
+                        migrations.RunPython(forwards, backwards),
+                    ],
+                    state_operations=[
+                        migrations.AlterField("account", "id",
+                                              IDField(storage="bigint")),
+                    ],
+                ),
+            ]
+
+        The ``AlterField`` must only change the migration state: run against
+        the database it would try to cast the base36 strings to integers
+        with ``USING "id"::bigint``, which fails. """
+    if to == "bigint":
+        new_type = "BIGINT USING dwdj_from36(%s)"
+    elif to == "char" and pad:
+        new_type = "CHAR(12) USING lpad(dwdj_to36(%s), 12, '0')"
+    elif to == "char":
+        new_type = "CHAR(12) USING dwdj_to36(%s)"
+    else:
+        raise ValueError("invalid IDField storage: %r" %(to, ))
+    cursor.execute(_MIGRATE_FUNCTIONS_SQL)
+    cursor.execute("""
+        SELECT c.conname, c.conrelid::regclass::text, a.attname,
+               pg_get_constraintdef(c.oid)
+        FROM pg_constraint c
+        JOIN pg_attribute a ON a.attrelid = c.conrelid AND a.attnum = c.conkey[1]
+        JOIN pg_attribute ra ON ra.attrelid = c.confrelid AND ra.attnum = c.confkey[1]
+        WHERE c.contype = 'f' AND c.confrelid = %s::regclass AND ra.attname = %s
+    """, [table, column])
+    foreign_keys = cursor.fetchall()
+    for name, fk_table, _, _ in foreign_keys:
+        cursor.execute('ALTER TABLE %s DROP CONSTRAINT "%s"' %(fk_table, name))
+    columns = [(table, column)] + [(t, c) for (_, t, c, _) in foreign_keys]
+    for col_table, col in columns:
+        quoted = '"%s"' %(col, )
+        cursor.execute("ALTER TABLE %s ALTER COLUMN %s TYPE %s" %(
+            col_table, quoted, new_type %(quoted, ),
+        ))
+    for name, fk_table, _, definition in foreign_keys:
+        cursor.execute('ALTER TABLE %s ADD CONSTRAINT "%s" %s'
+                       %(fk_table, name, definition))
+    cursor.execute("DROP FUNCTION dwdj_from36(text); DROP FUNCTION dwdj_to36(bigint)")
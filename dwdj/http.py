@@ -1,39 +1,348 @@
 import re
 import os
+import zlib
+import hashlib
+import mmap
+import tempfile
 import mimetypes
-from cStringIO import StringIO
 
-from django.utils.http import http_date
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from django.utils.http import http_date, parse_http_date_safe
 from django.views.static import was_modified_since
-from django.http import HttpResponseNotModified
+from django.http import HttpResponse, HttpResponseNotModified
 try:
     from django.http import CompatibleStreamingHttpResponse as StreamingHttpResponse
 except ImportError:
     from django.http import StreamingHttpResponse
 
+from .cache import LocalLRUCache
+
 def escape_header(header_value):
     """ Escapes an HTTP header (ex, a ``Content-Disposition``).
         Kind of blunt and probably not 100% correct... But should be safe. """
     return re.sub(" *[\t\n\r;,]+ *", " ", header_value)
 
 
+FILE_CHUNK_SIZE = 64 * 1024
+
+def file_chunks(f, start=0, length=None, chunk_size=None):
+    """ Yields ``length`` bytes (or everything up to EOF if ``length`` is
+        ``None``) from the file object ``f``, starting at ``start``, in
+        ``chunk_size`` chunks. The file is closed when the generator is
+        exhausted or closed. """
+    chunk_size = chunk_size or FILE_CHUNK_SIZE
+    try:
+        if start:
+            f.seek(start)
+        remaining = length
+        while remaining is None or remaining > 0:
+            size = chunk_size if remaining is None else min(chunk_size, remaining)
+            chunk = f.read(size)
+            if not chunk:
+                break
+            if remaining is not None:
+                remaining -= len(chunk)
+            yield chunk
+    finally:
+        f.close()
+
+def mmap_chunks(f, start=0, length=None, chunk_size=None):
+    """ Like ``file_chunks``, but reads from an ``mmap`` of ``f``, which
+        avoids a ``read`` syscall (and a buffer copy) per chunk. Falls back to
+        ``file_chunks`` if ``f`` can't be mapped (ex, if it's empty). """
+    chunk_size = chunk_size or FILE_CHUNK_SIZE
+    try:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (AttributeError, ValueError, EnvironmentError):
+        for chunk in file_chunks(f, start, length, chunk_size):
+            yield chunk
+        return
+    # The mapping remains valid after the file is closed
+    f.close()
+    try:
+        end = len(mapped)
+        if length is not None:
+            end = min(end, start + length)
+        for offset in xrange(start, end, chunk_size):
+            yield mapped[offset:min(offset + chunk_size, end)]
+    finally:
+        mapped.close()
+
+
+BUFFER_TYPES = (bytearray, buffer, memoryview, mmap.mmap)
+
+def sliced_chunks(data, chunk_size=None):
+    """ Yields ``data`` (one of ``BUFFER_TYPES``) as ``str`` chunks of
+        ``chunk_size`` bytes, so only one chunk is copied at a time. """
+    chunk_size = chunk_size or FILE_CHUNK_SIZE
+    for offset in xrange(0, len(data), chunk_size):
+        chunk = data[offset:offset + chunk_size]
+        if isinstance(chunk, memoryview):
+            chunk = chunk.tobytes()
+        elif not isinstance(chunk, str):
+            chunk = str(chunk)
+        yield chunk
+
+def gzip_chunks(chunks, level=6):
+    """ Yields the gzip-compressed contents of ``chunks``. """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        chunk = compressor.compress(chunk)
+        if chunk:
+            yield chunk
+    yield compressor.flush()
+
+def accepts_encoding(request, coding):
+    """ Returns ``True`` if the request's ``Accept-Encoding`` header accepts
+        the content ``coding`` (ex, ``"gzip"``). """
+    header = request.META.get("HTTP_ACCEPT_ENCODING", "")
+    for item in header.split(","):
+        params = item.split(";")
+        name = params[0].strip().lower()
+        if name not in (coding, "*"):
+            continue
+        for param in params[1:]:
+            key, _, value = param.partition("=")
+            if key.strip() == "q":
+                try:
+                    return float(value) > 0
+                except ValueError:
+                    return False
+        return True
+    return False
+
+def _file_size(f):
+    """ Returns the number of bytes left in file object ``f``, or ``None`` if
+        that can't be determined without reading it. """
+    try:
+        return os.fstat(f.fileno()).st_size - f.tell()
+    except (AttributeError, EnvironmentError, ValueError):
+        pass
+    try:
+        pos = f.tell()
+        f.seek(0, os.SEEK_END)
+        end = f.tell()
+        f.seek(pos)
+        return end - pos
+    except (AttributeError, EnvironmentError, ValueError):
+        return None
+
+
+_etag_re = re.compile(r'((?:W/)?"[^"]*")')
+
+def parse_etags(header):
+    """ Returns the list of ETags in an ``If-Match`` or ``If-None-Match``
+        header (``["*"]`` for ``*``).
+
+        >>> parse_etags('"abc", W/"def"')
+        ['"abc"', 'W/"def"']
+    """
+    if header.strip() == "*":
+        return ["*"]
+    return _etag_re.findall(header)
+
+def etag_matches(header, etag, weak=False):
+    """ Returns ``True`` if ``etag`` matches one of the ETags in ``header``,
+        using the weak comparison function if ``weak`` is true and the strong
+        one otherwise (where weak ETags never match).
+
+        >>> etag_matches('W/"a", "b"', '"a"', weak=True)
+        True
+        >>> etag_matches('W/"a", "b"', '"a"')
+        False
+    """
+    tags = parse_etags(header)
+    if tags == ["*"]:
+        return True
+    if weak:
+        strip = lambda tag: tag[2:] if tag.startswith("W/") else tag
+        return strip(etag) in [strip(tag) for tag in tags]
+    return not etag.startswith("W/") and etag in tags
+
+def hash_chunks(chunks, hasher=None):
+    """ Returns a hash object (default ``hashlib.md5()``) updated with each
+        of ``chunks``. """
+    hasher = hasher or hashlib.md5()
+    for chunk in chunks:
+        hasher.update(chunk)
+    return hasher
+
+def data_etag(data, weak=False):
+    """ Returns an ETag for ``data`` (a ``str``, one of ``BUFFER_TYPES``, or
+        a seekable file object, which is hashed incrementally and then
+        rewound), or ``None`` if the ETag can't be computed without consuming
+        ``data``. """
+    if isinstance(data, unicode):
+        data = data.encode("utf-8")
+    if isinstance(data, (str, ) + BUFFER_TYPES):
+        digest = hashlib.md5(data).hexdigest()
+    elif hasattr(data, "read") and hasattr(data, "seek"):
+        try:
+            pos = data.tell()
+            chunks = iter(lambda: data.read(FILE_CHUNK_SIZE), "")
+            digest = hash_chunks(chunks).hexdigest()
+            data.seek(pos)
+        except (EnvironmentError, ValueError):
+            return None
+    else:
+        return None
+    return (weak and 'W/"%s"' or '"%s"') %(digest, )
+
+ETAG_METHODS = ["stat", "content"]
+
+_file_etag_cache = LocalLRUCache(max_entries=10000, timeout=float("inf"))
+
+def file_etag(filepath, statobj=None, method=None):
+    """ Returns a strong ETag for ``filepath``. If ``method`` (default:
+        ``settings.FILE_RESPONSE_ETAG``, or ``"stat"``) is ``"stat"`` the ETag
+        is derived from the file's mtime and size. If it is ``"content"`` the
+        ETag is a hash of the file's contents, which is cached per (path,
+        mtime, size), so the file is only read once per version. """
+    if statobj is None:
+        statobj = os.stat(filepath)
+    if method is None:
+        method = getattr(settings, "FILE_RESPONSE_ETAG", "stat")
+    if method == "stat":
+        return '"%x-%x"' %(int(statobj.st_mtime * 1000000), statobj.st_size)
+    if method != "content":
+        raise ValueError("invalid ETag method %r (expected one of: %s)"
+                         %(method, ", ".join(ETAG_METHODS)))
+    key = (filepath, statobj.st_mtime, statobj.st_size)
+    etag = _file_etag_cache.get(key)
+    if etag is None:
+        with open(filepath, "rb") as f:
+            etag = data_etag(f)
+        _file_etag_cache.set(key, etag)
+    return etag
+
+def if_range_matches(header, etag, mtime):
+    """ Returns ``True`` if an ``If-Range`` header matches the current
+        entity, which has a strong ``etag`` and was last modified at
+        ``mtime``. Weak ETags never match. """
+    if header.startswith('"') or header.startswith("W/"):
+        return header == etag
+    return parse_http_date_safe(header) == int(mtime)
+
+def check_conditions(request, etag=None, last_modified=None):
+    """ Evaluates the request's ``If-Match``, ``If-Unmodified-Since``,
+        ``If-None-Match`` and ``If-Modified-Since`` headers (in the order
+        given by RFC 7232) against the current ``etag`` and ``last_modified``
+        (a timestamp) of the requested resource.
+
+        Returns a ``304 Not Modified`` or ``412 Precondition Failed`` response
+        if one should be sent instead of the resource, otherwise ``None``. """
+    meta = request.META
+    safe = request.method in ("GET", "HEAD")
+    if_match = meta.get("HTTP_IF_MATCH")
+    if if_match:
+        if etag is None or not etag_matches(if_match, etag):
+            return HttpResponse(status=412)
+    elif last_modified is not None:
+        if_unmodified_since = meta.get("HTTP_IF_UNMODIFIED_SINCE")
+        if if_unmodified_since:
+            since = parse_http_date_safe(if_unmodified_since)
+            if since is not None and int(last_modified) > since:
+                return HttpResponse(status=412)
+
+    if_none_match = meta.get("HTTP_IF_NONE_MATCH")
+    if if_none_match:
+        if etag is not None and etag_matches(if_none_match, etag, weak=True):
+            if not safe:
+                return HttpResponse(status=412)
+            response = HttpResponseNotModified()
+            response["ETag"] = etag
+            if last_modified is not None:
+                response["Last-Modified"] = http_date(last_modified)
+            return response
+    elif safe and last_modified is not None:
+        if not was_modified_since(meta.get("HTTP_IF_MODIFIED_SINCE"),
+                                  last_modified):
+            response = HttpResponseNotModified()
+            if etag is not None:
+                response["ETag"] = etag
+            response["Last-Modified"] = http_date(last_modified)
+            return response
+    return None
+
+
 def data_response(data, size=None,
                   attachment=False, attachment_name=None,
-                  mimetype=None, encoding=None):
-    if hasattr(data, "getvalue"):
-        data = data.getvalue()
+                  mimetype=None, encoding=None,
+                  request=None, gzip=None, chunk_size=None, etag=None):
+    """ Returns a response which streams ``data`` in ``chunk_size`` chunks
+        without copying it. ``data`` can be a ``str`` or ``unicode``, a
+        ``StringIO`` (all of which is sent, regardless of its position), a
+        file object (which is read from its current position, then closed),
+        a ``bytearray``, ``buffer``, ``memoryview`` or ``mmap``, or an
+        iterable of ``str`` chunks.
+
+        ``Content-Length`` is set to ``size``, if given, or if the length can
+        be determined without reading the data.
+
+        If ``gzip`` (default: ``settings.DATA_RESPONSE_GZIP``) is true and
+        ``request`` accepts it, the response is gzip compressed as it is
+        streamed.
+
+        ``etag`` is used as the response's ``ETag``; if it is ``True``, one is
+        computed with ``data_etag``. If ``request`` is given it is checked
+        with ``check_conditions``, and a 304 or 412 response may be returned
+        instead. """
+    charset = None
     if isinstance(data, unicode):
+        # Note: this is a charset, not a content coding
         data = data.encode("utf-8")
-        encoding = "utf-8"
+        charset = "utf-8"
     if isinstance(data, str):
         size = len(data)
-        data = StringIO(data)
+        chunks = [data]
+    elif hasattr(data, "read"):
+        if hasattr(data, "getvalue"):
+            data.seek(0)
+        if size is None:
+            size = _file_size(data)
+        chunks = file_chunks(data, chunk_size=chunk_size)
+    elif isinstance(data, BUFFER_TYPES):
+        if size is None:
+            size = len(data)
+        chunks = sliced_chunks(data, chunk_size)
+    else:
+        chunks = data
+
+    if gzip is None:
+        gzip = getattr(settings, "DATA_RESPONSE_GZIP", False)
+    compress = gzip and not encoding and request is not None
+    gzipped = compress and accepts_encoding(request, "gzip")
+
+    if etag is True:
+        etag = data_etag(data)
+    if etag is not None and gzipped:
+        # The compressed representation needs a different ETag
+        etag = etag[:-1] + '-gzip"'
+    if etag is not None and request is not None:
+        response = check_conditions(request, etag)
+        if response is not None:
+            if compress:
+                patch_vary_headers(response, ["Accept-Encoding"])
+            return response
+
+    if gzipped:
+        chunks = gzip_chunks(chunks)
+        encoding = "gzip"
+        size = None
+
     mimetype = mimetype or 'application/octet-stream'
-    response = StreamingHttpResponse(data, content_type=mimetype)
+    if charset and "charset=" not in mimetype:
+        mimetype += "; charset=" + charset
+    response = StreamingHttpResponse(chunks, content_type=mimetype)
+    if compress:
+        patch_vary_headers(response, ["Accept-Encoding"])
     if size is not None:
         response["Content-Length"] = size
     if encoding:
         response["Content-Encoding"] = encoding
+    if etag is not None:
+        response["ETag"] = etag
     if attachment or attachment_name:
         response["Content-Disposition"] = "attachment" + (
             attachment_name and
@@ -42,19 +351,267 @@ def data_response(data, size=None,
     return response
 
 
+_range_re = re.compile(r"^\s*bytes\s*=\s*(\d*)\s*-\s*(\d*)\s*$")
+
+def parse_range_header(header, size):
+    """ Parses an HTTP ``Range`` header for an entity of ``size`` bytes.
+        Returns the ``(first, last)`` (inclusive) bytes of the range, ``None``
+        if the header should be ignored (it's missing, invalid, or asks for
+        multiple ranges), or ``False`` if the range can't be satisfied.
+
+        >>> parse_range_header("bytes=0-99", 1000)
+        (0, 99)
+        >>> parse_range_header("bytes=-100", 1000)
+        (900, 999)
+        >>> parse_range_header("bytes=900-5000", 1000)
+        (900, 999)
+        >>> print parse_range_header("bytes=0-0,-1", 1000)
+        None
+        >>> parse_range_header("bytes=1000-", 1000)
+        False
+    """
+    match = header and _range_re.match(header)
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first:
+        if not last:
+            return None
+        suffix = int(last)
+        if suffix == 0 or size == 0:
+            return False
+        return (max(size - suffix, 0), size - 1)
+    first = int(first)
+    if last and int(last) < first:
+        return None
+    if first >= size:
+        return False
+    last = int(last) if last else size - 1
+    return (first, min(last, size - 1))
+
+OFFLOAD_MODES = ["x-sendfile", "x-accel-redirect"]
+
+def offload_response(filepath, mode):
+    """ Returns an empty ``HttpResponse`` which asks the front end web server
+        to send ``filepath``, or ``None`` if ``filepath`` can't be offloaded.
+
+        ``mode`` is either ``"x-sendfile"`` (Apache's ``mod_xsendfile``,
+        lighttpd) or ``"x-accel-redirect"`` (nginx). For ``x-accel-redirect``
+        the file system path must be mapped to an ``internal`` location with
+        ``settings.FILE_RESPONSE_ACCEL_REDIRECT_PREFIXES``, a dictionary of
+        ``{"/path/on/disk/": "/internal-location/"}``. """
+    if mode not in OFFLOAD_MODES:
+        raise ValueError("invalid offload mode %r (expected one of: %s)"
+                         %(mode, ", ".join(OFFLOAD_MODES)))
+    filepath = os.path.abspath(filepath)
+    if mode == "x-sendfile":
+        header, value = "X-Sendfile", filepath
+    else:
+        header, value = "X-Accel-Redirect", None
+        prefixes = getattr(settings, "FILE_RESPONSE_ACCEL_REDIRECT_PREFIXES", {})
+        for root in sorted(prefixes, key=len, reverse=True):
+            if filepath.startswith(root):
+                value = prefixes[root] + filepath[len(root):]
+                break
+        if value is None:
+            return None
+    response = HttpResponse()
+    response[header] = value
+    return response
+
+
+# The types to use for files which are themselves compressed (ex,
+# ``export.csv.gz``), instead of sending a ``Content-Encoding`` (which would
+# make browsers decompress them).
+COMPRESSED_MIMETYPES = {
+    "gzip": "application/gzip",
+    "bzip2": "application/x-bzip2",
+    "xz": "application/x-xz",
+    "compress": "application/x-compress",
+}
+
+COMPRESSIBLE_MIMETYPES = set([
+    "application/javascript", "application/json", "application/xml",
+    "application/x-javascript", "image/svg+xml",
+])
+
+def is_compressible(mimetype):
+    return bool(mimetype) and (
+        mimetype.startswith("text/") or mimetype in COMPRESSIBLE_MIMETYPES
+    )
+
+# Content codings of precompressed siblings, in order of preference
+PRECOMPRESSED_ENCODINGS = [("br", ".br"), ("gzip", ".gz")]
+
+def compressed_cache_path(filepath, statobj, cache_dir, create=True):
+    """ Returns the path of a gzip compressed copy of ``filepath`` in
+        ``cache_dir``, creating it if necessary (and ``create`` is true).
+        Copies are named by the file's path, mtime and size, so stale copies
+        are never used (but they aren't removed either; use something like
+        ``tmpreaper``). """
+    name = "%s-%x-%x.gz" %(
+        hashlib.md5(os.path.abspath(filepath)).hexdigest(),
+        int(statobj.st_mtime * 1000000), statobj.st_size,
+    )
+    path = os.path.join(cache_dir, name)
+    if not create or os.path.exists(path):
+        return path
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, prefix=name + ".",
+                                    suffix=".tmp")
+    try:
+        # mkstemp creates the file 0600, but it may be served by the front
+        # end web server (see ``offload_response``)
+        os.chmod(tmp_path, 0644)
+        with os.fdopen(fd, "wb") as f:
+            with open(filepath, "rb") as source:
+                for chunk in gzip_chunks(file_chunks(source)):
+                    f.write(chunk)
+        os.rename(tmp_path, path)
+    except:
+        os.unlink(tmp_path)
+        raise
+    return path
+
+def find_precompressed(request, filepath, statobj, mimetype=None,
+                       cache_dir=None, create=True):
+    """ Returns ``(coding, path)`` of the best compressed version of
+        ``filepath`` that ``request`` will accept, or ``(None, None)``.
+
+        Siblings (ex, ``foo.css.gz`` and ``foo.css.br``) are used if they are
+        at least as new as ``filepath``. Otherwise, if ``cache_dir`` is given
+        and ``mimetype`` is compressible, a gzip copy is kept in ``cache_dir``
+        (see ``compressed_cache_path``; if ``create`` is false, the copy's
+        path is returned without creating it). """
+    for coding, extension in PRECOMPRESSED_ENCODINGS:
+        if not accepts_encoding(request, coding):
+            continue
+        try:
+            sibling = os.stat(filepath + extension)
+        except OSError:
+            continue
+        if sibling.st_mtime >= statobj.st_mtime:
+            return coding, filepath + extension
+    if cache_dir and is_compressible(mimetype):
+        if accepts_encoding(request, "gzip"):
+            return "gzip", compressed_cache_path(
+                filepath, statobj, cache_dir, create=create,
+            )
+    return None, None
+
+
 def file_response(request, filepath,
                   attachment=False, attachment_name=None,
-                  mimetype=None, encoding=None):
-    statobj = os.stat(filepath)
-    if not was_modified_since(request.META.get('HTTP_IF_MODIFIED_SINCE'),
-                              statobj.st_mtime, statobj.st_size):
-        return HttpResponseNotModified()
+                  mimetype=None, encoding=None,
+                  offload=None, use_mmap=None, chunk_size=None,
+                  precompressed=None):
+    """ Returns a response which serves ``filepath``, supporting
+        conditional requests (see ``check_conditions`` and ``file_etag``;
+        304 and 412 responses are returned without opening the file) and
+        single byte ``Range`` (and ``If-Range``) requests.
 
+        If ``offload`` (default: ``settings.FILE_RESPONSE_OFFLOAD``) is set,
+        sending the file is offloaded to the front end web server (see
+        ``offload_response``). Otherwise the file is streamed in
+        ``chunk_size`` (default: ``settings.FILE_RESPONSE_CHUNK_SIZE``, or
+        64k) chunks, read from an ``mmap`` of the file if ``use_mmap``
+        (default: ``settings.FILE_RESPONSE_MMAP``) is true.
+
+        If ``precompressed`` (default:
+        ``settings.FILE_RESPONSE_PRECOMPRESSED``) is true, a compressed
+        version of the file is served if the client accepts it (see
+        ``find_precompressed``; ``settings.FILE_RESPONSE_COMPRESS_CACHE_DIR``
+        is used as the ``cache_dir``).
+
+        ``encoding`` is sent as the ``Content-Encoding``. Note that files
+        which are compressed themselves (ex, ``foo.csv.gz``) are sent as-is,
+        with a type like ``application/gzip``. """
+    statobj = os.stat(filepath)
+    mtime = statobj.st_mtime
     if mimetype is None:
-        mimetype, encoding = mimetypes.guess_type(filepath)
-    response = data_response(
-        open(filepath, 'rb'), size=statobj.st_size,
-        mimetype=mimetype, encoding=encoding,
-    )
-    response["Last-Modified"] = http_date(statobj.st_mtime)
+        mimetype, file_encoding = mimetypes.guess_type(filepath)
+        if file_encoding:
+            mimetype = COMPRESSED_MIMETYPES.get(file_encoding)
+
+    if precompressed is None:
+        precompressed = getattr(settings, "FILE_RESPONSE_PRECOMPRESSED", False)
+    vary = precompressed and not encoding
+    etag = file_etag(filepath, statobj)
+    coding = None
+    if vary:
+        # Only negotiate the coding here: the compressed copy isn't needed
+        # (or created) unless the conditions below pass.
+        cache_dir = getattr(settings, "FILE_RESPONSE_COMPRESS_CACHE_DIR", None)
+        coding, compressed_path = find_precompressed(
+            request, filepath, statobj, mimetype, cache_dir=cache_dir,
+            create=False,
+        )
+        if coding is not None:
+            etag = etag[:-1] + '-%s"' %(coding, )
+
+    response = check_conditions(request, etag, mtime)
+    if response is not None:
+        if vary:
+            patch_vary_headers(response, ["Accept-Encoding"])
+        return response
+
+    if coding is not None:
+        if not os.path.exists(compressed_path):
+            compressed_path = compressed_cache_path(
+                filepath, statobj, cache_dir,
+            )
+        encoding = coding
+        filepath = compressed_path
+        statobj = os.stat(filepath)
+
+    if offload is None:
+        offload = getattr(settings, "FILE_RESPONSE_OFFLOAD", None)
+    response = offload and offload_response(filepath, offload)
+    if response is not None:
+        response["Content-Type"] = mimetype or "application/octet-stream"
+        if encoding:
+            response["Content-Encoding"] = encoding
+        if attachment or attachment_name:
+            response["Content-Disposition"] = "attachment" + (
+                attachment_name and
+                "; filename=%s" %(escape_header(attachment_name), ) or ""
+            )
+    else:
+        size = statobj.st_size
+        byte_range = parse_range_header(request.META.get("HTTP_RANGE"), size)
+        if_range = request.META.get("HTTP_IF_RANGE")
+        if byte_range is not None and if_range:
+            if not if_range_matches(if_range, etag, mtime):
+                byte_range = None
+        if byte_range is False:
+            response = HttpResponse(status=416)
+            response["Content-Range"] = "bytes */%s" %(size, )
+            return response
+
+        start, length = 0, size
+        if byte_range:
+            start, length = byte_range[0], byte_range[1] - byte_range[0] + 1
+        if use_mmap is None:
+            use_mmap = getattr(settings, "FILE_RESPONSE_MMAP", False)
+        if chunk_size is None:
+            chunk_size = getattr(settings, "FILE_RESPONSE_CHUNK_SIZE", None)
+        chunks = (mmap_chunks if use_mmap else file_chunks)(
+            open(filepath, 'rb'), start, length, chunk_size,
+        )
+        response = data_response(
+            chunks, size=length,
+            attachment=attachment, attachment_name=attachment_name,
+            mimetype=mimetype, encoding=encoding,
+        )
+        response["Accept-Ranges"] = "bytes"
+        if byte_range:
+            response.status_code = 206
+            response["Content-Range"] = "bytes %s-%s/%s" %(
+                byte_range[0], byte_range[1], size,
+            )
+    if vary:
+        patch_vary_headers(response, ["Accept-Encoding"])
+    response["Last-Modified"] = http_date(mtime)
+    response["ETag"] = etag
     return response
@@ -1,4 +1,9 @@
+import os
+import time
+import Queue
+import atexit
 import logging
+import threading
 
 from django.conf import settings as s
 
@@ -6,3 +11,69 @@ from django.conf import settings as s
 class RequireDebugFalse(logging.Filter):
     def filter(self, record):
         return not s.DEBUG
+
+
+class AsyncLogQueue(object):
+    """ Logs messages from a background thread, so a slow log handler (ex,
+        a remote syslog) doesn't stall the thread doing the logging.
+
+        At most ``maxsize`` messages are queued; when the queue is full new
+        messages are dropped (and counted in ``dropped``) rather than
+        blocking. Pending messages are flushed at exit.
+
+        For example::
+
+            log_queue = AsyncLogQueue()
+            log_queue.log(logging.getLogger("access"), logging.INFO, "...")
+    """
+
+    def __init__(self, maxsize=10000):
+        self.queue = Queue.Queue(maxsize)
+        self.logged = 0
+        self.dropped = 0
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def log(self, logger, level, msg, *args):
+        if not logger.isEnabledFor(level):
+            return
+        if self._pid != os.getpid():
+            self._start()
+        try:
+            self.queue.put_nowait((logger, level, msg, args))
+        except Queue.Full:
+            self.dropped += 1
+
+    def flush(self, timeout=5):
+        """ Waits up to ``timeout`` seconds for queued messages to be logged.
+            """
+        deadline = time.time() + timeout
+        while self.queue.unfinished_tasks and time.time() < deadline:
+            time.sleep(0.01)
+        return not self.queue.unfinished_tasks
+
+    def _start(self):
+        # Threads don't survive a fork, so the logging thread is (re-)started
+        # in each process (the ``atexit`` handler is inherited, though).
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            if self._thread is None:
+                atexit.register(self.flush)
+            thread = threading.Thread(target=self._run, name="dwdj-async-log")
+            thread.daemon = True
+            thread.start()
+            self._thread = thread
+            self._pid = os.getpid()
+
+    def _run(self):
+        while True:
+            logger, level, msg, args = self.queue.get()
+            try:
+                logger.log(level, msg, *args)
+                self.logged += 1
+            except Exception:
+                pass
+            finally:
+                self.queue.task_done()
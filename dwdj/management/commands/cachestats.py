@@ -0,0 +1,47 @@
+from django.core.cache import get_cache
+
+from dwdj.management.base import BaseCommand, CommandError, make_option
+
+
+class Command(BaseCommand):
+    help = """
+        Prints the cache stats published by ``dwdj.cache.SwappableCache``
+        (see the ``STATS`` option) by every process.
+    """
+
+    option_list = [
+        make_option("--cache", default="default",
+            help="The cache alias to show stats for (default: 'default')."),
+        make_option("--sort", default="count",
+            choices=["count", "hit_ratio", "p50", "p95", "p99"],
+            help="The column to sort by (default: 'count')."),
+        make_option("--limit", type="int", default=50,
+            help="Show at most this many rows (default: 50)."),
+    ]
+
+    def handle(self, *args, **options):
+        from dwdj.cache import summarize_cache_stats
+        cache = get_cache(options["cache"])
+        if not hasattr(cache, "get_published_stats"):
+            raise CommandError("cache %r is not a SwappableCache"
+                               %(options["cache"], ))
+        rows = summarize_cache_stats(cache.get_published_stats())
+        if not rows:
+            print "No stats have been published (is OPTIONS['STATS'] set?)"
+            return 0
+        sort = options["sort"]
+        rows.sort(key=lambda row: row[sort], reverse=True)
+        fmt = "%-30s %-12s %10s %8s %10s %9s %9s %9s"
+        print fmt %("prefix", "op", "count", "hit %", "avg bytes",
+                    "p50 ms", "p95 ms", "p99 ms")
+        for row in rows[:options["limit"]]:
+            print fmt %(
+                row["prefix"][:30], row["op"], row["count"],
+                "-" if row["hit_ratio"] is None else
+                "%.1f" %(row["hit_ratio"] * 100, ),
+                "-" if row["avg_bytes"] is None else row["avg_bytes"],
+                "%.3f" %(row["p50"], ),
+                "%.3f" %(row["p95"], ),
+                "%.3f" %(row["p99"], ),
+            )
+        return 0
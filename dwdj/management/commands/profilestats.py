@@ -0,0 +1,75 @@
+from django.conf import settings
+
+from dwdj.management.base import BaseCommand, CommandError, make_option
+from dwdj.profiling import load_dumped_stats
+
+
+class Command(BaseCommand):
+    help = """
+        Prints the slowest endpoints recorded by
+        ``dwdj.middleware.ProfilingMiddleware`` (and, with ``--functions``,
+        the most expensive functions from sampled profiles).
+    """
+
+    option_list = [
+        make_option("--dir", help=(
+            "Directory containing the dumped stats (default: "
+            "settings.PROFILING_DUMP_DIR)."
+        )),
+        make_option("--sort", default="total",
+            choices=["total", "count", "mean", "p50", "p95", "p99", "cpu", "db"],
+            help="The column to sort by (default: 'total')."),
+        make_option("--limit", type="int", default=20,
+            help="Show at most this many rows (default: 20)."),
+        make_option("--functions", action="store_true", default=False,
+            help="Also print the top functions from the sampled profiles."),
+    ]
+
+    def handle(self, *args, **options):
+        dump_dir = options.get("dir") or getattr(settings, "PROFILING_DUMP_DIR", None)
+        if not dump_dir:
+            raise CommandError("--dir or settings.PROFILING_DUMP_DIR is required")
+        endpoints, profile_stats = load_dumped_stats(dump_dir)
+        if not endpoints:
+            print "No stats found in %r" %(dump_dir, )
+            return 0
+
+        rows = []
+        for endpoint, stats in endpoints.items():
+            count = stats.count or 1
+            rows.append({
+                "endpoint": endpoint,
+                "count": stats.count,
+                "total": stats.wall,
+                "mean": stats.wall / count,
+                "p50": stats.percentile(0.50),
+                "p95": stats.percentile(0.95),
+                "p99": stats.percentile(0.99),
+                "cpu": stats.cpu / count,
+                "db": stats.db / count,
+                "db_queries": float(stats.db_queries) / count,
+                "template": stats.template / count,
+                "middleware": stats.middleware / count,
+            })
+        rows.sort(key=lambda row: row[options["sort"]], reverse=True)
+
+        fmt = "%-35s %8s %9s %8s %8s %8s %8s %8s %8s %8s %8s"
+        print fmt %("endpoint", "count", "total s", "mean ms", "p95 ms",
+                    "p99 ms", "cpu ms", "db ms", "queries", "tmpl ms",
+                    "mw ms")
+        ms = lambda x: "%.1f" %(x * 1000, )
+        for row in rows[:options["limit"]]:
+            print fmt %(
+                row["endpoint"][:35], row["count"], "%.1f" %(row["total"], ),
+                ms(row["mean"]), ms(row["p95"]), ms(row["p99"]),
+                ms(row["cpu"]), ms(row["db"]), "%.1f" %(row["db_queries"], ),
+                ms(row["template"]), ms(row["middleware"]),
+            )
+
+        if options["functions"]:
+            print
+            if profile_stats is None:
+                print "No sampled profiles found."
+            else:
+                profile_stats.sort_stats("cumulative").print_stats(options["limit"])
+        return 0
@@ -1,3 +1,5 @@
+import json
+import time
 import logging
 from datetime import datetime
 
@@ -5,6 +7,11 @@ from django.core import urlresolvers
 from django.conf import settings as s
 from django.http import Http404, HttpResponsePermanentRedirect
 
+from .log import AsyncLogQueue
+from .cache import LocalLRUCache
+from . import profiling
+from .response_cache import ResponseCache, ResponseCacheKey, DEFAULT_TIMEOUT
+
 
 class ActualHTTPMethodMiddleware(object):
     """ Allow an 'actual_method' GET paramter to modify the HTTP request
@@ -39,35 +46,120 @@ class SetRemoteAddrFromForwardedFor(object):
         request.META["REMOTE_ADDR"] = remote_addr
 
 
+_timestamp_cache = (None, None)
+
+def _log_timestamp(now):
+    """ Returns the access log timestamp for ``now``, formatting it at most
+        once per second. """
+    global _timestamp_cache
+    second = int(now)
+    cached_second, cached_str = _timestamp_cache
+    if cached_second != second:
+        cached_str = datetime.utcfromtimestamp(second).strftime(
+            "%d/%b/%Y:%H:%M:%S -0000",
+        )
+        _timestamp_cache = (second, cached_str)
+    return cached_str
+
+
 class AccessLogMiddleware(object):
-    """ Log Apache-style access logs using Python's logging module. """
+    """ Log Apache-style access logs using Python's logging module.
+
+        Settings:
+
+        * ``ACCESS_LOG_FORMAT``: ``"apache"`` (default), ``"json"`` or
+          ``"logfmt"``. The ``json`` and ``logfmt`` formats include the
+          request duration (in milliseconds) as ``duration_ms``.
+        * ``ACCESS_LOG_DURATION``: if ``True``, the request duration is also
+          appended to ``apache`` lines as an extra last field (by default
+          they are unchanged, so existing log parsers keep working).
+        * ``ACCESS_LOG_ASYNC``: if ``True``, access log lines are logged from
+          a background thread (see ``dwdj.log.AsyncLogQueue``) so slow log
+          handlers don't stall requests. Lines are dropped (and counted in
+          ``AccessLogMiddleware.shared_log_queue.dropped``) if more than
+          ``ACCESS_LOG_QUEUE_SIZE`` (default 10000) are waiting.
+    """
 
     access_log = logging.getLogger("accesslog.access")
     error_log = logging.getLogger("accesslog.error")
 
+    shared_log_queue = None
+
     def __init__(self):
         logging.getLogger("django.request").setLevel(logging.CRITICAL)
+        self.log_format = getattr(s, "ACCESS_LOG_FORMAT", "apache")
+        if self.log_format not in ["apache", "json", "logfmt"]:
+            raise ValueError("invalid ACCESS_LOG_FORMAT: %r" %(self.log_format, ))
+        self.log_duration = getattr(s, "ACCESS_LOG_DURATION", False)
+        self.log_queue = None
+        if getattr(s, "ACCESS_LOG_ASYNC", False):
+            cls = AccessLogMiddleware
+            if cls.shared_log_queue is None:
+                cls.shared_log_queue = AsyncLogQueue(
+                    getattr(s, "ACCESS_LOG_QUEUE_SIZE", 10000),
+                )
+            self.log_queue = cls.shared_log_queue
 
-    def format_log(self, request, status_code, body_bytes):
+    def process_request(self, request):
+        request._access_log_start = time.time()
+
+    def get_log_fields(self, request, status_code, body_bytes):
         env = request.META
+        now = time.time()
+        start = getattr(request, "_access_log_start", None)
         user = getattr(request, "user", None)
         username = user and user.username or "-"
         su_state = getattr(request, "su_state", None)
+        acting_as = None
         if su_state is not None and su_state.old_user is not None:
-            username = '"%s acting-as %s"' %(
-                su_state.old_user.username, username,
-            )
-        return ('%s %s %s [%s] "%s %s %s" %s %s' %(
-            env.get("REMOTE_ADDR"),
-            hex(id(request))[-6:],
+            acting_as = username
+            username = su_state.old_user.username
+        return {
+            "remote_addr": env.get("REMOTE_ADDR"),
+            "request_id": hex(id(request))[-6:],
+            "user": username,
+            "acting_as": acting_as,
+            "time": _log_timestamp(now),
+            "method": env.get("REQUEST_METHOD"),
+            "path": env.get("PATH_INFO"),
+            "protocol": env.get("SERVER_PROTOCOL"),
+            "status": status_code,
+            "bytes": body_bytes or None,
+            "duration_ms": (
+                None if start is None else
+                round((now - start) * 1000, 1)
+            ),
+        }
+
+    def format_log(self, request, status_code, body_bytes):
+        fields = self.get_log_fields(request, status_code, body_bytes)
+        if self.log_format == "json":
+            return json.dumps(fields)
+        if self.log_format == "logfmt":
+            return " ".join(
+                "%s=%s" %(key, json.dumps(fields[key]) if isinstance(
+                    fields[key], basestring) else fields[key])
+                for key in sorted(fields)
+                if fields[key] is not None
+            ).encode("utf-8")
+        username = fields["user"]
+        if fields["acting_as"] is not None:
+            username = '"%s acting-as %s"' %(username, fields["acting_as"])
+        line = '%s %s %s [%s] "%s %s %s" %s %s' %(
+            fields["remote_addr"],
+            fields["request_id"],
             username,
-            datetime.utcnow().strftime("%d/%b/%Y:%H:%M:%S -0000"),
-            env.get("REQUEST_METHOD"),
-            env.get("PATH_INFO"),
-            env.get("SERVER_PROTOCOL"),
+            fields["time"],
+            fields["method"],
+            fields["path"],
+            fields["protocol"],
             status_code,
             body_bytes or "-",
-        )).encode("utf-8")
+        )
+        if self.log_duration:
+            duration = fields["duration_ms"]
+            line += " %s" %("-" if duration is None else duration, )
+        return line.encode("utf-8")
 
     def process_response(self, request, response):
         body_bytes_func = getattr(response.content, "__len__", None)
@@ -77,10 +169,11 @@ class AccessLogMiddleware(object):
             body_bytes = 0
         status = response.status_code
         formatted = self.format_log(request, status, body_bytes)
-        if status < 500:
-            self.access_log.info(formatted)
+        level = logging.INFO if status < 500 else logging.WARNING
+        if self.log_queue is not None:
+            self.log_queue.log(self.access_log, level, formatted)
         else:
-            self.access_log.warning(formatted)
+            self.access_log.log(level, formatted)
         return response
 
     def process_exception(self, request, exception):
@@ -91,9 +184,282 @@ class AccessLogMiddleware(object):
         self.error_log.exception(self.format_log(request, 500, 0))
 
 
+class CacheRequestScopeMiddleware(object):
+    """ Enables the "request scope" of ``dwdj.cache.SwappableCache`` (see its
+        docstring) for each request, so repeated gets of the same key only
+        hit the backend once and views can use ``cache.prefetch(...)``. """
+
+    def get_cache(self):
+        from django.core.cache import cache
+        return cache
+
+    def process_request(self, request):
+        self.get_cache().begin_request_scope()
+
+    def process_response(self, request, response):
+        self.get_cache().end_request_scope()
+        return response
+
+    def process_exception(self, request, exception):
+        # ``process_response`` isn't guaranteed to run after an exception, and
+        # a scope left behind would serve stale values to whatever the thread
+        # does next.
+        self.get_cache().end_request_scope()
+
+
+class ResponseCacheMiddleware(object):
+    """ Caches entire responses using ``dwdj.response_cache.ResponseCache``
+        (by default only anonymous ``GET`` and ``HEAD`` requests are cached).
+
+        Configured with these settings:
+
+        * ``RESPONSE_CACHE_TIMEOUT`` (default: the cache's default timeout)
+        * ``RESPONSE_CACHE_QUERY_PARAMS`` (default: the whole query string)
+        * ``RESPONSE_CACHE_HEADERS`` (default: none)
+        * ``RESPONSE_CACHE_MAX_SIZE`` (default: 1MB)
+
+        Note: this must come after ``AuthenticationMiddleware``, since the
+        default cache key depends on ``request.user``.
+    """
+
+    def __init__(self):
+        self.response_cache = ResponseCache(
+            timeout=getattr(s, "RESPONSE_CACHE_TIMEOUT", DEFAULT_TIMEOUT),
+            key=ResponseCacheKey(
+                query_params=getattr(s, "RESPONSE_CACHE_QUERY_PARAMS", None),
+                headers=getattr(s, "RESPONSE_CACHE_HEADERS", ()),
+            ),
+            max_size=getattr(s, "RESPONSE_CACHE_MAX_SIZE", 1 << 20),
+        )
+
+    def process_request(self, request):
+        key = self.response_cache.get_key(request)
+        request._response_cache_key = key
+        if key is None:
+            return None
+        response = self.response_cache.lookup(request, key)
+        if response is not None:
+            request._response_cache_key = None
+        return response
+
+    def process_response(self, request, response):
+        key = getattr(request, "_response_cache_key", None)
+        if key is None:
+            return response
+        return self.response_cache.store(request, key, response)
+
+
+class ProfilingMiddleware(object):
+    """ Records the wall and CPU time of each request, broken down into
+        middleware, view, template rendering and database time, and
+        aggregated by URL name (see ``dwdj.profiling``).
+
+        This must be the *last* middleware in ``MIDDLEWARE_CLASSES`` so that
+        the "view" phase only includes the view (including any rendering it
+        does); everything else from ``request_started`` to
+        ``request_finished`` is counted as "middleware".
+
+        Settings:
+
+        * ``PROFILING_DUMP_DIR``: directory where each process writes its
+          stats every ``PROFILING_DUMP_INTERVAL`` (default 60) seconds. Use
+          ``./manage.py profilestats`` to show the slowest endpoints.
+        * ``PROFILING_SAMPLE_RATE``: if set, one in this many views is run
+          under ``cProfile``, and the aggregated profile is dumped along with
+          the stats.
+    """
+
+    profiler = None
+
+    def __init__(self):
+        from django.core.signals import request_started, request_finished
+        cls = ProfilingMiddleware
+        if cls.profiler is None:
+            cls.profiler = profiling.RequestProfiler(
+                sample_rate=getattr(s, "PROFILING_SAMPLE_RATE", 0),
+                dump_dir=getattr(s, "PROFILING_DUMP_DIR", None),
+                dump_interval=getattr(s, "PROFILING_DUMP_INTERVAL", 60),
+            )
+            profiling.install_hooks()
+            request_started.connect(self._request_started, weak=False)
+            request_finished.connect(self._request_finished, weak=False)
+
+    def _request_started(self, **kwargs):
+        self.profiler.begin()
+
+    def _request_finished(self, **kwargs):
+        self.profiler.finish()
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        timer = profiling.current_request()
+        if timer is None:
+            return
+        match = getattr(request, "resolver_match", None)
+        timer.endpoint = (
+            match and match.url_name or
+            "%s.%s" %(view_func.__module__, getattr(view_func, "__name__", "?"))
+        )
+        timer.view_start = time.time()
+        if timer.profile is not None:
+            timer.profile.enable()
+            timer.profile_enabled = True
+
+    def process_response(self, request, response):
+        timer = profiling.current_request()
+        if timer is not None and timer.view_start is not None:
+            if timer.profile is not None:
+                timer.profile.disable()
+            timer.view_time = time.time() - timer.view_start
+        return response
+
+
+_REGEX_SPECIAL = set(".^$*+?{}[]\\|()")
+_REGEX_QUANTIFIERS = set("*+?{")
+
+def regex_literal_prefix(pattern):
+    """ Returns ``(prefix, rest)``, where ``prefix`` is the literal string that
+        any match of the regular expression ``pattern`` must start with, and
+        ``rest`` is the remainder of the pattern. Patterns which aren't
+        anchored with ``^`` have an empty prefix.
+
+        >>> regex_literal_prefix(r"^foo/(?P<id>\\d+)/$")
+        ('foo/', '(?P<id>\\\\d+)/$')
+        >>> regex_literal_prefix(r"^a\\.b/?$")
+        ('a.b', '/?$')
+        >>> regex_literal_prefix(r"^static/")
+        ('static/', '')
+        >>> regex_literal_prefix(r"^a\\\\b*")
+        ('a\\\\', 'b*')
+        >>> regex_literal_prefix(r"^a|b")
+        ('', '^a|b')
+        >>> regex_literal_prefix(r"foo/$")
+        ('', 'foo/$')
+    """
+    if not pattern.startswith("^"):
+        return "", pattern
+    depth = 0
+    escaped = False
+    in_class = False
+    for char in pattern:
+        if escaped:
+            escaped = False
+        elif char == "\\":
+            escaped = True
+        elif in_class:
+            in_class = char != "]"
+        elif char == "[":
+            in_class = True
+        elif char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif char == "|" and depth == 0:
+            return "", pattern
+    prefix = []
+    starts = []
+    i = 1
+    while i < len(pattern):
+        char = pattern[i]
+        starts.append(i)
+        if char == "\\":
+            next_char = pattern[i + 1:i + 2]
+            if not next_char or next_char.isalnum():
+                starts.pop()
+                break
+            char = next_char
+            i += 1
+        elif char in _REGEX_SPECIAL:
+            starts.pop()
+            break
+        prefix.append(char)
+        i += 1
+    if pattern[i:i + 1] in _REGEX_QUANTIFIERS and prefix:
+        # The last character is optional (or repeated), so it isn't part of
+        # the prefix.
+        prefix.pop()
+        i = starts.pop()
+    return "".join(prefix), pattern[i:]
+
+
+def url_prefixes(resolver, prefix="", prefixes=None, exact=None):
+    """ Returns ``(prefixes, exact)``: sets of the literal prefixes and the
+        exact paths (from patterns like ``^about/$``) which any path matched
+        by ``resolver`` must start with or be equal to (see
+        ``regex_literal_prefix``). ``prefixes`` will contain ``""`` if some
+        pattern could match any path. """
+    try:
+        from django.core.urlresolvers import LocaleRegexURLResolver
+    except ImportError:
+        LocaleRegexURLResolver = ()
+    if prefixes is None:
+        prefixes, exact = set(), set()
+    if isinstance(resolver, LocaleRegexURLResolver):
+        # The pattern depends on the active language
+        prefixes.add(prefix)
+        return prefixes, exact
+    pattern_prefix, rest = regex_literal_prefix(resolver.regex.pattern)
+    prefix += pattern_prefix
+    patterns = getattr(resolver, "url_patterns", None)
+    if rest == "$" and patterns is None:
+        exact.add(prefix)
+    elif rest or not patterns:
+        prefixes.add(prefix)
+    else:
+        for pattern in patterns:
+            url_prefixes(pattern, prefix, prefixes, exact)
+    return prefixes, exact
+
+
 class RemoveTrailingSlashMiddleware(object):
     """ The opposite of Django's ``APPEND_SLASH``, removes a trailing slash
-        from URLs when appropriate. """
+        from URLs when appropriate.
+
+        Resolving URLs can be slow, so the outcome for each path is cached in
+        an LRU of ``REMOVE_TRAILING_SLASH_CACHE_SIZE`` (default 10000, ``0``
+        to disable) entries. Paths which can't match any URL pattern (based
+        on the literal prefixes of the patterns; see ``url_prefixes``) are
+        never resolved at all. Both are reset when the URL resolver is
+        reloaded (ie, after ``urlresolvers.clear_url_caches()``). """
+
+    def __init__(self):
+        cache_size = getattr(s, "REMOVE_TRAILING_SLASH_CACHE_SIZE", 10000)
+        self.path_cache = None
+        if cache_size:
+            self.path_cache = LocalLRUCache(
+                max_entries=cache_size, timeout=float("inf"),
+            )
+        self._resolvers = {}
+
+    def _could_match(self, path, urlconf):
+        resolver = urlresolvers.get_resolver(urlconf)
+        cached = self._resolvers.get(urlconf)
+        if cached is None or cached[0] is not resolver:
+            prefixes, exact = url_prefixes(resolver)
+            prefixes = None if "" in prefixes else tuple(sorted(prefixes))
+            if cached is not None and self.path_cache is not None:
+                self.path_cache.clear()
+            cached = self._resolvers[urlconf] = (resolver, prefixes, exact)
+        _, prefixes, exact = cached
+        return prefixes is None or path in exact or path.startswith(prefixes)
+
+    def should_redirect(self, path, urlconf=None):
+        """ Returns ``True`` if ``path`` (which ends in a ``/``) isn't valid
+            but would be without the trailing slash. """
+        new_path = path.rstrip("/")
+        if not self._could_match(new_path, urlconf):
+            return False
+        key = (urlconf, path)
+        if self.path_cache is not None:
+            result = self.path_cache.get(key)
+            if result is not None:
+                return result
+        result = (
+            not urlresolvers.is_valid_path(path, urlconf) and
+            urlresolvers.is_valid_path(new_path, urlconf)
+        )
+        if self.path_cache is not None:
+            self.path_cache.set(key, result)
+        return result
 
     def process_request(self, request):
         old_path = request.path
@@ -102,14 +468,10 @@ class RemoveTrailingSlashMiddleware(object):
 
         urlconf = getattr(request, "urlconf", None)
 
-        if urlresolvers.is_valid_path(request.path_info, urlconf):
-            return
-
-        if not urlresolvers.is_valid_path(request.path_info.rstrip("/"), urlconf):
+        if not self.should_redirect(request.path_info, urlconf):
             return
 
         new_path = request.path.rstrip("/")
-
         if s.DEBUG and request.method == 'POST':
             raise RuntimeError((
                 "You called this URL via POST, but the URL should not end "
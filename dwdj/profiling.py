@@ -0,0 +1,262 @@
+""" Per-endpoint request timing used by ``dwdj.middleware.ProfilingMiddleware``
+    (see its docstring) and the ``profilestats`` management command. """
+
+import os
+import sys
+import json
+import math
+import time
+import glob
+import pstats
+import socket
+import cProfile
+import threading
+
+_local = threading.local()
+_rusage = None
+
+def cpu_time():
+    """ Returns the CPU time used by the current thread, or by the whole
+        process where per-thread usage isn't available.
+
+        ``resource`` is imported on first use (rather than when this module
+        is imported by ``dwdj.middleware``) because it doesn't exist on
+        every platform; without it, ``os.times()`` is used instead. """
+    global _rusage
+    if _rusage is None:
+        try:
+            import resource
+        except ImportError:
+            _rusage = (None, None)
+        else:
+            if hasattr(resource, "RUSAGE_THREAD"):
+                who = resource.RUSAGE_THREAD
+            elif sys.platform.startswith("linux"):
+                who = 1
+            else:
+                who = resource.RUSAGE_SELF
+            _rusage = (resource.getrusage, who)
+    getrusage, who = _rusage
+    if getrusage is None:
+        times = os.times()
+        return times[0] + times[1]
+    usage = getrusage(who)
+    return usage.ru_utime + usage.ru_stime
+
+
+def current_request():
+    """ Returns the ``RequestTimer`` for the request being handled by the
+        current thread (or ``None`` if it isn't being profiled). """
+    return getattr(_local, "timer", None)
+
+
+class RequestTimer(object):
+    """ Accumulates the time spent in each phase of a single request. """
+
+    def __init__(self):
+        self.start = time.time()
+        self.cpu_start = cpu_time()
+        self.endpoint = None
+        self.view_start = None
+        self.view_time = 0.0
+        self.template_time = 0.0
+        self.template_depth = 0
+        self.db_time = 0.0
+        self.db_queries = 0
+        self.profile = None
+        self.profile_enabled = False
+
+
+class EndpointStats(object):
+    """ Timing stats for one endpoint. Wall times are also recorded in a
+        log-scale histogram (four buckets per doubling, starting at 1ms) so
+        percentiles can be estimated. """
+
+    fields = ["count", "wall", "cpu", "view", "template", "db", "db_queries",
+              "middleware"]
+
+    def __init__(self, data=None):
+        data = data or {}
+        for field in self.fields:
+            setattr(self, field, data.get(field, 0))
+        self.buckets = dict(
+            (int(k), v) for (k, v) in data.get("buckets", {}).items()
+        )
+
+    def record(self, wall, cpu, view, template, db, db_queries):
+        self.count += 1
+        self.wall += wall
+        self.cpu += cpu
+        self.view += view
+        self.template += template
+        self.db += db
+        self.db_queries += db_queries
+        self.middleware += max(wall - view, 0)
+        bucket = int(math.log(max(wall * 1000, 1), 2) * 4)
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+
+    def merge(self, other):
+        for field in self.fields:
+            setattr(self, field, getattr(self, field) + getattr(other, field))
+        for bucket, count in other.buckets.items():
+            self.buckets[bucket] = self.buckets.get(bucket, 0) + count
+
+    def percentile(self, percentile):
+        """ Returns the approximate ``percentile`` wall time in seconds. """
+        target = self.count * percentile
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= target:
+                return 2 ** ((bucket + 1) / 4.0) / 1000.0
+        return None
+
+    def to_dict(self):
+        result = dict((field, getattr(self, field)) for field in self.fields)
+        result["buckets"] = self.buckets
+        return result
+
+
+class RequestProfiler(object):
+    """ Aggregates ``RequestTimer``s by endpoint, profiles one in every
+        ``sample_rate`` requests with ``cProfile``, and periodically dumps the
+        results to ``dump_dir`` (one file per process) so they can be read by
+        ``./manage.py profilestats``. """
+
+    def __init__(self, sample_rate=0, dump_dir=None, dump_interval=60):
+        self.sample_rate = sample_rate
+        self.dump_dir = dump_dir
+        self.dump_interval = dump_interval
+        self.endpoints = {}
+        self.profile_stats = None
+        self.request_count = 0
+        self._lock = threading.Lock()
+        self._next_dump = time.time() + dump_interval
+
+    def begin(self):
+        _local.timer = timer = RequestTimer()
+        self.request_count += 1
+        if self.sample_rate and self.request_count % self.sample_rate == 0:
+            timer.profile = cProfile.Profile()
+        return timer
+
+    def finish(self):
+        timer = current_request()
+        if timer is None:
+            return
+        _local.timer = None
+        if timer.profile is not None:
+            timer.profile.disable()
+        now = time.time()
+        wall = now - timer.start
+        cpu = cpu_time() - timer.cpu_start
+        with self._lock:
+            endpoint = timer.endpoint or "<unresolved>"
+            stats = self.endpoints.get(endpoint)
+            if stats is None:
+                stats = self.endpoints[endpoint] = EndpointStats()
+            stats.record(wall, cpu, timer.view_time, timer.template_time,
+                         timer.db_time, timer.db_queries)
+            # The profile is only enabled once the view is reached, and
+            # ``pstats`` raises a TypeError for a profile with no stats.
+            if timer.profile_enabled:
+                try:
+                    if self.profile_stats is None:
+                        self.profile_stats = pstats.Stats(timer.profile)
+                    else:
+                        self.profile_stats.add(timer.profile)
+                except TypeError:
+                    pass
+        if self.dump_dir and now > self._next_dump:
+            self.dump()
+
+    def dump(self):
+        """ Writes the aggregated stats to ``dump_dir``. """
+        self._next_dump = time.time() + self.dump_interval
+        if not os.path.isdir(self.dump_dir):
+            os.makedirs(self.dump_dir)
+        name = "%s-%s" %(socket.gethostname(), os.getpid())
+        with self._lock:
+            endpoints = dict(
+                (endpoint, stats.to_dict())
+                for (endpoint, stats) in self.endpoints.items()
+            )
+            path = os.path.join(self.dump_dir, "endpoints-%s.json" %(name, ))
+            with open(path + ".tmp", "w") as f:
+                json.dump(endpoints, f)
+            os.rename(path + ".tmp", path)
+            if self.profile_stats is not None:
+                path = os.path.join(self.dump_dir, "profile-%s.pstats" %(name, ))
+                self.profile_stats.dump_stats(path + ".tmp")
+                os.rename(path + ".tmp", path)
+
+
+def load_dumped_stats(dump_dir):
+    """ Returns ``(endpoints, profile_stats)``, merged from every process's
+        files in ``dump_dir``. ``profile_stats`` is a ``pstats.Stats`` (or
+        ``None`` if no requests were profiled). """
+    endpoints = {}
+    for path in glob.glob(os.path.join(dump_dir, "endpoints-*.json")):
+        with open(path) as f:
+            for endpoint, data in json.load(f).items():
+                stats = endpoints.setdefault(endpoint, EndpointStats())
+                stats.merge(EndpointStats(data))
+    profile_stats = None
+    for path in glob.glob(os.path.join(dump_dir, "profile-*.pstats")):
+        if profile_stats is None:
+            profile_stats = pstats.Stats(path)
+        else:
+            profile_stats.add(path)
+    return endpoints, profile_stats
+
+
+_hooks_installed = False
+
+def install_hooks():
+    """ Wraps Django's cursor and template rendering so database and
+        template time is added to the current ``RequestTimer``. Only requests
+        being profiled pay more than a thread-local lookup. """
+    global _hooks_installed
+    if _hooks_installed:
+        return
+    _hooks_installed = True
+
+    try:
+        from django.db.backends import utils as db_utils
+    except ImportError:
+        from django.db.backends import util as db_utils
+    from django.template.base import Template
+
+    def wrap_cursor_method(name):
+        orig = getattr(db_utils.CursorWrapper, name)
+        def cursor_method_wrapper(self, *args, **kwargs):
+            timer = current_request()
+            if timer is None:
+                return orig(self, *args, **kwargs)
+            start = time.time()
+            try:
+                return orig(self, *args, **kwargs)
+            finally:
+                timer.db_time += time.time() - start
+                timer.db_queries += 1
+        cursor_method_wrapper.__name__ = name
+        setattr(db_utils.CursorWrapper, name, cursor_method_wrapper)
+
+    wrap_cursor_method("execute")
+    wrap_cursor_method("executemany")
+
+    orig_render = Template.render
+    def render_wrapper(self, *args, **kwargs):
+        timer = current_request()
+        if timer is None:
+            return orig_render(self, *args, **kwargs)
+        # Only time the outermost render, since templates include templates
+        timer.template_depth += 1
+        start = time.time()
+        try:
+            return orig_render(self, *args, **kwargs)
+        finally:
+            timer.template_depth -= 1
+            if timer.template_depth == 0:
+                timer.template_time += time.time() - start
+    Template.render = render_wrapper
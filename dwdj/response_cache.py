@@ -0,0 +1,319 @@
+import hashlib
+from functools import wraps
+
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+try:
+    from django.http import CompatibleStreamingHttpResponse as StreamingHttpResponse
+except ImportError:
+    from django.http import StreamingHttpResponse
+try:
+    from django.core.cache.backends.base import DEFAULT_TIMEOUT
+except ImportError:
+    # Before Django 1.6, ``None`` meant "use the default timeout"
+    DEFAULT_TIMEOUT = None
+
+
+def default_user_segment(request):
+    """ Returns the "user segment" used as part of response cache keys. By
+        default only anonymous requests are cached (returning ``None`` means
+        "don't cache this request"), and every anonymous request is in the
+        same segment, so they all see the same response whatever cookies
+        they send. ``ResponseCache`` won't store responses which accessed
+        ``request.session``; if responses depend on other cookies, use a
+        ``user_segment`` which includes them. """
+    user = getattr(request, "user", None)
+    if user is not None and user.is_authenticated():
+        return None
+    return "anon"
+
+
+class ResponseCacheKey(object):
+    """ Builds cache keys for responses (or fragments) from the parts of the
+        request which the response depends on:
+
+        * ``host``: if ``True`` (default), the scheme (``http`` or
+          ``https``) and host (from ``request.get_host()``).
+        * ``path``: if ``True`` (default), the request path.
+        * ``query_params``: ``None`` (default) to include the entire query
+          string, or a list of the query parameters to include.
+        * ``headers``: a list of request headers (ex, ``"Accept-Language"``)
+          to include. These are also added to the response's ``Vary`` header.
+        * ``user_segment``: a function which takes the request and returns a
+          string which identifies the group of users who will see the same
+          response, or ``None`` if the response should not be cached (see
+          ``default_user_segment``).
+
+        For example::
+
+            key = ResponseCacheKey(query_params=["page"],
+                                   headers=["Accept-Language"])
+            @cache_response(timeout=60, key=key)
+            def article_list(request):
+                ...
+    """
+
+    def __init__(self, prefix="response", host=True, path=True,
+                 query_params=None, headers=(),
+                 user_segment=default_user_segment):
+        self.prefix = prefix
+        self.host = host
+        self.path = path
+        self.query_params = query_params
+        self.headers = list(headers)
+        self.user_segment = user_segment
+
+    def __call__(self, request, name=None):
+        """ Returns the key for ``request`` or ``None`` if the request should
+            not be cached. """
+        segment = self.user_segment(request)
+        if segment is None:
+            return None
+        parts = [name or "", segment]
+        if self.host:
+            parts.append("https" if request.is_secure() else "http")
+            parts.append(request.get_host())
+        if self.path:
+            parts.append(request.path)
+        if self.query_params is None:
+            parts.append(request.META.get("QUERY_STRING", ""))
+        else:
+            parts.extend(
+                "%s=%s" %(param, ",".join(request.GET.getlist(param)))
+                for param in self.query_params
+            )
+        for header in self.headers:
+            meta_name = "HTTP_" + header.upper().replace("-", "_")
+            parts.append(request.META.get(meta_name, ""))
+        digest = hashlib.md5("\0".join(
+            part.encode("utf-8") if isinstance(part, unicode) else part
+            for part in parts
+        )).hexdigest()
+        return "%s:%s" %(self.prefix, digest)
+
+
+class ResponseCache(object):
+    """ Caches complete responses in a Django cache (by default,
+        ``django.core.cache.cache``, which will be a ``SwappableCache``).
+
+        Only successful ``GET`` and ``HEAD`` responses which don't set cookies
+        and aren't marked ``private`` or ``no-store`` are cached. Responses
+        are also not cached if the view accessed ``request.session`` (since
+        they may differ between two requests in the same user segment;
+        session reads made while building the key, ex, by loading
+        ``request.user``, don't count), or
+        if they have a ``Vary`` header other than ``Cookie`` or one of the
+        key's ``headers`` (since the cache key doesn't include it). Each cached
+        response gets an ``ETag`` (an MD5 of its body), which is stored under
+        a separate key so a conditional request with a matching
+        ``If-None-Match`` can be answered with a ``304`` without fetching the
+        body or calling the view.
+
+        Streamed responses are stored as the list of chunks the view
+        generated, collected while they are sent to the client (responses
+        larger than ``max_size`` bytes aren't cached).
+
+        ``timeout`` defaults to the cache's default timeout. """
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT, key=None, cache=None,
+                 max_size=1 << 20):
+        self.timeout = timeout
+        self.key = key or ResponseCacheKey()
+        self._cache = cache
+        self.max_size = max_size
+
+    @property
+    def cache(self):
+        if self._cache is None:
+            from django.core.cache import cache
+            self._cache = cache
+        return self._cache
+
+    def get_key(self, request, name=None):
+        if request.method not in ("GET", "HEAD"):
+            return None
+        session = getattr(request, "session", None)
+        accessed = getattr(session, "accessed", None)
+        key = self.key(request, name)
+        if accessed is False and session.accessed:
+            # Building the key read the session (ex, ``request.user`` was
+            # loaded by ``user_segment``). Reset the flag so ``store`` can
+            # tell whether the view reads it too; ``_restore_session``
+            # sets it again.
+            session.accessed = False
+            request._response_cache_session_reset = True
+            if key is None:
+                self._restore_session(request)
+        return key
+
+    def _restore_session(self, request):
+        if getattr(request, "_response_cache_session_reset", False):
+            request._response_cache_session_reset = False
+            request.session.accessed = True
+
+    def _etag_matches(self, request, etag):
+        if_none_match = request.META.get("HTTP_IF_NONE_MATCH")
+        if not if_none_match or not etag:
+            return False
+        return if_none_match.strip() == "*" or etag in [
+            tag.strip() for tag in if_none_match.split(",")
+        ]
+
+    def not_modified(self, etag):
+        response = HttpResponseNotModified()
+        response["ETag"] = etag
+        self.patch_vary(response)
+        return response
+
+    def patch_vary(self, response):
+        vary = list(self.key.headers)
+        if self.key.user_segment is not None:
+            vary.append("Cookie")
+        if vary:
+            patch_vary_headers(response, vary)
+
+    def lookup(self, request, key):
+        """ Returns the cached response for ``request`` (or a ``304`` if the
+            cached ``ETag`` matches), or ``None``. """
+        response = self._lookup(request, key)
+        if response is not None:
+            self._restore_session(request)
+        return response
+
+    def _lookup(self, request, key):
+        if request.META.get("HTTP_IF_NONE_MATCH"):
+            etag = self.cache.get(key + ":etag")
+            if etag is not None and self._etag_matches(request, etag):
+                return self.not_modified(etag)
+        entry = self.cache.get(key)
+        if entry is None:
+            return None
+        if self._etag_matches(request, entry["etag"]):
+            return self.not_modified(entry["etag"])
+        body = entry["body"]
+        if isinstance(body, list):
+            response = StreamingHttpResponse(iter(body), status=entry["status"])
+        else:
+            response = HttpResponse(body, status=entry["status"])
+        for header, value in entry["headers"]:
+            response[header] = value
+        if entry["etag"]:
+            response["ETag"] = entry["etag"]
+        return response
+
+    def is_cacheable(self, response, request=None):
+        if response.status_code != 200 or response.cookies:
+            return False
+        cache_control = response.get("Cache-Control", "").lower()
+        if "private" in cache_control or "no-store" in cache_control:
+            return False
+        session = getattr(request, "session", None)
+        if session is not None and getattr(session, "accessed", False):
+            return False
+        allowed = set(h.lower() for h in self.key.headers + ["Cookie"])
+        vary = response.get("Vary", "")
+        return all(
+            header.strip().lower() in allowed
+            for header in vary.split(",") if header.strip()
+        )
+
+    def _headers(self, response):
+        return [
+            (header, value) for (header, value) in response.items()
+            if header.lower() not in ("etag", "content-length")
+        ]
+
+    def store(self, request, key, response):
+        """ Stores ``response`` in the cache (if it is cacheable), returning
+            the response which should be sent to the client. """
+        self.patch_vary(response)
+        cacheable = self.is_cacheable(response, request)
+        self._restore_session(request)
+        if not cacheable:
+            return response
+        if getattr(response, "streaming", False):
+            response.streaming_content = self._store_streaming(
+                key, response, response.streaming_content,
+            )
+            return response
+        body = response.content
+        if len(body) > self.max_size:
+            return response
+        etag = response.get("ETag") or '"%s"' %(hashlib.md5(body).hexdigest(), )
+        response["ETag"] = etag
+        self._set(key, response.status_code, self._headers(response), body, etag)
+        if self._etag_matches(request, etag):
+            return self.not_modified(etag)
+        return response
+
+    def _store_streaming(self, key, response, content):
+        status = response.status_code
+        headers = self._headers(response)
+        chunks = []
+        size = 0
+        md5 = hashlib.md5()
+        for chunk in content:
+            if chunks is not None:
+                size += len(chunk)
+                if size > self.max_size:
+                    chunks = None
+                else:
+                    chunks.append(chunk)
+                    md5.update(chunk)
+            yield chunk
+        if chunks is not None:
+            etag = '"%s"' %(md5.hexdigest(), )
+            self._set(key, status, headers, chunks, etag)
+
+    def _set(self, key, status, headers, body, etag):
+        self.cache.set_many({
+            key: {
+                "status": status,
+                "headers": headers,
+                "body": body,
+                "etag": etag,
+            },
+            key + ":etag": etag,
+        }, self.timeout)
+
+    def __call__(self, view, name=None):
+        @wraps(view)
+        def cache_response_helper(request, *args, **kwargs):
+            key = self.get_key(request, name or view.__module__ + "." +
+                               view.__name__)
+            if key is None:
+                return view(request, *args, **kwargs)
+            response = self.lookup(request, key)
+            if response is None:
+                response = self.store(request, key,
+                                      view(request, *args, **kwargs))
+            return response
+        return cache_response_helper
+
+
+def cache_response(timeout=DEFAULT_TIMEOUT, key=None, cache=None,
+                   max_size=1 << 20):
+    """ A view decorator which caches the view's responses (see
+        ``ResponseCache`` and ``ResponseCacheKey``)::
+
+            @cache_response(timeout=60)
+            def homepage(request):
+                return r2r(request, "homepage.html")
+    """
+    return ResponseCache(timeout=timeout, key=key, cache=cache,
+                         max_size=max_size)
+
+
+def cached_fragment(request, name, render, timeout=DEFAULT_TIMEOUT, key=None,
+                    cache=None):
+    """ Returns a cached fragment (ex, a rendered template snippet) built by
+        calling ``render()``, keyed on ``name`` and the parts of ``request``
+        used by ``key`` (a ``ResponseCacheKey``; by default the whole path
+        and query string). ``SwappableCache.get_or_set`` is used so only one
+        process renders a fragment at a time. """
+    if cache is None:
+        from django.core.cache import cache
+    key = (key or ResponseCacheKey(prefix="fragment"))(request, name)
+    if key is None:
+        return render()
+    return cache.get_or_set(key, render, timeout=timeout)
@@ -1,5 +1,12 @@
+import types
+import operator
 import textwrap
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 def truncate(s, max_len=80):
     if len(s) > max_len:
         return s[:max_len - 3] + "..."
@@ -78,6 +85,87 @@ def to_unicode(obj, encoding='utf-8', fallback='latin1', **decode_args):
     except UnicodeDecodeError:
         return unicode(obj_str, fallback, **decode_args)
 
+def _str_strategy(cls, encoding, encode_args):
+    if cls is str:
+        return None
+    if cls is types.InstanceType:
+        # Old-style instances all share one type, so check each instance
+        return lambda obj: to_str(obj, encoding, **encode_args)
+    if issubclass(cls, unicode) or hasattr(cls, "__unicode__"):
+        return lambda obj: unicode(obj).encode(encoding, **encode_args)
+    # Note: subclasses of ``str`` are converted too (as ``to_str`` does)
+    return str
+
+def _unicode_strategy(cls, encoding, fallback, decode_args):
+    if cls is unicode:
+        return None
+    if cls is types.InstanceType:
+        return lambda obj: to_unicode(obj, encoding, fallback, **decode_args)
+    if issubclass(cls, unicode) or hasattr(cls, "__unicode__"):
+        return unicode
+    def to_unicode_helper(obj):
+        obj_str = obj if cls is str else str(obj)
+        try:
+            return unicode(obj_str, encoding, **decode_args)
+        except UnicodeDecodeError:
+            return unicode(obj_str, fallback, **decode_args)
+    return to_unicode_helper
+
+def _convert_many(objs, get_strategy, on_error):
+    if on_error not in ["raise", "skip", "repr"]:
+        raise ValueError("invalid on_error: %r" %(on_error, ))
+    strategies = {}
+    for obj in objs:
+        cls = type(obj)
+        try:
+            strategy = strategies[cls]
+        except KeyError:
+            strategy = strategies[cls] = get_strategy(cls)
+        if strategy is None:
+            yield obj
+            continue
+        try:
+            yield strategy(obj)
+        except Exception:
+            if on_error == "raise":
+                raise
+            if on_error == "repr":
+                yield repr(obj)
+
+def to_str_many(objs, encoding='utf-8', on_error="raise", **encode_args):
+    r"""
+    Returns an iterator over ``to_str(obj)`` for each of ``objs``. The
+    conversion strategy is chosen once per type (instead of once per value),
+    which makes it faster than calling ``to_str`` for each value.
+
+    If ``on_error`` is ``"skip"`` values which can't be converted are skipped,
+    and if it is ``"repr"`` their ``repr`` is used instead. Additional
+    arguments (ex, ``errors="replace"``) are passed to ``unicode.encode``.
+
+        >>> list(to_str_many(["\xff", u"\u1234", Exception(u"\u1234"), 42]))
+        ['\xff', '\xe1\x88\xb4', '\xe1\x88\xb4', '42']
+        >>> list(to_str_many([u"\u1234", 42], encoding="ascii", on_error="repr"))
+        ["u'\\u1234'", '42']
+    """
+    return _convert_many(
+        objs, lambda cls: _str_strategy(cls, encoding, encode_args), on_error,
+    )
+
+def to_unicode_many(objs, encoding='utf-8', fallback='latin1',
+                    on_error="raise", **decode_args):
+    r"""
+    Returns an iterator over ``to_unicode(obj)`` for each of ``objs``. See
+    ``to_str_many``.
+
+        >>> list(to_unicode_many(['\xe1\x88\xb4', '\xff', Exception(u'\u1234'), 42]))
+        [u'\u1234', u'\xff', u'\u1234', u'42']
+    """
+    return _convert_many(
+        objs,
+        lambda cls: _unicode_strategy(cls, encoding, fallback, decode_args),
+        on_error,
+    )
+
 def to_base(number, alphabet):
     if not isinstance(number, (int, long)):
         raise TypeError('number must be an integer')
@@ -94,8 +182,144 @@ def to_base(number, alphabet):
         in_base.append(alphabet[i])
     return "".join(reversed(in_base))
 
+BASE36_ALPHABET = '0123456789abcdefghijklmnopqrstuvwxyz'
+
 def to36(number):
-    return to_base(number, '0123456789abcdefghijklmnopqrstuvwxyz')
+    return base36.encode(number)
+
+class BaseCodec(object):
+    """ Converts non-negative integers to and from strings of digits from
+        ``alphabet``, using lookup tables so ``chunk_digits`` digits are
+        converted per ``divmod``. If ``width`` is given, encoded strings are
+        padded to ``width`` digits (so they sort in numeric order).
+
+        >>> b36 = BaseCodec(BASE36_ALPHABET)
+        >>> b36.encode(1296), b36.decode('100')
+        ('100', 1296)
+        >>> hexcodec = BaseCodec('0123456789abcdef', width=4)
+        >>> list(hexcodec.encode_many([0, 255, 65535]))
+        ['0000', '00ff', 'ffff']
+        >>> list(hexcodec.decode_many(['00ff', 'ffff']))
+        [255, 65535]
+        >>> b62 = BaseCodec('0123456789abcdefghijklmnopqrstuvwxyz'
+        ...                 'ABCDEFGHIJKLMNOPQRSTUVWXYZ')
+        >>> b62.encode(2**62 - 1), b62.decode(b62.encode(2**62 - 1)) == 2**62 - 1
+        ('5uFzovh2zo3', True)
+
+        ``encode_many`` and ``decode_many`` accept any iterable and return
+        iterators. If NumPy is installed and ``encode_many`` is passed a
+        NumPy integer array, the conversion is vectorized.
+    """
+
+    def __init__(self, alphabet, width=None, chunk_digits=2):
+        if len(set(alphabet)) != len(alphabet) or len(alphabet) < 2:
+            raise ValueError("invalid alphabet: %r" %(alphabet, ))
+        self.alphabet = alphabet
+        self.base = len(alphabet)
+        self.width = width
+        self.chunk_digits = chunk_digits
+        self._chunk_base = self.base ** chunk_digits
+        chunks = [""]
+        for _ in range(chunk_digits):
+            chunks = [c + d for c in chunks for d in alphabet]
+        self._encode_chunks = chunks
+        self._decode_chunks = dict((c, i) for (i, c) in enumerate(chunks))
+        self._decode_digits = dict((d, i) for (i, d) in enumerate(alphabet))
+        # ``int(s, base)`` is much faster than anything we can do in Python,
+        # so use it when the alphabet is compatible.
+        self._use_int = (
+            self.base <= 36 and alphabet == BASE36_ALPHABET[:self.base]
+        )
+
+    def encode(self, number):
+        number = operator.index(number)
+        if number < 0:
+            raise ValueError('number must be nonnegative')
+        zero = self.alphabet[0]
+        if number < self.base:
+            encoded = self.alphabet[number]
+        else:
+            chunks = self._encode_chunks
+            chunk_base = self._chunk_base
+            digits = []
+            while number:
+                number, i = divmod(number, chunk_base)
+                digits.append(chunks[i])
+            digits.reverse()
+            encoded = "".join(digits).lstrip(zero)
+        if self.width is not None:
+            if len(encoded) > self.width:
+                raise ValueError("%r is too long for width %s"
+                                 %(encoded, self.width))
+            encoded = encoded.rjust(self.width, zero)
+        return encoded
+
+    def decode(self, encoded):
+        # ``strip`` leaves something behind iff there is a digit which isn't
+        # in the alphabet. This also stops ``int`` from accepting strings the
+        # table lookup wouldn't (ex, "-1", " 1f ", "0x1f" or "1F").
+        if not encoded or encoded.strip(self.alphabet):
+            raise ValueError("invalid digits for alphabet %r: %r"
+                             %(self.alphabet, encoded))
+        if self._use_int:
+            return int(encoded, self.base)
+        chunk_digits = self.chunk_digits
+        chunks = self._decode_chunks
+        chunk_base = self._chunk_base
+        head = len(encoded) % chunk_digits
+        result = 0
+        for digit in encoded[:head]:
+            result = result * self.base + self._decode_digits[digit]
+        for i in xrange(head, len(encoded), chunk_digits):
+            result = result * chunk_base + chunks[encoded[i:i + chunk_digits]]
+        return result
+
+    def encode_many(self, numbers):
+        if numpy is not None and isinstance(numbers, numpy.ndarray):
+            return iter(self._encode_numpy(numbers))
+        return (self.encode(number) for number in numbers)
+
+    def decode_many(self, encoded):
+        return (self.decode(x) for x in encoded)
+
+    def _encode_numpy(self, numbers):
+        numbers = numpy.asarray(numbers)
+        if numbers.dtype.kind not in "iu":
+            raise TypeError('numbers must be integers')
+        if len(numbers) == 0:
+            return []
+        if numbers.min() < 0:
+            raise ValueError('number must be nonnegative')
+        remaining = numbers.astype(numpy.uint64).ravel()
+        width = self.width
+        if width is None:
+            width = len(self.encode(int(remaining.max())))
+        digits = numpy.empty((len(remaining), width), dtype=numpy.intp)
+        for i in xrange(width - 1, -1, -1):
+            digits[:, i] = remaining % self.base
+            remaining //= self.base
+        if remaining.any():
+            raise ValueError("number is too long for width %s" %(width, ))
+        chars = numpy.frombuffer(self.alphabet, dtype=numpy.uint8)[digits]
+        result = chars.view("S%s" %(width, )).ravel().tolist()
+        if self.width is None:
+            zero = self.alphabet[0]
+            result = [x.lstrip(zero) or zero for x in result]
+        return result
+
+
+base36 = BaseCodec(BASE36_ALPHABET)
+
+def to36_many(numbers):
+    """ Returns a list of ``to36(n)`` for each of ``numbers``, but faster
+        (see ``BaseCodec``)::
+
+        >>> to36_many([0, 35, 36, 1295, 1296, 2**62 - 1])
+        ['0', 'z', '10', 'zz', '100', 'z1ci99jj7473']
+        >>> to36_many([2**62 - 1]) == [to36(2**62 - 1)]
+        True
+    """
+    return list(base36.encode_many(numbers))
 
 def from36(str):
     return int(str, 36)
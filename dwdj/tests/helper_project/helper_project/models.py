@@ -2,3 +2,14 @@ from django.db import models as m
 
 class HelperModel(m.Model):
     number = m.IntegerField()
+
+from dwdj.fields import IDField
+
+class IDModel(m.Model):
+    id = IDField()
+
+class BigIDModel(m.Model):
+    id = IDField(storage="bigint", generator="monotonic")
+
+class BigIDChild(m.Model):
+    parent = m.ForeignKey(BigIDModel)
@@ -74,6 +74,9 @@ MIDDLEWARE_CLASSES = (
 
 ROOT_URLCONF = 'helper_project.urls'
 
+# Used by ``IDField(generator="monotonic")`` (see ``BigIDModel``)
+IDFIELD_WORKER_ID = 1
+
 TEMPLATE_DIRS = (
     # Put strings here, like "/home/html/django_templates" or "C:/www/django/templates".
     # Always use forward slashes, even on Windows.
@@ -0,0 +1,338 @@
+import time
+import threading
+
+from mock import patch
+from nose.tools import assert_equal, raises
+from django.core.cache import get_cache
+
+from ..cache import (
+    SwappableCache, ShardedCache, CachedValue, summarize_cache_stats,
+)
+
+
+def locmem_cache(**options):
+    cache = SwappableCache("locmem", {"OPTIONS": options})
+    cache.set_backend(get_cache("django.core.cache.backends.locmem.LocMemCache"))
+    cache.clear()
+    return cache
+
+
+class TestL1Cache(object):
+    def test_l1_hit(self):
+        cache = locmem_cache(L1_MAX_ENTRIES=10)
+        cache.set("foo", 42)
+        assert_equal(cache.get("foo"), 42)
+        cache._backend.delete("foo")
+        assert_equal(cache.get("foo"), 42)
+        assert_equal(cache.l1_stats()["hits"], 1)
+
+    def test_l1_invalidated_by_set(self):
+        cache = locmem_cache(L1_MAX_ENTRIES=10)
+        cache.set("foo", 1)
+        assert_equal(cache.get_many(["foo", "bar"]), {"foo": 1})
+        cache.set("foo", 2)
+        assert_equal(cache.get("foo"), 2)
+
+    def test_l1_disabled(self):
+        cache = locmem_cache()
+        cache.set("foo", 1)
+        assert_equal(cache.get("foo"), 1)
+        assert_equal(cache.l1_stats(), None)
+
+
+def expires_in(backend, key):
+    """ Returns the number of seconds until ``key`` expires in the locmem
+        ``backend`` (or ``None`` if it never expires). """
+    expiry = backend._expire_info[backend.make_key(key)]
+    return expiry and expiry - time.time()
+
+
+class TestTimeouts(object):
+    def assert_default_timeout(self, backend, key):
+        remaining = expires_in(backend, key)
+        assert remaining is not None, "%r never expires" %(key, )
+        assert abs(remaining - backend.default_timeout) < 5, remaining
+
+    def test_default_timeout(self):
+        cache = locmem_cache()
+        cache.set("a", 1)
+        cache.add("b", 2)
+        cache.set_many({"c": 3})
+        cache.set("forever", 4, None)
+        for key in "abc":
+            self.assert_default_timeout(cache._backend, key)
+        assert_equal(expires_in(cache._backend, "forever"), None)
+
+    def test_default_timeout_write_behind(self):
+        cache = locmem_cache(WRITE_BEHIND={"linger": 0})
+        cache.set("a", 1)
+        assert cache.flush_writes(timeout=5)
+        self.assert_default_timeout(cache._backend, "a")
+
+    def test_default_timeout_get_or_set(self):
+        cache = locmem_cache()
+        cache.get_or_set("a", lambda: 1)
+        self.assert_default_timeout(cache._backend, "a")
+
+
+class TestSharedState(object):
+    def test_threads_share_state(self):
+        # Since Django 1.7 each thread gets its own SwappableCache instance
+        params = {"OPTIONS": {
+            "L1_MAX_ENTRIES": 10,
+            "L1_TIMEOUT": 60,
+            "WRITE_BEHIND": {"linger": 0},
+        }}
+        backend = get_cache("django.core.cache.backends.locmem.LocMemCache")
+        main = SwappableCache("shared-state-test", params)
+        main.set_backend(backend)
+        other = SwappableCache("shared-state-test", dict(params))
+        other.set_backend(backend)
+        main.set("k", "old")
+        assert_equal(main.get("k"), "old")
+
+        thread = threading.Thread(target=lambda: other.set("k", "new"))
+        thread.start()
+        thread.join()
+        assert_equal(main.get("k"), "new")
+        assert main._write_behind is other._write_behind
+        assert main._flight_locks is other._flight_locks
+        assert main.flush_writes(timeout=5)
+        assert_equal(backend.get("k"), "new")
+
+    def test_sharded_aliases_dont_share_state(self):
+        params = {"OPTIONS": {"L1_MAX_ENTRIES": 10, "L1_TIMEOUT": 60}}
+        a = SwappableCache("shard-a1;shard-a2", dict(params))
+        b = SwappableCache("shard-b1;shard-b2", dict(params))
+        assert a._l1 is not b._l1
+        assert a._flight_locks is not b._flight_locks
+        again = SwappableCache("shard-a2,shard-a1", dict(params))
+        assert again._l1 is a._l1
+        locmem = "django.core.cache.backends.locmem.LocMemCache"
+        a.set_backend(get_cache(locmem, LOCATION="shard-a"))
+        b.set_backend(get_cache(locmem, LOCATION="shard-b"))
+        b.set("k", "from b")
+        assert_equal(a.get("k"), None)
+
+
+class TestRequestScope(object):
+    def test_get_is_deduplicated(self):
+        cache = locmem_cache()
+        cache.set("foo", 1)
+        cache.begin_request_scope()
+        assert_equal(cache.get("foo"), 1)
+        assert_equal(cache.get("foo"), 1)
+        assert_equal(cache.get("missing", "default"), "default")
+        stats = cache.end_request_scope()
+        assert_equal(stats["hits"], 1)
+        assert_equal(stats["round_trips"], 2)
+
+    def test_deferred_gets_are_batched(self):
+        cache = locmem_cache()
+        cache.set_many({"a": 1, "b": 2})
+        cache.begin_request_scope()
+        a = cache.get_deferred("a")
+        b = cache.get_deferred("b")
+        assert_equal((a.get(), b.get()), (1, 2))
+        assert_equal(cache.end_request_scope()["round_trips"], 1)
+
+    def test_prefetch_and_set(self):
+        cache = locmem_cache()
+        cache.set("a", 1)
+        cache.begin_request_scope()
+        cache.prefetch(["a", "b"])
+        assert_equal(cache.get_many(["a", "b"]), {"a": 1})
+        cache.set("a", 2)
+        assert_equal(cache.get("a"), 2)
+        assert_equal(cache.end_request_scope()["round_trips"], 2)
+
+
+class TestGetOrSet(object):
+    def test_computes_once(self):
+        cache = locmem_cache()
+        calls = []
+        func = lambda: calls.append(1) or len(calls)
+        assert_equal(cache.get_or_set("foo", func, timeout=60), 1)
+        assert_equal(cache.get_or_set("foo", func, timeout=60), 1)
+        assert_equal(calls, [1])
+
+    def test_stale_value_served_while_locked(self):
+        cache = locmem_cache()
+        cache.set("foo", CachedValue("stale", time.time() - 1, 0), 60)
+        # Pretend another process is refreshing the value
+        cache.add("dwdj-lock:foo", 1, 30)
+        assert_equal(cache.get_or_set("foo", lambda: "fresh"), "stale")
+
+    def test_stale_value_refreshed(self):
+        cache = locmem_cache()
+        cache.set("foo", CachedValue("stale", time.time() - 1, 0), 60)
+        assert_equal(cache.get_or_set("foo", lambda: "fresh"), "fresh")
+        assert_equal(cache.get_or_set("foo", lambda: "other"), "fresh")
+        assert_equal(cache.get("dwdj-lock:foo"), None)
+
+    def test_other_values_are_misses(self):
+        cache = locmem_cache()
+        cache.set("foo", "plain")
+        assert_equal(cache.get_or_set("foo", lambda: "fresh"), "fresh")
+        assert_equal(cache.get("foo").value, "fresh")
+
+    def test_foreign_lock_not_deleted(self):
+        cache = locmem_cache()
+        cache.add("dwdj-lock:foo", 1, 30)
+        result = cache.get_or_set("foo", lambda: "fresh", lock_timeout=0.1)
+        assert_equal(result, "fresh")
+        assert_equal(cache.get("dwdj-lock:foo"), 1)
+
+    def test_locks_are_per_key(self):
+        cache = locmem_cache()
+        assert cache._flight_locks.acquire(("foo", None))
+        try:
+            assert_equal(cache.get_or_set("bar", lambda: "bar"), "bar")
+        finally:
+            cache._flight_locks.release(("foo", None))
+        assert_equal(len(cache._flight_locks), 0)
+
+
+class TestValueCodec(object):
+    def test_codec_round_trip(self):
+        cache = locmem_cache(CODEC={"compress_threshold": 10})
+        value = {"foo": ["bar"] * 100}
+        cache.set("foo", value)
+        assert_equal(cache.get("foo"), value)
+        assert_equal(cache.get_many(["foo"]), {"foo": value})
+        assert cache.codec_stats()["bytes_saved"] > 0
+
+    def test_codec_incr(self):
+        cache = locmem_cache(CODEC={})
+        cache.set("count", 1)
+        cache.incr("count")
+        assert_equal(cache.get("count"), 2)
+
+
+class TestShardedCache(object):
+    def test_keys_are_sharded(self):
+        locmem = "django.core.cache.backends.locmem.LocMemCache"
+        shards = dict(
+            ("shard%s" %(i, ), get_cache(locmem, LOCATION="shard%s" %(i, )))
+            for i in range(3)
+        )
+        cache = SwappableCache("locmem")
+        cache.set_backend(ShardedCache(shards))
+        data = dict(("key%s" %(i, ), i) for i in range(30))
+        cache.set_many(data)
+        assert_equal(cache.get_many(data.keys()), data)
+        assert_equal(cache.get("key1"), 1)
+        for shard in shards.values():
+            assert 0 < len(shard.get_many(data.keys())) < len(data)
+
+    def test_placement_is_stable(self):
+        locmem = "django.core.cache.backends.locmem.LocMemCache"
+        def placements():
+            sharded = ShardedCache(dict(
+                (name, get_cache(locmem, LOCATION=name))
+                for name in ["a", "b", "c"]
+            ))
+            inverse = dict((v, k) for (k, v) in sharded.backends.items())
+            return [inverse[sharded.get_shard("key%s" %(i, ))]
+                    for i in range(30)]
+        assert_equal(placements(), placements())
+
+    @raises(ValueError)
+    def test_unnamed_backends_rejected(self):
+        locmem = "django.core.cache.backends.locmem.LocMemCache"
+        ShardedCache([get_cache(locmem, LOCATION="shard")])
+
+
+class TestCacheStats(object):
+    def test_stats_recorded(self):
+        cache = locmem_cache(STATS=True)
+        cache.set("user:1", "alex")
+        cache.get("user:1")
+        cache.get("user:2")
+        snapshot = cache.report_stats()
+        summary = dict(
+            ((row["prefix"], row["op"]), row)
+            for row in summarize_cache_stats(snapshot)
+        )
+        assert_equal(summary["user", "get"]["count"], 2)
+        assert_equal(summary["user", "get"]["hit_ratio"], 0.5)
+        assert_equal(summary["user", "set"]["count"], 1)
+        published = summarize_cache_stats(cache.get_published_stats())
+        assert_equal(len(published), 2)
+
+    def test_zero_hit_ratio(self):
+        cache = locmem_cache(STATS=True)
+        cache.get("missing:1")
+        cache.get("missing:2")
+        summary = summarize_cache_stats(cache.report_stats())
+        assert_equal(summary[0]["prefix"], "missing")
+        assert_equal(summary[0]["hit_ratio"], 0.0)
+
+    def test_batch_latency_split(self):
+        cache = locmem_cache(STATS=True)
+        cache.report_stats()
+        backend = cache._backend
+        def slow_get_many(keys, version=None):
+            time.sleep(0.04)
+            return {}
+        backend.get_many = slow_get_many
+        cache.get_many(["batch:%s" %(i, ) for i in range(4)])
+        summary = summarize_cache_stats(cache.report_stats())
+        row = [r for r in summary if r["op"] == "get_many"][0]
+        assert_equal(row["count"], 4)
+        assert_equal(row["hit_ratio"], 0.0)
+        # Each key is charged about 10ms of the 40ms batch
+        assert row["p99"] < 20, row
+
+
+class TestTags(object):
+    def test_invalidate_tag(self):
+        cache = locmem_cache()
+        cache.set("a", 1, tags=["foo"])
+        cache.set("b", 2, tags=["foo", "bar"])
+        cache.set("c", 3, tags=["bar"])
+        assert_equal(cache.get("a"), 1)
+        assert_equal(cache.get_many(["a", "b", "c"]), {"a": 1, "b": 2, "c": 3})
+        cache.invalidate_tag("foo")
+        assert_equal(cache.get("a", "missing"), "missing")
+        assert_equal(cache.get_many(["a", "b", "c"]), {"c": 3})
+
+    def test_tag_versions_fetched_with_value(self):
+        cache = locmem_cache()
+        cache.set("a", 1, tags=["foo"])
+        cache.begin_request_scope()
+        assert_equal(cache.get("a", tags=["foo"]), 1)
+        assert_equal(cache.end_request_scope()["round_trips"], 1)
+
+
+class TestWriteBehind(object):
+    def test_reads_see_pending_writes(self):
+        cache = locmem_cache(WRITE_BEHIND={"linger": 0.1})
+        cache.set("a", 1)
+        cache.set_many({"b": 2, "c": 3})
+        cache.delete("c")
+        assert_equal(cache.get("a"), 1)
+        assert_equal(cache.get_many(["a", "b", "c"]), {"a": 1, "b": 2})
+        assert "a" in cache and "b" in cache
+        assert "c" not in cache
+        assert cache.has_key("a")
+        assert not cache.has_key("c")
+        assert cache.flush_writes(timeout=5)
+        assert_equal(cache._backend.get_many(["a", "b", "c"]), {"a": 1, "b": 2})
+        stats = cache.write_behind_stats()
+        # The set and delete of "c" are coalesced into one delete
+        assert_equal((stats["queued"], stats["written"]), (4, 3))
+
+    def test_writer_restarted_after_fork(self):
+        cache = locmem_cache(WRITE_BEHIND={"linger": 0})
+        cache.set("a", 1)
+        assert cache.flush_writes(timeout=5)
+        queue = cache._write_behind
+        parent_thread = queue._thread
+        # The forked child inherits ``_thread``, but not the running thread
+        with patch("os.getpid", return_value=-1):
+            cache.set("b", 2)
+            assert queue._thread is not parent_thread
+            assert_equal(queue._pid, -1)
+        assert cache.flush_writes(timeout=5)
+        assert_equal(cache._backend.get("b"), 2)
@@ -0,0 +1,207 @@
+import time
+
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.db import connection
+from django.core.exceptions import ImproperlyConfigured
+
+from mock import Mock
+
+from helper_project.models import IDModel, BigIDModel, BigIDChild
+
+from ..fields import (
+    IDField, MonotonicIDGenerator, monotonic_ids, migrate_idfield_storage,
+)
+from ..strutil import from36
+
+
+class IDFieldDeconstructTestCase(TestCase):
+    def assert_round_trip(self, field, expected_kwargs):
+        name, path, args, kwargs = field.deconstruct()
+        self.assertEqual(path, "dwdj.fields.IDField")
+        self.assertEqual(kwargs, expected_kwargs)
+        new_field = IDField(*args, **kwargs)
+        self.assertEqual(new_field.storage, field.storage)
+        self.assertEqual(new_field.auto, field.auto)
+        self.assertEqual(new_field.primary_key, field.primary_key)
+        self.assertEqual(new_field.pad_ids, field.pad_ids)
+
+    def test_defaults(self):
+        self.assert_round_trip(IDField(), {})
+
+    def test_options(self):
+        self.assert_round_trip(
+            IDField(primary_key=False, auto=False, storage="bigint"),
+            {"primary_key": False, "auto": False, "storage": "bigint"},
+        )
+
+    def test_generator(self):
+        self.assert_round_trip(
+            IDField(generator="monotonic"), {"generator": "monotonic"},
+        )
+        generator = MonotonicIDGenerator(worker_id=3)
+        path, args, kwargs = generator.deconstruct()
+        self.assertEqual(path, "dwdj.fields.MonotonicIDGenerator")
+        self.assertEqual(kwargs, {"worker_id": 3})
+
+
+class IDFieldNewManyTestCase(TestCase):
+    def test_new_many(self):
+        start = int(time.time()) & ((1 << 30) - 1)
+        ids = IDField.new_many(5000)
+        end = int(time.time()) & ((1 << 30) - 1)
+        self.assertEqual(len(set(ids)), 5000)
+        for id in ids:
+            assert start <= from36(id) >> 32 <= end, id
+        self.assertEqual(IDField.new_many(0), [])
+
+    def test_assign_ids(self):
+        field = IDModel._meta.pk
+        objs = [IDModel(), IDModel(id="existing"), IDModel()]
+        self.assertEqual(field.assign_ids(objs), objs)
+        self.assertEqual(objs[1].id, "existing")
+        assert objs[0].id and objs[2].id and objs[0].id != objs[2].id
+        IDModel.objects.bulk_create(objs)
+        self.assertEqual(
+            sorted(IDModel.objects.values_list("id", flat=True)),
+            sorted(obj.id for obj in objs),
+        )
+
+    def test_assign_ids_generator(self):
+        objs = [BigIDModel() for _ in range(3)]
+        BigIDModel._meta.pk.assign_ids(objs)
+        ids = [obj.id for obj in objs]
+        self.assertEqual(ids, sorted(set(ids)))
+        assert all(len(id) == 12 for id in ids)
+        BigIDModel.objects.bulk_create(objs)
+        found = BigIDModel.objects.order_by("id").values_list("id", flat=True)
+        self.assertEqual(list(found), ids)
+
+
+class IDFieldStorageTestCase(TestCase):
+    def test_char_round_trip(self):
+        obj = IDModel.objects.create()
+        self.assertEqual(len(obj.id), 12)
+        self.assertEqual(IDModel.objects.get(id=obj.id).id, obj.id)
+
+    def test_bigint_round_trip(self):
+        field = BigIDModel._meta.pk
+        obj = BigIDModel.objects.create()
+        prepped = field.get_prep_value(obj.id)
+        assert isinstance(prepped, (int, long))
+        self.assertEqual(
+            field.from_db_value(prepped, None, connection, {}), obj.id,
+        )
+        self.assertEqual(BigIDModel.objects.get(id=obj.id).id, obj.id)
+        self.assertEqual(BigIDModel.objects.get(id=prepped).id, obj.id)
+
+    def test_in_lookup(self):
+        for model in [IDModel, BigIDModel]:
+            objs = [model.objects.create() for _ in range(3)]
+            ids = [obj.id for obj in objs[:2]]
+            found = model.objects.filter(id__in=ids).values_list("id")
+            self.assertEqual(sorted(id for (id, ) in found), sorted(ids))
+
+    def test_bigint_foreign_key(self):
+        parent = BigIDModel.objects.create()
+        BigIDChild.objects.create(parent=parent)
+        child = BigIDChild.objects.get()
+        self.assertEqual(child.parent_id, parent.id)
+        self.assertEqual(
+            list(BigIDChild.objects.values_list("parent_id", flat=True)),
+            [parent.id],
+        )
+        children = BigIDChild.objects.all()
+        self.assertEqual(children.filter(parent_id=parent.id).count(), 1)
+        self.assertEqual(children.filter(parent=parent).count(), 1)
+        self.assertEqual(parent.bigidchild_set.get(), child)
+
+    def test_monotonic_ids_padded(self):
+        obj = BigIDModel.objects.create()
+        self.assertEqual(len(obj.id), 12)
+        self.assertEqual(BigIDModel.objects.get().id, obj.id)
+        assert monotonic_ids.new() > obj.id
+
+
+class MonotonicIDGeneratorTestCase(TestCase):
+    def test_ids_increase(self):
+        generator = MonotonicIDGenerator(worker_id=1)
+        ids = [generator.new() for _ in range(100)] + generator.new_many(5000)
+        self.assertEqual(ids, sorted(set(ids)))
+        assert all(len(id) == 12 for id in ids)
+
+    def test_sequence_overflow(self):
+        generator = MonotonicIDGenerator(worker_id=1)
+        ints = generator.new_ints(5000)
+        self.assertEqual(ints, sorted(set(ints)))
+        ts_shift = generator.worker_bits + generator.sequence_bits
+        timestamps = set(i >> ts_shift for i in ints)
+        assert len(timestamps) >= 3, timestamps
+
+    def test_worker_id(self):
+        sequence_bits = MonotonicIDGenerator.sequence_bits
+        with override_settings(IDFIELD_WORKER_ID=42):
+            generator = MonotonicIDGenerator()
+            worker = (generator.new_ints(1)[0] >> sequence_bits) & 1023
+        self.assertEqual(worker, 42)
+        generator = MonotonicIDGenerator(worker_id=7)
+        worker = (generator.new_ints(1)[0] >> sequence_bits) & 1023
+        self.assertEqual(worker, 7)
+        with override_settings(IDFIELD_WORKER_ID=lambda: 9):
+            generator = MonotonicIDGenerator()
+            worker = (generator.new_ints(1)[0] >> sequence_bits) & 1023
+        self.assertEqual(worker, 9)
+
+    def test_worker_id_required(self):
+        with override_settings(IDFIELD_WORKER_ID=None):
+            generator = MonotonicIDGenerator()
+            self.assertRaises(ImproperlyConfigured, generator.new)
+            # Still raises, rather than using a half-initialized worker ID
+            self.assertRaises(ImproperlyConfigured, generator.new)
+        for worker_id in [-1, 1024]:
+            generator = MonotonicIDGenerator(worker_id=worker_id)
+            self.assertRaises(ImproperlyConfigured, generator.new)
+
+    def test_random_sequence_start(self):
+        # Two generators with the same worker ID should (almost always)
+        # start their sequences at different values.
+        mask = (1 << MonotonicIDGenerator.sequence_bits) - 1
+        starts = set(
+            MonotonicIDGenerator(worker_id=1).new_ints(1)[0] & mask
+            for _ in range(20)
+        )
+        assert len(starts) > 1, starts
+        assert max(starts) < 1024, starts
+
+
+class MigrateIDFieldStorageTestCase(TestCase):
+    def column_types(self, **kwargs):
+        cursor = Mock()
+        cursor.fetchall.return_value = [
+            ("child_fk", "myapp_child", "account_id", "FOREIGN KEY ..."),
+        ]
+        migrate_idfield_storage(cursor, "myapp_account", **kwargs)
+        return [
+            call[0][0].split(" TYPE ", 1)[1]
+            for call in cursor.execute.call_args_list
+            if " ALTER COLUMN " in call[0][0]
+        ]
+
+    def test_to_bigint(self):
+        self.assertEqual(self.column_types(), [
+            'BIGINT USING dwdj_from36("id")',
+            'BIGINT USING dwdj_from36("account_id")',
+        ])
+
+    def test_to_char(self):
+        self.assertEqual(self.column_types(to="char"), [
+            'CHAR(12) USING dwdj_to36("id")',
+            'CHAR(12) USING dwdj_to36("account_id")',
+        ])
+        self.assertEqual(self.column_types(to="char", pad=True), [
+            'CHAR(12) USING lpad(dwdj_to36("id"), 12, \'0\')',
+            'CHAR(12) USING lpad(dwdj_to36("account_id"), 12, \'0\')',
+        ])
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, self.column_types, to="text")
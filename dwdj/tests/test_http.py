@@ -0,0 +1,287 @@
+import os
+import gzip
+import mmap
+import shutil
+import tempfile
+from StringIO import StringIO
+
+from nose.tools import assert_equal, raises
+from django.test import RequestFactory
+from django.test.utils import override_settings
+from django.utils.http import http_date
+
+from ..http import file_response, data_response, check_conditions
+
+factory = RequestFactory()
+
+
+def content(response):
+    return "".join(response.streaming_content)
+
+
+class FileTestBase(object):
+    data = "".join("line %s\n" %(i, ) for i in range(1000))
+
+    def setup(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "data.txt")
+        with open(self.path, "wb") as f:
+            f.write(self.data)
+
+    def teardown(self):
+        shutil.rmtree(self.dir)
+
+
+class TestCheckConditions(object):
+    etag = '"abc"'
+    mtime = 1000000000
+
+    def status(self, method="GET", **headers):
+        request = getattr(factory, method.lower())("/", **headers)
+        response = check_conditions(request, self.etag, self.mtime)
+        return response and response.status_code
+
+    def test_no_conditions(self):
+        assert_equal(self.status(), None)
+
+    def test_if_match(self):
+        assert_equal(self.status(HTTP_IF_MATCH='"abc"'), None)
+        assert_equal(self.status(HTTP_IF_MATCH='"x", "abc"'), None)
+        assert_equal(self.status(HTTP_IF_MATCH="*"), None)
+        assert_equal(self.status(HTTP_IF_MATCH='"x"'), 412)
+        # If-Match uses the strong comparison
+        assert_equal(self.status(HTTP_IF_MATCH='W/"abc"'), 412)
+
+    def test_if_unmodified_since(self):
+        before, after = http_date(self.mtime - 1), http_date(self.mtime)
+        assert_equal(self.status(HTTP_IF_UNMODIFIED_SINCE=after), None)
+        assert_equal(self.status(HTTP_IF_UNMODIFIED_SINCE=before), 412)
+        # If-Unmodified-Since is ignored when there is an If-Match
+        assert_equal(self.status(HTTP_IF_MATCH='"abc"',
+                                 HTTP_IF_UNMODIFIED_SINCE=before), None)
+
+    def test_if_none_match(self):
+        assert_equal(self.status(HTTP_IF_NONE_MATCH='"x"'), None)
+        assert_equal(self.status(HTTP_IF_NONE_MATCH='"abc"'), 304)
+        assert_equal(self.status(HTTP_IF_NONE_MATCH='W/"abc"'), 304)
+        assert_equal(self.status(HTTP_IF_NONE_MATCH="*"), 304)
+        assert_equal(self.status("POST", HTTP_IF_NONE_MATCH='"abc"'), 412)
+
+    def test_not_modified_headers(self):
+        request = factory.get("/", HTTP_IF_NONE_MATCH='"abc"')
+        response = check_conditions(request, self.etag, self.mtime)
+        assert_equal(response["ETag"], self.etag)
+        assert_equal(response["Last-Modified"], http_date(self.mtime))
+
+    def test_if_modified_since(self):
+        before, after = http_date(self.mtime - 1), http_date(self.mtime)
+        assert_equal(self.status(HTTP_IF_MODIFIED_SINCE=after), 304)
+        assert_equal(self.status(HTTP_IF_MODIFIED_SINCE=before), None)
+        assert_equal(self.status("POST", HTTP_IF_MODIFIED_SINCE=after), None)
+        # If-Modified-Since is ignored when there is an If-None-Match
+        assert_equal(self.status(HTTP_IF_NONE_MATCH='"x"',
+                                 HTTP_IF_MODIFIED_SINCE=after), None)
+
+    def test_precondition_before_not_modified(self):
+        # A failed If-Match wins over a matching If-None-Match
+        assert_equal(self.status(HTTP_IF_MATCH='"x"',
+                                 HTTP_IF_NONE_MATCH='"abc"'), 412)
+        assert_equal(self.status(
+            HTTP_IF_UNMODIFIED_SINCE=http_date(self.mtime - 1),
+            HTTP_IF_MODIFIED_SINCE=http_date(self.mtime),
+        ), 412)
+
+    def test_data_response_etag(self):
+        def get(**headers):
+            request = factory.get("/", HTTP_ACCEPT_ENCODING="gzip", **headers)
+            return data_response("hello", request=request, gzip=True,
+                                 etag=True)
+        etag = get()["ETag"]
+        assert etag.endswith('-gzip"'), etag
+        response = get(HTTP_IF_NONE_MATCH=etag)
+        assert_equal(response.status_code, 304)
+        assert_equal(response["Vary"], "Accept-Encoding")
+
+
+def gunzip(data):
+    return gzip.GzipFile(fileobj=StringIO(data)).read()
+
+
+class TestDataResponse(FileTestBase):
+    def check(self, data, expected, size):
+        response = data_response(data, chunk_size=7)
+        assert_equal(content(response), expected)
+        assert_equal(response.get("Content-Length"), size and str(size))
+
+    def test_input_types(self):
+        data = self.data
+        self.check(data, data, len(data))
+        self.check(bytearray(data), data, len(data))
+        self.check(buffer(data), data, len(data))
+        self.check(memoryview(data), data, len(data))
+        self.check(["abc", "def"], "abcdef", None)
+        self.check(iter(["abc", "def"]), "abcdef", None)
+
+    def test_unicode(self):
+        response = data_response(u"\u1234", mimetype="text/plain")
+        assert_equal(content(response), "\xe1\x88\xb4")
+        assert_equal(response["Content-Type"], "text/plain; charset=utf-8")
+        assert "Content-Encoding" not in response
+
+    def test_file_objects(self):
+        # StringIOs are sent in full, files from their current position
+        sio = StringIO(self.data)
+        sio.read(10)
+        self.check(sio, self.data, len(self.data))
+        f = open(self.path, "rb")
+        f.read(10)
+        self.check(f, self.data[10:], len(self.data) - 10)
+        assert f.closed
+
+    def test_mmap(self):
+        with open(self.path, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.check(mapped, self.data, len(self.data))
+
+    def test_gzip(self):
+        request = factory.get("/", HTTP_ACCEPT_ENCODING="gzip, deflate")
+        response = data_response(iter([self.data]), request=request,
+                                 gzip=True)
+        assert_equal(response["Content-Encoding"], "gzip")
+        assert_equal(response["Vary"], "Accept-Encoding")
+        assert "Content-Length" not in response
+        assert_equal(gunzip(content(response)), self.data)
+
+    def test_gzip_not_accepted(self):
+        for accept in ["", "gzip;q=0", "identity"]:
+            request = factory.get("/", HTTP_ACCEPT_ENCODING=accept)
+            response = data_response(self.data, request=request, gzip=True)
+            assert "Content-Encoding" not in response
+            assert_equal(response["Vary"], "Accept-Encoding")
+            assert_equal(content(response), self.data)
+
+    def test_gzip_skipped_with_encoding(self):
+        request = factory.get("/", HTTP_ACCEPT_ENCODING="gzip")
+        response = data_response("compressed", request=request, gzip=True,
+                                 encoding="br")
+        assert_equal(response["Content-Encoding"], "br")
+        assert_equal(content(response), "compressed")
+
+
+class TestFileResponse(FileTestBase):
+    def get(self, **kwargs):
+        headers = dict(
+            (key, kwargs.pop(key)) for key in list(kwargs)
+            if key.startswith("HTTP_")
+        )
+        return file_response(factory.get("/data.txt", **headers), self.path,
+                             **kwargs)
+
+    def test_full(self):
+        response = self.get()
+        assert_equal(response.status_code, 200)
+        assert_equal(response["Accept-Ranges"], "bytes")
+        assert_equal(response["Content-Length"], str(len(self.data)))
+        assert_equal(content(response), self.data)
+
+    def test_range(self):
+        for use_mmap in [False, True]:
+            response = self.get(HTTP_RANGE="bytes=10-19", use_mmap=use_mmap,
+                                chunk_size=3)
+            assert_equal(response.status_code, 206)
+            assert_equal(response["Content-Range"],
+                         "bytes 10-19/%s" %(len(self.data), ))
+            assert_equal(response["Content-Length"], "10")
+            assert_equal(content(response), self.data[10:20])
+
+    def test_suffix_range(self):
+        response = self.get(HTTP_RANGE="bytes=-5")
+        assert_equal(response.status_code, 206)
+        assert_equal(content(response), self.data[-5:])
+
+    def test_unsatisfiable_range(self):
+        response = self.get(HTTP_RANGE="bytes=%s-" %(len(self.data), ))
+        assert_equal(response.status_code, 416)
+        assert_equal(response["Content-Range"],
+                     "bytes */%s" %(len(self.data), ))
+
+    def test_if_range(self):
+        full = self.get()
+        etag = full["ETag"]
+        response = self.get(HTTP_RANGE="bytes=0-4", HTTP_IF_RANGE=etag)
+        assert_equal(response.status_code, 206)
+        response = self.get(HTTP_RANGE="bytes=0-4",
+                            HTTP_IF_RANGE=full["Last-Modified"])
+        assert_equal(response.status_code, 206)
+        # A changed entity (or a weak ETag) means the whole file is sent
+        for if_range in ['"other"', "W/" + etag, http_date(0)]:
+            response = self.get(HTTP_RANGE="bytes=0-4", HTTP_IF_RANGE=if_range)
+            assert_equal(response.status_code, 200)
+            assert_equal(content(response), self.data)
+
+    def test_offload_sendfile(self):
+        response = self.get(offload="x-sendfile", HTTP_RANGE="bytes=0-4")
+        assert_equal(response.status_code, 200)
+        assert_equal(response["X-Sendfile"], os.path.abspath(self.path))
+        assert_equal(response["Content-Type"], "text/plain")
+        assert "ETag" in response
+
+    def test_offload_accel_redirect(self):
+        prefixes = {self.dir + "/": "/protected/"}
+        with override_settings(FILE_RESPONSE_ACCEL_REDIRECT_PREFIXES=prefixes):
+            response = self.get(offload="x-accel-redirect")
+        assert_equal(response["X-Accel-Redirect"], "/protected/data.txt")
+
+    def test_offload_unmapped_path_streams(self):
+        with override_settings(FILE_RESPONSE_ACCEL_REDIRECT_PREFIXES={}):
+            response = self.get(offload="x-accel-redirect")
+        assert "X-Accel-Redirect" not in response
+        assert_equal(content(response), self.data)
+
+    @raises(ValueError)
+    def test_offload_invalid_mode(self):
+        self.get(offload="carrier-pigeon")
+
+
+class TestPrecompressed(FileTestBase):
+    def setup(self):
+        super(TestPrecompressed, self).setup()
+        self.cache_dir = os.path.join(self.dir, "cache")
+        self.settings = override_settings(
+            FILE_RESPONSE_PRECOMPRESSED=True,
+            FILE_RESPONSE_COMPRESS_CACHE_DIR=self.cache_dir,
+        )
+        self.settings.enable()
+
+    def teardown(self):
+        self.settings.disable()
+        super(TestPrecompressed, self).teardown()
+
+    def get(self, **headers):
+        headers.setdefault("HTTP_ACCEPT_ENCODING", "gzip")
+        return file_response(factory.get("/data.txt", **headers), self.path)
+
+    def test_compressed_copy_created(self):
+        response = self.get()
+        assert_equal(response["Content-Encoding"], "gzip")
+        body = gzip.GzipFile(fileobj=StringIO(content(response))).read()
+        assert_equal(body, self.data)
+        assert_equal(len(os.listdir(self.cache_dir)), 1)
+        assert os.listdir(self.cache_dir)[0].endswith(".gz")
+
+    def test_not_modified_doesnt_compress(self):
+        etag = self.get()["ETag"]
+        shutil.rmtree(self.cache_dir)
+        response = self.get(HTTP_IF_NONE_MATCH=etag)
+        assert_equal(response.status_code, 304)
+        assert_equal(response["ETag"], etag)
+        assert "Accept-Encoding" in response["Vary"]
+        assert not os.path.exists(self.cache_dir)
+
+    def test_sibling_preferred(self):
+        with open(self.path + ".br", "wb") as f:
+            f.write("brotli")
+        response = self.get(HTTP_ACCEPT_ENCODING="gzip, br")
+        assert_equal(response["Content-Encoding"], "br")
+        assert_equal(content(response), "brotli")
+        assert not os.path.exists(self.cache_dir)
@@ -0,0 +1,47 @@
+import logging
+
+from mock import patch
+from nose.tools import assert_equal
+
+from ..log import AsyncLogQueue
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+class TestAsyncLogQueue(object):
+    def setup(self):
+        self.handler = ListHandler()
+        self.logger = logging.getLogger("dwdj.tests.test_log")
+        self.logger.addHandler(self.handler)
+        self.logger.setLevel(logging.INFO)
+        self.logger.propagate = False
+
+    def teardown(self):
+        self.logger.removeHandler(self.handler)
+
+    def test_log(self):
+        queue = AsyncLogQueue()
+        queue.log(self.logger, logging.INFO, "hello %s", "world")
+        queue.log(self.logger, logging.DEBUG, "ignored")
+        assert queue.flush()
+        assert_equal(self.handler.messages, ["hello world"])
+        assert_equal(queue.logged, 1)
+
+    def test_thread_restarted_after_fork(self):
+        queue = AsyncLogQueue()
+        queue.log(self.logger, logging.INFO, "parent")
+        assert queue.flush()
+        parent_thread = queue._thread
+        # The forked child inherits ``_thread``, but not the running thread
+        with patch("os.getpid", return_value=-1):
+            queue.log(self.logger, logging.INFO, "child")
+            assert queue._thread is not parent_thread
+        assert queue.flush()
+        assert_equal(self.handler.messages, ["parent", "child"])
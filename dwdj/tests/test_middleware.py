@@ -0,0 +1,125 @@
+from mock import patch
+from nose.tools import assert_equal
+from django.http import HttpResponse
+from django.test import RequestFactory
+from django.test.utils import override_settings
+from django.conf.urls import url, include
+from django.core import urlresolvers
+
+from ..middleware import (
+    AccessLogMiddleware, RemoveTrailingSlashMiddleware, url_prefixes,
+    CacheRequestScopeMiddleware,
+)
+from .test_cache import locmem_cache
+
+factory = RequestFactory()
+
+def view(request, *args):
+    return HttpResponse("ok")
+
+urlpatterns = [
+    url(r"^about/$", view),
+    url(r"^articles/(\d+)$", view),
+    url(r"^blog/", include([
+        url(r"^$", view),
+        url(r"^post-(?P<slug>[\w-]+)$", view),
+    ])),
+]
+
+URLCONF = __name__
+
+
+class TestAccessLogMiddleware(object):
+    def log_line(self, start=100.0, now=100.0):
+        request = factory.get("/foo")
+        request._access_log_start = start
+        with patch("dwdj.middleware.time.time", return_value=now):
+            return AccessLogMiddleware().format_log(request, 200, 5)
+
+    def test_apache_default(self):
+        line = self.log_line(now=100.25)
+        assert line.endswith('"GET /foo HTTP/1.1" 200 5'), line
+
+    @override_settings(ACCESS_LOG_DURATION=True)
+    def test_apache_duration(self):
+        assert self.log_line(now=100.25).endswith(" 200 5 250.0")
+        assert self.log_line().endswith(" 200 5 0.0")
+        assert self.log_line(start=None).endswith(" 200 5 -")
+
+    @override_settings(ACCESS_LOG_FORMAT="logfmt")
+    def test_logfmt(self):
+        line = self.log_line(now=100.5)
+        assert "duration_ms=500.0" in line.split(), line
+        assert "status=200" in line.split(), line
+
+
+class TestCacheRequestScopeMiddleware(object):
+    def setup(self):
+        self.cache = locmem_cache()
+        self.middleware = CacheRequestScopeMiddleware()
+        self.middleware.get_cache = lambda: self.cache
+
+    def test_scope_ended_on_exception(self):
+        request = factory.get("/")
+        self.middleware.process_request(request)
+        self.cache.get("a")
+        self.middleware.process_exception(request, ValueError())
+        # Outside of a request, gets aren't served from the (stale) scope
+        self.cache._backend.set("a", 1)
+        assert_equal(self.cache.get("a"), 1)
+        assert_equal(self.cache.end_request_scope(), None)
+        # ... and a process_response after the exception is harmless
+        response = HttpResponse("error", status=500)
+        assert self.middleware.process_response(request, response) is response
+
+
+class TestRemoveTrailingSlashMiddleware(object):
+    def setup(self):
+        urlresolvers.clear_url_caches()
+        self.middleware = RemoveTrailingSlashMiddleware()
+
+    def should_redirect(self, path):
+        return self.middleware.should_redirect(path, URLCONF)
+
+    def test_url_prefixes(self):
+        resolver = urlresolvers.get_resolver(URLCONF)
+        assert_equal(url_prefixes(resolver), (
+            set(["/articles/", "/blog/post-"]),
+            set(["/about/", "/blog/"]),
+        ))
+
+    def test_should_redirect(self):
+        assert self.should_redirect("/articles/5/")
+        assert self.should_redirect("/blog/post-hello/")
+        assert not self.should_redirect("/about/")
+        assert not self.should_redirect("/blog/")
+        assert not self.should_redirect("/articles/x/")
+
+    def test_prefix_precheck(self):
+        with patch("django.core.urlresolvers.is_valid_path") as is_valid_path:
+            assert not self.should_redirect("/nothing/here/")
+            assert not self.should_redirect("/articlesx/")
+        assert_equal(is_valid_path.call_count, 0)
+
+    def test_cache_reset_with_resolver(self):
+        is_valid_path = urlresolvers.is_valid_path
+        with patch("django.core.urlresolvers.is_valid_path",
+                   wraps=is_valid_path) as mock_is_valid_path:
+            assert self.should_redirect("/articles/5/")
+            calls = mock_is_valid_path.call_count
+            assert self.should_redirect("/articles/5/")
+            assert_equal(mock_is_valid_path.call_count, calls)
+            urlresolvers.clear_url_caches()
+            assert self.should_redirect("/articles/5/")
+            assert_equal(mock_is_valid_path.call_count, calls * 2)
+
+    def test_process_request(self):
+        request = factory.get("/articles/5/?page=2")
+        request.urlconf = URLCONF
+        response = self.middleware.process_request(request)
+        assert_equal(response.status_code, 301)
+        assert_equal(response["Location"], "/articles/5?page=2")
+        for path in ["/", "/about/", "/articles/5"]:
+            request = factory.get(path)
+            request.urlconf = URLCONF
+            assert_equal(self.middleware.process_request(request), None)
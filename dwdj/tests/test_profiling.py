@@ -0,0 +1,167 @@
+import shutil
+import tempfile
+from StringIO import StringIO
+
+from mock import patch
+from django.test import TestCase
+from django.db import connection
+from django.template import Context, Template
+
+from helper_project.models import IDModel
+
+from .. import profiling
+from ..profiling import RequestProfiler, current_request, load_dumped_stats
+from ..management.commands.profilestats import Command
+
+
+def run_request(profiler, endpoint, work=lambda: None):
+    timer = profiler.begin()
+    timer.endpoint = endpoint
+    if timer.profile is not None:
+        timer.profile.enable()
+        timer.profile_enabled = True
+    work()
+    if timer.profile is not None:
+        timer.profile.disable()
+    profiler.finish()
+    return timer
+
+
+class RequestProfilerTestCase(TestCase):
+    def test_begin_finish(self):
+        profiler = RequestProfiler()
+        timer = profiler.begin()
+        self.assertIs(current_request(), timer)
+        timer.endpoint = "home"
+        profiler.finish()
+        self.assertIs(current_request(), None)
+        self.assertEqual(profiler.endpoints["home"].count, 1)
+        # Finishing without a current request is a no-op
+        profiler.finish()
+        self.assertEqual(profiler.endpoints["home"].count, 1)
+
+    def test_unresolved_endpoint(self):
+        profiler = RequestProfiler()
+        profiler.begin()
+        profiler.finish()
+        self.assertEqual(list(profiler.endpoints), ["<unresolved>"])
+
+    def test_no_sampling(self):
+        profiler = RequestProfiler(sample_rate=0)
+        for _ in range(3):
+            timer = run_request(profiler, "home")
+            self.assertIs(timer.profile, None)
+        self.assertIs(profiler.profile_stats, None)
+
+    def test_sample_every_request(self):
+        profiler = RequestProfiler(sample_rate=1)
+        for _ in range(3):
+            timer = run_request(profiler, "home", lambda: sum(range(100)))
+            assert timer.profile is not None
+        assert profiler.profile_stats is not None
+        self.assertEqual(profiler.endpoints["home"].count, 3)
+
+    def test_sampled_but_not_enabled(self):
+        # A profile which never reached the view has no stats to merge
+        profiler = RequestProfiler(sample_rate=1)
+        profiler.begin()
+        profiler.finish()
+        self.assertIs(profiler.profile_stats, None)
+
+
+class TimerHooksTestCase(TestCase):
+    def setUp(self):
+        profiling.install_hooks()
+        self.profiler = RequestProfiler()
+
+    def test_db_time(self):
+        def work():
+            cursor = connection.cursor()
+            cursor.execute("SELECT 1")
+            cursor.executemany(
+                "DELETE FROM %s WHERE id = %%s" %(IDModel._meta.db_table, ),
+                [("a", ), ("b", )],
+            )
+        timer = run_request(self.profiler, "db", work)
+        self.assertEqual(timer.db_queries, 2)
+        assert timer.db_time > 0
+        stats = self.profiler.endpoints["db"]
+        self.assertEqual(stats.db_queries, 2)
+        self.assertEqual(stats.db, timer.db_time)
+
+    def test_db_untimed_outside_request(self):
+        connection.cursor().execute("SELECT 1")
+        timer = run_request(self.profiler, "db")
+        self.assertEqual(timer.db_queries, 0)
+
+    def test_template_time(self):
+        inner = Template("{{ x }}")
+        outer = Template("{% for i in items %}{{ inner }}{% endfor %}")
+        class Inner(object):
+            def __unicode__(self):
+                return inner.render(Context({"x": 1}))
+        timer = run_request(self.profiler, "tmpl", lambda: outer.render(
+            Context({"items": range(3), "inner": Inner()})
+        ))
+        assert timer.template_time > 0
+        self.assertEqual(timer.template_depth, 0)
+        self.assertEqual(
+            self.profiler.endpoints["tmpl"].template, timer.template_time,
+        )
+
+
+class DumpTestCase(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def make_dumps(self):
+        for (pid, count) in [(1, 2), (2, 3)]:
+            profiler = RequestProfiler(sample_rate=1, dump_dir=self.dir)
+            for _ in range(count):
+                run_request(profiler, "slow", lambda: sum(range(1000)))
+            run_request(profiler, "fast")
+            with patch("os.getpid", return_value=pid):
+                profiler.dump()
+
+    def test_dump_and_load(self):
+        self.make_dumps()
+        endpoints, profile_stats = load_dumped_stats(self.dir)
+        self.assertEqual(sorted(endpoints), ["fast", "slow"])
+        self.assertEqual(endpoints["slow"].count, 5)
+        self.assertEqual(endpoints["fast"].count, 2)
+        self.assertEqual(sum(endpoints["slow"].buckets.values()), 5)
+        assert profile_stats is not None
+
+    def test_load_empty(self):
+        self.assertEqual(load_dumped_stats(self.dir), ({}, None))
+
+    def profilestats(self, **options):
+        options.setdefault("dir", self.dir)
+        options.setdefault("sort", "total")
+        options.setdefault("limit", 20)
+        options.setdefault("functions", False)
+        with patch("sys.stdout", new_callable=StringIO) as stdout:
+            result = Command().handle(**options)
+        self.assertEqual(result, 0)
+        return stdout.getvalue().splitlines()
+
+    def test_profilestats(self):
+        self.make_dumps()
+        lines = self.profilestats(sort="count")
+        assert lines[0].startswith("endpoint"), lines
+        self.assertEqual([line.split()[:2] for line in lines[1:]],
+                         [["slow", "5"], ["fast", "2"]])
+        lines = self.profilestats(sort="count", limit=1)
+        self.assertEqual([line.split()[0] for line in lines[1:]], ["slow"])
+
+    def test_profilestats_functions(self):
+        self.make_dumps()
+        output = "\n".join(self.profilestats(functions=True))
+        assert "cumulative" in output, output
+
+    def test_profilestats_empty(self):
+        lines = self.profilestats()
+        self.assertEqual(lines, ["No stats found in %r" %(self.dir, )])
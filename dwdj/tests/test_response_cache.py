@@ -0,0 +1,142 @@
+import time
+
+from nose.tools import assert_equal
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory, SimpleTestCase
+from django.core.cache import get_cache
+from django.test.utils import override_settings
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.contrib.auth.middleware import AuthenticationMiddleware
+
+from ..response_cache import ResponseCache
+
+factory = RequestFactory()
+
+
+def locmem_cache():
+    cache = get_cache("django.core.cache.backends.locmem.LocMemCache",
+                      LOCATION="test_response_cache")
+    cache.clear()
+    return cache
+
+
+class CountingView(object):
+    def __init__(self, make_response=lambda: HttpResponse("hello")):
+        self.calls = 0
+        self.make_response = make_response
+        self.__name__ = "counting_view"
+
+    def __call__(self, request):
+        self.calls += 1
+        return self.make_response()
+
+
+class TestResponseCache(object):
+    def setup(self):
+        self.cache = locmem_cache()
+        self.view = CountingView()
+        self.cached_view = ResponseCache(cache=self.cache)(self.view)
+
+    def test_hit(self):
+        first = self.cached_view(factory.get("/foo"))
+        second = self.cached_view(factory.get("/foo"))
+        assert_equal(self.view.calls, 1)
+        assert_equal(second.content, "hello")
+        assert_equal(second["ETag"], first["ETag"])
+        assert "Cookie" in second["Vary"]
+
+    def test_not_modified(self):
+        etag = self.cached_view(factory.get("/foo"))["ETag"]
+        response = self.cached_view(
+            factory.get("/foo", HTTP_IF_NONE_MATCH=etag))
+        assert_equal(response.status_code, 304)
+        assert_equal(response["ETag"], etag)
+        assert_equal(self.view.calls, 1)
+
+    def test_key_includes_host_and_scheme(self):
+        self.cached_view(factory.get("/foo", HTTP_HOST="a.example.com"))
+        self.cached_view(factory.get("/foo", HTTP_HOST="b.example.com"))
+        self.cached_view(factory.get("/foo", HTTP_HOST="a.example.com",
+                                     secure=True))
+        assert_equal(self.view.calls, 3)
+        self.cached_view(factory.get("/foo", HTTP_HOST="a.example.com"))
+        assert_equal(self.view.calls, 3)
+
+    def test_default_timeout(self):
+        self.cached_view(factory.get("/foo"))
+        key = ResponseCache(cache=self.cache).get_key(
+            factory.get("/foo"), __name__ + ".counting_view")
+        expires = self.cache._expire_info[self.cache.make_key(key)]
+        assert 0 < expires - time.time() <= self.cache.default_timeout
+
+    def test_session_responses_not_cached(self):
+        class Session(dict):
+            accessed = True
+        for _ in range(2):
+            request = factory.get("/foo")
+            request.session = Session()
+            self.cached_view(request)
+        assert_equal(self.view.calls, 2)
+
+    def test_unknown_vary_not_cached(self):
+        def make_response():
+            response = HttpResponse("hello")
+            response["Vary"] = "Accept-Language"
+            return response
+        self.view.make_response = make_response
+        self.cached_view(factory.get("/foo"))
+        self.cached_view(factory.get("/foo"))
+        assert_equal(self.view.calls, 2)
+
+    def test_streaming_store(self):
+        self.view.make_response = lambda: StreamingHttpResponse(
+            iter(["hel", "lo"]))
+        response = self.cached_view(factory.get("/foo"))
+        assert_equal("".join(response.streaming_content), "hello")
+        cached = self.cached_view(factory.get("/foo"))
+        assert_equal(self.view.calls, 1)
+        assert_equal("".join(cached.streaming_content), "hello")
+        response = self.cached_view(
+            factory.get("/foo", HTTP_IF_NONE_MATCH=cached["ETag"]))
+        assert_equal(response.status_code, 304)
+
+
+@override_settings(
+    SESSION_ENGINE="django.contrib.sessions.backends.signed_cookies",
+)
+class ResponseCacheWithAuthTestCase(SimpleTestCase):
+    """ Requests go through ``SessionMiddleware`` and
+        ``AuthenticationMiddleware``, so building the key loads the (lazy)
+        ``request.user`` from the session. """
+
+    def setUp(self):
+        self.cache = locmem_cache()
+        self.calls = []
+
+    def request(self, view):
+        request = factory.get("/foo")
+        SessionMiddleware().process_request(request)
+        AuthenticationMiddleware().process_request(request)
+        response = view(request)
+        return SessionMiddleware().process_response(request, response)
+
+    def test_hit(self):
+        @ResponseCache(cache=self.cache)
+        def view(request):
+            self.calls.append(1)
+            return HttpResponse("hello")
+        self.request(view)
+        response = self.request(view)
+        self.assertEqual(self.calls, [1])
+        self.assertEqual(response.content, "hello")
+        self.assertIn("Cookie", response["Vary"])
+
+    def test_view_using_session_not_cached(self):
+        @ResponseCache(cache=self.cache)
+        def view(request):
+            self.calls.append(1)
+            return HttpResponse(request.session.get("name", "anon"))
+        self.request(view)
+        response = self.request(view)
+        self.assertEqual(self.calls, [1, 1])
+        self.assertIn("Cookie", response["Vary"])
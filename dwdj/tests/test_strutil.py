@@ -0,0 +1,138 @@
+import random
+
+from nose.plugins.skip import SkipTest
+from nose.tools import assert_equal, raises
+from django.utils.safestring import SafeText, SafeBytes
+
+from ..strutil import (
+    to_str, to_unicode, to_str_many, to_unicode_many, to_base, BaseCodec,
+    BASE36_ALPHABET, numpy,
+)
+
+
+class MyUnicode(unicode):
+    pass
+
+class MyStr(str):
+    def __str__(self):
+        return "my:" + self
+
+class WithUnicode(object):
+    def __unicode__(self):
+        return u"\u1234"
+
+class OldStyle:
+    def __str__(self):
+        return "old"
+
+
+OBJS = [
+    "\xe1\x88\xb4", "\xff", u"\u1234", 42, None, [u"\u1234"],
+    Exception(u"\u1234"), MyUnicode(u"\u1234"), MyStr("\xff"),
+    SafeText(u"\u1234"), SafeBytes("\xe1\x88\xb4"), WithUnicode(),
+    OldStyle(),
+]
+
+
+def check_many(convert_many, convert):
+    expected = [convert(obj) for obj in OBJS]
+    actual = list(convert_many(OBJS))
+    assert_equal(actual, expected)
+    assert_equal([type(x) for x in actual], [type(x) for x in expected])
+
+
+def test_to_str_many_matches_to_str():
+    check_many(to_str_many, to_str)
+
+
+def test_to_unicode_many_matches_to_unicode():
+    check_many(to_unicode_many, to_unicode)
+
+
+ALPHABETS = [
+    "01",
+    "0123456789abcdef",
+    BASE36_ALPHABET,
+    BASE36_ALPHABET + "ABCDEFGHIJKLMNOPQRSTUVWXYZ",
+    "zyxwvutsrq",
+]
+
+def numbers_for(base):
+    rand = random.Random(base)
+    numbers = [0, 1, base - 1, base, base + 1, base ** 2 - 1, base ** 2,
+               base ** 3 + 1, 2 ** 62 - 1, 2 ** 64]
+    return numbers + [rand.getrandbits(rand.randint(1, 70)) for _ in range(50)]
+
+
+def test_base_codec_matches_to_base():
+    for alphabet in ALPHABETS:
+        for chunk_digits in [1, 2, 3]:
+            codec = BaseCodec(alphabet, chunk_digits=chunk_digits)
+            numbers = numbers_for(len(alphabet))
+            encoded = list(codec.encode_many(numbers))
+            expected = [
+                to_base(n, alphabet) if n else alphabet[0] for n in numbers
+            ]
+            assert_equal((alphabet, chunk_digits, encoded),
+                         (alphabet, chunk_digits, expected))
+            assert_equal(list(codec.decode_many(encoded)), numbers)
+
+
+def test_base_codec_width():
+    codec = BaseCodec("0123456789abcdef", width=4)
+    numbers = sorted(numbers_for(16)[:7])
+    encoded = [codec.encode(n) for n in numbers]
+    assert all(len(x) == 4 for x in encoded)
+    assert_equal(encoded, sorted(encoded))
+    assert_equal([codec.decode(x) for x in encoded], numbers)
+
+
+@raises(ValueError)
+def test_base_codec_too_wide():
+    BaseCodec("0123456789abcdef", width=4).encode(16 ** 4)
+
+
+@raises(ValueError)
+def test_base_codec_negative():
+    BaseCodec(BASE36_ALPHABET).encode(-1)
+
+
+@raises(ValueError)
+def test_base_codec_invalid_digits():
+    BaseCodec("zyxwvutsrq").decode("zya")
+
+
+def test_base_codec_rejects_what_int_accepts():
+    # The ``int`` fast path and the lookup tables reject the same strings
+    for alphabet in [BASE36_ALPHABET, "0123456789abcdef", "fedcba9876543210"]:
+        codec = BaseCodec(alphabet)
+        invalid = ["", "-1", "+1", " 1f ", "1f\n", "1F"]
+        if "x" not in alphabet:
+            invalid.append("0x1f")
+        for encoded in invalid:
+            try:
+                codec.decode(encoded)
+            except ValueError:
+                pass
+            else:
+                raise AssertionError("%r accepted %r" %(alphabet, encoded))
+
+
+def test_base_codec_invalid_alphabet():
+    for alphabet in ["", "0", "0120"]:
+        try:
+            BaseCodec(alphabet)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("%r was accepted" %(alphabet, ))
+
+
+def test_base_codec_numpy():
+    if numpy is None:
+        raise SkipTest("numpy isn't installed")
+    for width in [None, 12]:
+        codec = BaseCodec(BASE36_ALPHABET, width=width)
+        numbers = [0, 35, 36, 2 ** 62 - 1]
+        assert_equal(list(codec.encode_many(numpy.array(numbers))),
+                     [codec.encode(n) for n in numbers])
@@ -1,9 +1,12 @@
-from django.test import TestCase
-from django.db import transaction
+from django.test import TestCase, TransactionTestCase
+from django.db import transaction, DatabaseError
 
 from helper_project.models import HelperModel
 
-from ..transaction import table_lock
+from ..transaction import (
+    table_lock, lock_objects, claim_batch, signal_lock_acquired,
+    signal_lock_released, chunked_atomic,
+)
 
 class TableLockTestCase(TestCase):
     def test_table_lock_no_transaction(self):
@@ -14,3 +17,104 @@ class TableLockTestCase(TestCase):
         with transaction.atomic():
             with table_lock(HelperModel, "EXCLUSIVE"):
                 pass
+
+    def test_table_lock_timing(self):
+        released = []
+        def handler(sender, lock, wait_time, held_time, **kwargs):
+            released.append((sender, lock, wait_time, held_time))
+        signal_lock_released.connect(handler)
+        try:
+            lock = table_lock(HelperModel, "EXCLUSIVE", timeout=1, nowait=True)
+            with lock:
+                HelperModel.objects.create(number=1)
+        finally:
+            signal_lock_released.disconnect(handler)
+        self.assertEqual(released, [
+            (table_lock, lock, lock.wait_time, lock.held_time),
+        ])
+        self.assertEqual(lock.attempts, 1)
+        assert lock.wait_time >= 0 and lock.held_time >= 0
+
+
+class LockObjectsTestCase(TestCase):
+    def test_lock_objects(self):
+        a = HelperModel.objects.create(number=1)
+        b = HelperModel.objects.create(number=2)
+        HelperModel.objects.filter(id=b.id).update(number=3)
+        missing = HelperModel(id=b.id + 1, number=4)
+        with transaction.atomic():
+            locked = lock_objects([b, a, missing])
+        self.assertEqual([x and x.number for x in locked], [3, 1, None])
+
+    def test_claim_batch(self):
+        for num in range(5):
+            HelperModel.objects.create(number=num)
+        waits = []
+        def handler(sender, wait_time, **kwargs):
+            waits.append(wait_time)
+        signal_lock_acquired.connect(handler)
+        try:
+            with transaction.atomic():
+                qs = HelperModel.objects.order_by("number")
+                batch = claim_batch(qs, 3)
+        finally:
+            signal_lock_acquired.disconnect(handler)
+        self.assertEqual([x.number for x in batch], [0, 1, 2])
+        self.assertEqual(len(waits), 1)
+
+
+class SerializationFailure(DatabaseError):
+    pgcode = "40001"
+
+class Deadlock(DatabaseError):
+    pgcode = "40P01"
+
+def fail_once(num, exc):
+    """ Returns a ``func`` for ``chunked_atomic`` which creates a
+        ``HelperModel`` and raises ``exc`` the first time it sees ``num``. """
+    failures = [num]
+    def create(num):
+        HelperModel.objects.create(number=num)
+        if num == failures[0]:
+            failures[0] = None
+            raise exc()
+    return create
+
+class ChunkedAtomicTestCase(TestCase):
+    def test_chunked_atomic(self):
+        def create(num):
+            HelperModel.objects.create(number=num)
+        chunk_rows = [
+            stats.chunk_rows for stats in
+            chunked_atomic(range(10), create, chunk_size=4)
+        ]
+        self.assertEqual(chunk_rows, [4, 4, 2])
+        self.assertEqual(HelperModel.objects.count(), 10)
+
+    def test_nested_deadlock_retried(self):
+        create = fail_once(3, Deadlock)
+        results = [
+            (stats.chunks, stats.rows, stats.retries) for stats in
+            chunked_atomic(range(6), create, chunk_size=4, backoff=0)
+        ]
+        self.assertEqual(results, [(1, 4, 1), (2, 6, 1)])
+
+    def test_nested_serialization_failure_raised(self):
+        create = fail_once(3, SerializationFailure)
+        with self.assertRaises(SerializationFailure):
+            list(chunked_atomic(range(6), create, chunk_size=4, backoff=0))
+
+
+class ChunkedAtomicTransactionTestCase(TransactionTestCase):
+    def test_chunked_atomic_retry(self):
+        create = fail_once(3, SerializationFailure)
+        results = [
+            (stats.chunks, stats.rows, stats.retries) for stats in
+            chunked_atomic(range(6), create, chunk_size=4, backoff=0)
+        ]
+        # The failed chunk is retried with only the items it had processed
+        self.assertEqual(results, [(1, 4, 1), (2, 6, 1)])
+        self.assertEqual(
+            sorted(HelperModel.objects.values_list("number", flat=True)),
+            range(6),
+        )
@@ -0,0 +1,110 @@
+from mock import patch
+from nose.tools import assert_equal
+
+from ..utils import compile_format, AutoStrMixin, _compiled_formats
+
+
+class Thing(object):
+    name = "thing"
+    number = 42
+    items = ["a", "b"]
+    mapping = {"key": "value"}
+    text = u"\u1234"
+
+    def __init__(self):
+        self.child = self
+
+    def __format__(self, spec):
+        return "<thing:%s>" %(spec, )
+
+
+class Slotted(object):
+    __slots__ = ["name"]
+
+    def __init__(self):
+        self.name = "slotted"
+
+
+FORMATS = [
+    "",
+    "plain text",
+    "{{escaped}} {self.name}",
+    "{self.name!r} {self.name!s}",
+    "{self.number:>8} {self.number:x} {self.number:08.3f}",
+    "{self.items[0]} {self.items[1]!r} {self.mapping[key]}",
+    "{self.child.child.name}",
+    "{self} {self:spec}",
+    "{self.name} {self.name} {self.number}",
+    "{self.number:{self.number}}",
+    u"{self.text} {self.mapping[key]} {self.name}",
+]
+
+
+def test_compile_format_matches_format():
+    obj = Thing()
+    for fmt in FORMATS:
+        expected = fmt.format(self=obj)
+        actual = compile_format(fmt)(obj)
+        assert_equal((fmt, actual, type(actual)),
+                     (fmt, expected, type(expected)))
+
+
+def test_compile_format_slots():
+    fmt = "{self.name!r}"
+    assert_equal(compile_format(fmt)(Slotted()), fmt.format(self=Slotted()))
+
+
+def test_compile_format_errors():
+    for fmt in ["{self.missing}", "{self.items[5]}", "{other}", "{self"]:
+        try:
+            fmt.format(self=Thing())
+        except Exception as e:
+            expected = type(e)
+        try:
+            compile_format(fmt)(Thing())
+        except Exception as e:
+            assert_equal((fmt, type(e)), (fmt, expected))
+        else:
+            raise AssertionError("%r didn't raise %r" %(fmt, expected))
+
+
+class Named(AutoStrMixin):
+    __autostr__ = "class:{self.name}"
+
+    def __init__(self, name):
+        self.name = name
+
+
+def test_autostr_instance_override():
+    obj = Named("foo")
+    assert_equal(str(obj), "class:foo")
+    obj.__autostr__ = "instance:{self.name}"
+    assert_equal(str(obj), "instance:foo")
+    assert_equal(str(Named("bar")), "class:bar")
+
+
+def test_autostr_class_reassigned():
+    class Renamed(Named):
+        pass
+    obj = Renamed("foo")
+    assert_equal(str(obj), "class:foo")
+    Renamed.__autostr__ = "renamed:{self.name}"
+    assert_equal(str(obj), "renamed:foo")
+    assert_equal(str(Named("bar")), "class:bar")
+
+
+def test_autostr_empty_format():
+    obj = Named("foo")
+    obj.__autostr__ = ""
+    assert_equal(str(obj), "")
+    class Empty(AutoStrMixin):
+        __autorepr__ = ""
+    assert repr(Empty()).startswith("<%s.Empty  at 0x" %(__name__, ))
+
+
+def test_compiled_formats_bounded():
+    with patch("dwdj.utils._compiled_formats_max", 10):
+        for i in range(25):
+            fmt = "{self.name} %s" %(i, )
+            assert_equal(compile_format(fmt)(Named("x")), "x %s" %(i, ))
+            assert len(_compiled_formats) <= 10, len(_compiled_formats)
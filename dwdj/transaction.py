@@ -1,6 +1,110 @@
-from django.db import connections, DEFAULT_DB_ALIAS, transaction
+import sys
+import time
+import struct
+import hashlib
+from contextlib import contextmanager
 
-class table_lock(object):
+from django.dispatch import Signal
+from django.db import (
+    connections, DEFAULT_DB_ALIAS, transaction, router, DatabaseError,
+)
+from django.db.transaction import TransactionManagementError
+
+signal_lock_acquired = Signal(providing_args=["lock", "wait_time"])
+signal_lock_released = Signal(providing_args=["lock", "wait_time", "held_time"])
+
+
+class LockNotAcquired(Exception):
+    """ Raised when a lock can't be acquired without waiting (or within its
+        timeout). """
+
+
+def pgcode(exc):
+    """ Returns the PostgreSQL error code (``SQLSTATE``) of ``exc`` (a
+        database error, possibly wrapped by Django), or ``None``. """
+    code = getattr(exc, "pgcode", None)
+    if code is None:
+        code = getattr(getattr(exc, "__cause__", None), "pgcode", None)
+    return code
+
+# lock_not_available: raised by NOWAIT locks and when lock_timeout expires
+PG_LOCK_NOT_AVAILABLE = "55P03"
+
+
+@contextmanager
+def lock_timeout(cursor, timeout):
+    """ Sets PostgreSQL's ``lock_timeout`` to ``timeout`` seconds for the
+        current transaction, restoring the previous value on exit. """
+    cursor.execute("SELECT current_setting('lock_timeout')")
+    old_timeout = cursor.fetchone()[0]
+    cursor.execute("SELECT set_config('lock_timeout', %s, true)",
+                   ["%dms" %(max(timeout * 1000, 1), )])
+    try:
+        yield
+    finally:
+        cursor.execute("SELECT set_config('lock_timeout', %s, true)",
+                       [old_timeout])
+
+
+class TimedLock(object):
+    """ Base class for lock context managers which acquire their lock inside
+        a transaction (starting one if necessary) and record how long they
+        waited for it (``wait_time``) and held it (``held_time``, until the
+        context manager exits; note that transaction-level locks are only
+        released when the outermost transaction ends).
+
+        ``signal_lock_acquired`` and ``signal_lock_released`` are sent (with
+        the lock's class as the sender) so these times can be collected. """
+
+    def __init__(self, using=None):
+        self.using = using
+        self.cxn = None
+        self.txn = None
+        self.wait_time = None
+        self.held_time = None
+
+    def acquire(self, cursor):
+        """ Acquires the lock. Must be implemented by subclasses. """
+        raise NotImplementedError()
+
+    def __enter__(self):
+        assert self.cxn is None, "lock already acquired"
+        self.cxn = transaction.get_connection(self.using)
+        if not self.cxn.in_atomic_block:
+            self.txn = transaction.atomic(using=self.using)
+            self.txn.__enter__()
+        self.cur = self.cxn.cursor()
+        wait_start = time.time()
+        try:
+            self.acquire(self.cur)
+        except:
+            exc = sys.exc_info()
+            self._end_transaction(exc)
+            raise exc[0], exc[1], exc[2]
+        self._held_start = time.time()
+        self.wait_time = self._held_start - wait_start
+        signal_lock_acquired.send(
+            sender=type(self), lock=self, wait_time=self.wait_time,
+        )
+        return self
+
+    def __exit__(self, *exc):
+        self.held_time = time.time() - self._held_start
+        self._end_transaction(exc)
+        signal_lock_released.send(
+            sender=type(self), lock=self, wait_time=self.wait_time,
+            held_time=self.held_time,
+        )
+
+    def _end_transaction(self, exc):
+        txn = self.txn
+        self.cxn = None
+        self.txn = None
+        if txn is not None:
+            txn.__exit__(*exc)
+
+
+class table_lock(TimedLock):
     """ A context manager for PostgreSQL table locking::
 
         with table_lock(models.BankAccount, "EXCLUSIVE"):
@@ -10,6 +114,19 @@ class table_lock(object):
             b.balance -= 100
             a.save()
             b.save()
+
+        If ``timeout`` (in seconds) is given, or ``nowait`` is true, and the
+        lock can't be acquired in time, the attempt is retried up to
+        ``retries`` times (sleeping ``backoff``, ``backoff * 2``, ... seconds
+        between attempts) before ``LockNotAcquired`` is raised.
+
+        The time spent waiting for and holding the lock is recorded (see
+        ``TimedLock``).
+
+        SQLite doesn't have table locks, so for modes which conflict with
+        writes (``SHARE`` and stronger) the database's write lock is taken
+        instead, and weaker modes are no-ops. This is mostly useful for
+        tests.
     """
 
     LOCK_MODES = set([
@@ -23,26 +140,316 @@ class table_lock(object):
         "ACCESS EXCLUSIVE",
     ])
 
-    def __init__(self, model, mode, using=None):
+    SQLITE_WRITE_LOCK_MODES = set([
+        "SHARE",
+        "SHARE ROW EXCLUSIVE",
+        "EXCLUSIVE",
+        "ACCESS EXCLUSIVE",
+    ])
+
+    def __init__(self, model, mode, using=None, timeout=None, nowait=False,
+                 retries=0, backoff=0.1):
         if mode.upper() not in self.LOCK_MODES:
             raise ValueError("invalid lock mode: %r" %(mode, ))
+        super(table_lock, self).__init__(using=using)
         self.model = model
         self.mode = mode
-        self.using = using
-        self.cxn = None
-        self.txn = None
+        self.timeout = timeout
+        self.nowait = nowait
+        self.retries = retries
+        self.backoff = backoff
+        self.attempts = 0
 
-    def __enter__(self):
-        assert self.cxn is None, "lock already acquired"
-        self.cxn = transaction.get_connection(self.using)
-        if not self.cxn.in_atomic_block:
-            self.txn = transaction.atomic(using=self.using)
-            self.txn.__enter__()
-        self.cur = self.cxn.cursor()
-        self.cur.execute("LOCK TABLE %s IN %s MODE" %(
-            self.model._meta.db_table, self.mode,
-        ))
+    def acquire(self, cursor):
+        table = self.model._meta.db_table
+        if self.cxn.vendor == "sqlite":
+            if self.mode.upper() not in self.SQLITE_WRITE_LOCK_MODES:
+                return
+            # A write (even one which doesn't change anything) takes SQLite's
+            # database-wide RESERVED lock, which blocks other writers.
+            sql = "DELETE FROM %s WHERE 0" %(self.cxn.ops.quote_name(table), )
+        else:
+            sql = "LOCK TABLE %s IN %s MODE%s" %(
+                table, self.mode, self.nowait and " NOWAIT" or "",
+            )
+        if self.timeout is None and not self.nowait:
+            self.attempts = 1
+            cursor.execute(sql)
+            return
 
-    def __exit__(self, *exc):
-        if self.txn is not None:
-            self.txn.__exit__(*exc)
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+            self.attempts = attempt + 1
+            try:
+                self._try_acquire(cursor, sql)
+                return
+            except DatabaseError as e:
+                if not self._is_lock_not_available(e):
+                    raise
+        raise LockNotAcquired("could not lock %s in %s mode after %s attempts"
+                              %(table, self.mode, self.attempts))
+
+    def _try_acquire(self, cursor, sql):
+        if self.cxn.vendor == "sqlite" or self.timeout is None:
+            with transaction.atomic(using=self.using):
+                cursor.execute(sql)
+            return
+        with lock_timeout(cursor, self.timeout):
+            with transaction.atomic(using=self.using):
+                cursor.execute(sql)
+
+    def _is_lock_not_available(self, exc):
+        if self.cxn.vendor == "sqlite":
+            return "locked" in str(exc)
+        return pgcode(exc) == PG_LOCK_NOT_AVAILABLE
+
+
+def advisory_lock_key(key):
+    """ Returns the signed 64 bit integer PostgreSQL advisory lock key for
+        ``key``, which may be an integer or a string (which is hashed)::
+
+        >>> advisory_lock_key(42)
+        42
+        >>> advisory_lock_key("foo")
+        -5999611798422882212
+        >>> advisory_lock_key(u"foo") == advisory_lock_key("foo")
+        True
+    """
+    if isinstance(key, (int, long)):
+        if not -2 ** 63 <= key < 2 ** 63:
+            raise ValueError("advisory lock keys must fit in 64 bits: %r"
+                             %(key, ))
+        return key
+    if isinstance(key, unicode):
+        key = key.encode("utf-8")
+    return struct.unpack("!q", hashlib.md5(key).digest()[:8])[0]
+
+
+class advisory_lock(TimedLock):
+    """ A context manager for PostgreSQL transaction-level advisory locks,
+        which lock an application-defined ``key`` (an integer or a string;
+        see ``advisory_lock_key``) instead of a table or rows::
+
+            with advisory_lock("account:%s" %(account.id, )):
+                ...
+
+        The lock is released when the transaction ends (a transaction is
+        started if necessary, as with ``table_lock``).
+
+        If ``shared`` is true a shared lock is taken instead of an exclusive
+        one. If ``wait`` is false (a "try lock") or ``timeout`` (in seconds)
+        expires before the lock can be acquired, ``LockNotAcquired`` is
+        raised.
+    """
+
+    def __init__(self, key, shared=False, wait=True, timeout=None, using=None):
+        super(advisory_lock, self).__init__(using=using)
+        self.key = key
+        self.lock_key = advisory_lock_key(key)
+        self.shared = shared
+        self.wait = wait
+        self.timeout = timeout
+
+    def acquire(self, cursor):
+        suffix = self.shared and "_shared" or ""
+        if not self.wait:
+            cursor.execute("SELECT pg_try_advisory_xact_lock%s(%%s)" %(suffix, ),
+                           [self.lock_key])
+            if not cursor.fetchone()[0]:
+                raise LockNotAcquired("advisory lock %r is held" %(self.key, ))
+            return
+        sql = "SELECT pg_advisory_xact_lock%s(%%s)" %(suffix, )
+        if self.timeout is None:
+            cursor.execute(sql, [self.lock_key])
+            return
+        with lock_timeout(cursor, self.timeout):
+            try:
+                with transaction.atomic(using=self.using):
+                    cursor.execute(sql, [self.lock_key])
+            except DatabaseError as e:
+                if pgcode(e) != PG_LOCK_NOT_AVAILABLE:
+                    raise
+                raise LockNotAcquired(
+                    "timeout acquiring advisory lock %r after %ss"
+                    %(self.key, self.timeout)
+                )
+
+
+def claim_batch(queryset, size, using=None):
+    """ Locks and returns up to ``size`` rows from ``queryset`` with ``SELECT
+        ... FOR UPDATE SKIP LOCKED``, so concurrent workers consuming a
+        queue-style table each get different rows instead of waiting on each
+        other::
+
+            pending = Job.objects.filter(done=False).order_by("id")
+            with transaction.atomic():
+                for job in claim_batch(pending, 100):
+                    ...
+
+        Must be called inside a transaction; rows stay locked until it ends.
+        On databases which don't support row locks (ex, SQLite) the rows are
+        returned without being locked. ``signal_lock_acquired`` is sent with
+        ``sender=claim_batch``. """
+    using = using or queryset.db
+    cxn = connections[using]
+    if not cxn.in_atomic_block:
+        raise TransactionManagementError(
+            "claim_batch must be called inside a transaction",
+        )
+    start = time.time()
+    queryset = queryset.using(using)
+    if not cxn.features.has_select_for_update:
+        rows = list(queryset[:size])
+    else:
+        try:
+            rows = list(queryset.select_for_update(skip_locked=True)[:size])
+        except TypeError:
+            # Django < 1.11 doesn't support skip_locked
+            query = queryset[:size].query
+            sql, params = query.get_compiler(using).as_sql()
+            manager = queryset.model._default_manager.db_manager(using)
+            rows = list(manager.raw(sql + " FOR UPDATE SKIP LOCKED", params))
+    signal_lock_acquired.send(
+        sender=claim_batch, lock=queryset, wait_time=time.time() - start,
+    )
+    return rows
+
+
+def lock_objects(objs, using=None, nowait=False):
+    """ Locks the rows of the model instances ``objs`` with ``SELECT ... FOR
+        UPDATE``, always in the same order (by table name, then primary key)
+        so concurrent callers locking overlapping rows can't deadlock, and
+        returns fresh copies of ``objs`` (in the same order; ``None`` for rows
+        which no longer exist)::
+
+            with transaction.atomic():
+                a, b = lock_objects([account_a, account_b])
+                a.balance += 100
+                b.balance -= 100
+                a.save()
+                b.save()
+
+        Must be called inside a transaction. ``signal_lock_acquired`` is sent
+        with ``sender=lock_objects``. """
+    objs = list(objs)
+    pks_by_model = {}
+    for obj in objs:
+        pks_by_model.setdefault(type(obj), set()).add(obj.pk)
+    start = time.time()
+    locked = {}
+    for model in sorted(pks_by_model, key=lambda m: m._meta.db_table):
+        db = using or router.db_for_write(model)
+        rows = (
+            model._default_manager.using(db)
+            .select_for_update(nowait=nowait)
+            .filter(pk__in=pks_by_model[model])
+            .order_by("pk")
+        )
+        for row in rows:
+            locked[(model, row.pk)] = row
+    signal_lock_acquired.send(
+        sender=lock_objects, lock=objs, wait_time=time.time() - start,
+    )
+    return [locked.get((type(obj), obj.pk)) for obj in objs]
+
+
+PG_SERIALIZATION_FAILURE = "40001"
+PG_DEADLOCK_DETECTED = "40P01"
+
+# The transaction can be retried
+RETRYABLE_PGCODES = set([PG_SERIALIZATION_FAILURE, PG_DEADLOCK_DETECTED])
+
+
+class ChunkStats(object):
+    """ Progress of a ``chunked_atomic`` run. """
+
+    def __init__(self):
+        self.start = time.time()
+        self.chunks = 0
+        self.rows = 0
+        self.retries = 0
+        self.chunk_rows = 0
+        self.chunk_time = 0.0
+
+    @property
+    def elapsed(self):
+        return time.time() - self.start
+
+    @property
+    def rows_per_second(self):
+        elapsed = self.elapsed
+        return elapsed and self.rows / elapsed or 0.0
+
+    def __repr__(self):
+        return "<ChunkStats chunks=%s rows=%s retries=%s rows/s=%.1f>" %(
+            self.chunks, self.rows, self.retries, self.rows_per_second,
+        )
+
+
+def chunked_atomic(items, func, chunk_size=1000, chunk_time=None,
+                   using=None, retries=3, backoff=0.1):
+    """ Calls ``func(item)`` for each of ``items``, in a separate transaction
+        (or a savepoint, if called inside a transaction) for every
+        ``chunk_size`` items or ``chunk_time`` seconds, so long-running bulk
+        writes don't hold locks for the whole run, and a failure only rolls
+        back the current chunk.
+
+        If a chunk fails with a serialization failure or deadlock it is
+        rolled back and retried (up to ``retries`` times, sleeping
+        ``backoff``, ``backoff * 2``, ... seconds between attempts), so
+        ``func`` must be safe to call again for the items of a failed chunk.
+        Inside an outer transaction, serialization failures are re-raised
+        immediately: retrying from a savepoint would reuse the outer
+        transaction's snapshot and fail again, so only the whole outer
+        transaction can be retried.
+
+        Yields a ``ChunkStats`` after each chunk is committed::
+
+            def save_row(row):
+                Thing.objects.create(**row)
+
+            for stats in chunked_atomic(read_csv(f), save_row, chunk_size=500):
+                log.info("imported %s rows (%.0f/s)", stats.rows,
+                         stats.rows_per_second)
+    """
+    items = iter(items)
+    stats = ChunkStats()
+    retryable = RETRYABLE_PGCODES
+    if transaction.get_connection(using).in_atomic_block:
+        retryable = retryable - set([PG_SERIALIZATION_FAILURE])
+    exhausted = False
+    while not exhausted:
+        chunk = []
+        for attempt in range(retries + 1):
+            if attempt:
+                stats.retries += 1
+                time.sleep(backoff * 2 ** (attempt - 1))
+            chunk_start = time.time()
+            try:
+                with transaction.atomic(using=using):
+                    # Retries re-run the items from the failed attempt
+                    for item in chunk:
+                        func(item)
+                    if attempt == 0:
+                        for item in items:
+                            chunk.append(item)
+                            func(item)
+                            if len(chunk) >= chunk_size:
+                                break
+                            if (chunk_time is not None and
+                                    time.time() - chunk_start >= chunk_time):
+                                break
+                        else:
+                            exhausted = True
+                break
+            except DatabaseError as e:
+                if attempt == retries or pgcode(e) not in retryable:
+                    raise
+        if not chunk:
+            break
+        stats.chunks += 1
+        stats.rows += len(chunk)
+        stats.chunk_rows = len(chunk)
+        stats.chunk_time = time.time() - chunk_start
+        yield stats
@@ -1,6 +1,89 @@
+import operator
+
 from django.template.defaultfilters import slugify
 
 
+# Cleared when it grows past ``_compiled_formats_max`` entries, so format
+# strings built at runtime can't grow it without bound.
+_compiled_formats = {}
+_compiled_formats_max = 1000
+
+def compile_format(fmt):
+    """ Returns a function which is equivalent to
+        ``lambda self: fmt.format(self=self)``, but faster: the format string
+        is only parsed once, and fields like ``{self.foo.bar!r}`` are
+        rewritten to positional fields which are fetched with
+        ``operator.attrgetter`` (which also works with ``__slots__``).
+        Compiled functions are cached, so this is cheap to call repeatedly.
+
+        Format strings which can't be rewritten (ex, because they use nested
+        fields or positional arguments) fall back to ``fmt.format``.
+
+        >>> class Person(object):
+        ...     name = "Alex"
+        ...     pets = ["Sam"]
+        ...
+        >>> fmtfunc = compile_format("{self.name!r} {{has}} {self.pets[0]:>4}")
+        >>> fmtfunc(Person())
+        "'Alex' {has}  Sam"
+        >>> compile_format(u"{self.name}")(Person())
+        u'Alex'
+        """
+    key = (type(fmt), fmt)
+    try:
+        return _compiled_formats[key]
+    except KeyError:
+        pass
+    if len(_compiled_formats) >= _compiled_formats_max:
+        _compiled_formats.clear()
+    result = _compiled_formats[key] = _compile_format(fmt)
+    return result
+
+def _compile_format(fmt):
+    fallback = lambda self: fmt.format(self=self)
+    try:
+        parsed = list(fmt._formatter_parser())
+    except ValueError:
+        # Let the error be raised when the format is used, as it would be if
+        # it wasn't compiled.
+        return fallback
+    new_fmt = []
+    getters = []
+    getter_idxs = {}
+    for literal, field, spec, conversion in parsed:
+        new_fmt.append(literal.replace("{", "{{").replace("}", "}}"))
+        if field is None:
+            continue
+        if field != "self" and not field.startswith(("self.", "self[")):
+            return fallback
+        if spec and "{" in spec:
+            return fallback
+        path = field[len("self"):]
+        index_start = path.find("[")
+        if index_start >= 0:
+            path, index = path[:index_start], path[index_start:]
+        else:
+            index = ""
+        attr = path.lstrip(".")
+        if attr not in getter_idxs:
+            getter_idxs[attr] = len(getters)
+            getters.append(attr and operator.attrgetter(attr) or None)
+        new_fmt.append("{%s%s%s%s}" %(
+            getter_idxs[attr],
+            index,
+            conversion and "!" + conversion or "",
+            spec and ":" + spec or "",
+        ))
+    new_fmt = type(fmt)("").join(new_fmt)
+
+    if len(getters) == 1:
+        getter = getters[0] or (lambda self: self)
+        return lambda self: new_fmt.format(getter(self))
+    getters = [g or (lambda self: self) for g in getters]
+    return lambda self: new_fmt.format(*[g(self) for g in getters])
+
+
+
 class AutoStrMixin(object):
     """ Allows string fields ``__autostr__``, ``__autounicode__`` and
         ``__autorepr__`` to be used to implement ``__str__``, ``__unicode__``
@@ -26,13 +109,19 @@ class AutoStrMixin(object):
             'name: wolever'
             >>> repr(foo)
             "<__main__.Foo name=u'wolever' at 0x...>"
+
+        Format strings are compiled (and cached, keyed on the format string)
+        with ``compile_format``, so they can be changed on the class or
+        overridden on an instance.
         """
 
+    __slots__ = ()
+
     def _autostr_helper(self, method, default):
         formatstr = getattr(self, "__auto%s__" %(method, ), None)
         if formatstr is None:
             return default()
-        return formatstr.format(self=self)
+        return compile_format(formatstr)(self)
 
     def __unicode__(self):
         default = lambda: unicode(repr(self))
@@ -52,8 +141,9 @@ class AutoStrMixin(object):
 
 
 def _autofmthelper(name, fmt, postprocess=None):
+    compiled = compile_format(fmt)
     def fmtfunc(self):
-        result = fmt.format(self=self)
+        result = compiled(self)
         if postprocess is not None:
             result = postprocess(self, result)
         return result